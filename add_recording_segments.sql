@@ -0,0 +1,24 @@
+-- Time-aligned transcript index: one row per Whisper segment of a recording
+-- Run this in your Supabase SQL editor or database admin tool
+
+CREATE TABLE IF NOT EXISTS recording_segments (
+    recording_id UUID NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    segment_index INTEGER NOT NULL,
+    start_seconds REAL NOT NULL,
+    end_seconds REAL NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (recording_id, segment_index)
+);
+
+-- Time-range lookups within a recording
+CREATE INDEX IF NOT EXISTS idx_recording_segments_time ON recording_segments(recording_id, start_seconds);
+
+-- Phrase lookups (ILIKE '%phrase%') without scanning every segment's text
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_recording_segments_text_trgm ON recording_segments USING GIN (text gin_trgm_ops);
+
+-- Verify the table was created
+SELECT column_name, data_type, is_nullable 
+FROM information_schema.columns 
+WHERE table_name = 'recording_segments' 
+ORDER BY ordinal_position;
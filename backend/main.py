@@ -1,17 +1,55 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import heapq
+import hashlib
+import inspect
+import json
 import logging
+import math
+import mimetypes
+import multiprocessing
 import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
 import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field as dataclass_field
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, List
+from typing import Awaitable, Callable, Optional, List, Tuple
 
+import numpy as np
 import openai
-from fastapi import FastAPI, File, HTTPException, UploadFile, Form, Query
+from fastapi import FastAPI, File, HTTPException, UploadFile, Form, Query, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import ClientDisconnect
 from supabase import Client, create_client
 from dotenv import load_dotenv
 
+import pdf_text
+
+try:
+    from faster_whisper import WhisperModel
+except ImportError:  # optional: only needed for local CPU transcription
+    WhisperModel = None
+
+try:
+    import tiktoken
+except ImportError:  # optional: without it token counts are estimated from the text length
+    tiktoken = None
+
 # Load environment variables
 load_dotenv()
 
@@ -21,6 +59,10 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="AI Clinic Assistant", version="1.0.0")
 
+# Idempotency-Key handling (see IDEMPOTENCY KEYS). Added before CORS so CORS wraps it and
+# replayed responses get CORS headers too; the lambda looks the dispatcher up per request.
+app.add_middleware(BaseHTTPMiddleware, dispatch=lambda request, call_next: idempotency_keys(request, call_next))
+
 # Enable CORS for mobile app
 app.add_middleware(
     CORSMiddleware,
@@ -41,200 +83,1395 @@ if not all([SUPABASE_URL, SUPABASE_KEY, OPENAI_API_KEY]):
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 openai.api_key = OPENAI_API_KEY
+openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+# The Supabase client is synchronous, so queries run on a dedicated thread pool
+# instead of blocking the event loop (and instead of competing for the default executor).
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "16"))
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase")
+
+async def db_execute(query):
+    """Run a Supabase query builder's execute() off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, query.execute)
+
+async def run_subprocess(cmd: List[str]) -> bytes:
+    """Run an external command (ffmpeg/ffprobe) without blocking the event loop.
+
+    Returns stdout and raises subprocess.CalledProcessError on a non-zero exit, like
+    subprocess.run(..., check=True).
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, output=stdout, stderr=stderr)
+    return stdout
+
+# ffmpeg/ffprobe work (probing, audio extraction, decoding, chunk encoding) runs in a fixed
+# number of transcoding slots, so a burst of uploads can't fill every core and /tmp at once.
+# New uploads wait in a bounded queue; once it is full they are turned away with 429 and a
+# Retry-After estimate. Background jobs were already admitted by the job queue and always wait.
+TRANSCODE_SLOTS = int(os.getenv("TRANSCODE_SLOTS", str(max(2, (os.cpu_count() or 2) // 2))))
+TRANSCODE_QUEUE_LIMIT = int(os.getenv("TRANSCODE_QUEUE_LIMIT", "8"))
+transcode_can_wait: contextvars.ContextVar = contextvars.ContextVar("transcode_can_wait", default=False)
+
+class TranscodePool:
+    """Fixed transcoding slots with a bounded wait queue and usage metrics."""
+
+    def __init__(self, slots: int, queue_limit: int):
+        self.slots = max(1, slots)
+        self.queue_limit = max(0, queue_limit)
+        self._semaphore = asyncio.Semaphore(self.slots)
+        self.busy = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self._hold_seconds_avg = 0.0
+        self._wait_seconds_max = 0.0
+        self._recent_waits: deque = deque(maxlen=SCHEDULER_WAIT_SAMPLES)
+
+    def retry_after_seconds(self) -> int:
+        """Rough time until a new upload would get a slot, from the average slot hold time."""
+        hold_seconds = self._hold_seconds_avg or 10.0
+        return max(1, min(300, math.ceil(hold_seconds * (self.waiting + 1) / self.slots)))
+
+    def check_admission(self) -> None:
+        """Raise 429 when the wait queue is full (callers that may wait are never rejected)."""
+        if transcode_can_wait.get() or self.busy < self.slots or self.waiting < self.queue_limit:
+            return
+        self.rejected += 1
+        retry_after = self.retry_after_seconds()
+        logger.warning(f"Transcoding queue full ({self.busy} busy, {self.waiting} waiting); rejecting upload")
+        raise HTTPException(
+            status_code=429,
+            detail="Server is busy processing other recordings; please retry shortly",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    @asynccontextmanager
+    async def slot(self, admission: bool = True):
+        """Hold one transcoding slot for the body.
+
+        admission=False is for follow-up work on an upload that already got in (e.g. its
+        chunk encodes), which waits however long the queue is.
+        """
+        if admission:
+            self.check_admission()
+            self.admitted += 1
+        enqueued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - enqueued_at
+        self._wait_seconds_max = max(self._wait_seconds_max, waited)
+        self._recent_waits.append(waited)
+        self.busy += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy -= 1
+            self.completed += 1
+            self._hold_seconds_avg = 0.8 * self._hold_seconds_avg + 0.2 * (time.perf_counter() - started) if self._hold_seconds_avg else time.perf_counter() - started
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        waits = sorted(self._recent_waits)
+        return {
+            "slots": self.slots,
+            "busy": self.busy,
+            "queue_depth": self.waiting,
+            "queue_limit": self.queue_limit,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "hold_seconds_avg": self._hold_seconds_avg,
+            "wait_seconds_max": self._wait_seconds_max,
+            "wait_seconds_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_seconds_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+        }
+
+# Pipeline stages (transcription, LLM summary, LLM extraction) each have a fixed number of
+# slots shared by every request and job. Work carries a priority class ("interactive" for
+# text/PDF consults and user actions, "batch" for audio/video) and a tenant (the patient),
+# set once per pipeline in these context variables and inherited by every task it starts.
+work_class: contextvars.ContextVar = contextvars.ContextVar("work_class", default="interactive")
+work_tenant: contextvars.ContextVar = contextvars.ContextVar("work_tenant", default="default")
+
+SCHEDULER_STAGE_SLOTS = {
+    "transcription": int(os.getenv("SCHEDULER_TRANSCRIPTION_SLOTS", "8")),
+    "summary": int(os.getenv("SCHEDULER_SUMMARY_SLOTS", "4")),
+    "extraction": int(os.getenv("SCHEDULER_EXTRACTION_SLOTS", "4")),
+}
+SCHEDULER_CLASS_WEIGHTS = {
+    "interactive": float(os.getenv("SCHEDULER_INTERACTIVE_WEIGHT", "8")),
+    "batch": float(os.getenv("SCHEDULER_BATCH_WEIGHT", "1")),
+}
+SCHEDULER_WAIT_SAMPLES = 500  # recent waits kept per stage/class for percentiles
+
+class StageScheduler:
+    """Weighted fair queuing of pipeline stage work across priority classes and patients.
+
+    Every (class, tenant) pair is a flow. A request for a slot gets a start tag of
+    max(stage virtual time, the flow's last finish tag), and the flow's finish tag moves
+    on by cost / class weight. Free slots always go to the waiter with the smallest tag,
+    so a short interactive job overtakes a backlog of batch audio without starving it,
+    and one patient's long recording can't monopolize a stage.
+    """
+
+    def __init__(self, stage_slots: dict, class_weights: dict):
+        self.class_weights = class_weights
+        self._free = dict(stage_slots)
+        self._waiters = {stage: [] for stage in stage_slots}
+        self._virtual_time = {stage: 0.0 for stage in stage_slots}
+        self._flow_tags = {stage: {} for stage in stage_slots}
+        self._sequence = 0
+        self._metrics: dict = {}
+
+    def _stage_metrics(self, stage: str, priority_class: str) -> dict:
+        return self._metrics.setdefault((stage, priority_class), {
+            "waiting": 0, "running": 0, "completed": 0,
+            "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            "recent_waits": deque(maxlen=SCHEDULER_WAIT_SAMPLES),
+        })
+
+    @asynccontextmanager
+    async def slot(self, stage: str, cost: float = 1.0):
+        """Hold one slot of `stage` for the body; cost is the expected amount of work (e.g. audio seconds)."""
+        priority_class = work_class.get()
+        flow = (priority_class, work_tenant.get())
+        weight = self.class_weights.get(priority_class, 1.0)
+        flow_tags = self._flow_tags[stage]
+        tag = max(self._virtual_time[stage], flow_tags.get(flow, 0.0))
+        flow_tags[flow] = tag + max(cost, 1e-3) / weight
+        if len(flow_tags) > 1000:
+            # Flows whose finish tag is behind the virtual time have nothing outstanding
+            for idle_flow in [key for key, value in flow_tags.items() if value <= self._virtual_time[stage]]:
+                del flow_tags[idle_flow]
+
+        metrics = self._stage_metrics(stage, priority_class)
+        enqueued_at = time.perf_counter()
+        if self._free[stage] > 0 and not self._waiters[stage]:
+            self._free[stage] -= 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._sequence += 1
+            heapq.heappush(self._waiters[stage], (tag, self._sequence, future))
+            metrics["waiting"] += 1
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release(stage)  # the slot was handed over just as we were cancelled
+                raise
+            finally:
+                metrics["waiting"] -= 1
+
+        waited = time.perf_counter() - enqueued_at
+        metrics["wait_seconds_total"] += waited
+        metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], waited)
+        metrics["recent_waits"].append(waited)
+        metrics["running"] += 1
+        try:
+            yield
+        finally:
+            metrics["running"] -= 1
+            metrics["completed"] += 1
+            self._release(stage)
+
+    def _release(self, stage: str) -> None:
+        waiters = self._waiters[stage]
+        while waiters:
+            tag, _sequence, future = heapq.heappop(waiters)
+            if future.cancelled():
+                continue
+            self._virtual_time[stage] = max(self._virtual_time[stage], tag)
+            future.set_result(None)
+            return
+        self._free[stage] += 1
+
+    def snapshot(self) -> dict:
+        stages = {}
+        for (stage, priority_class), metrics in sorted(self._metrics.items()):
+            waits = sorted(metrics["recent_waits"])
+            stages.setdefault(stage, {"free_slots": self._free[stage], "classes": {}})["classes"][priority_class] = {
+                "queue_depth": metrics["waiting"],
+                "running": metrics["running"],
+                "completed": metrics["completed"],
+                "wait_seconds_avg": metrics["wait_seconds_total"] / max(metrics["completed"] + metrics["running"], 1),
+                "wait_seconds_max": metrics["wait_seconds_max"],
+                "wait_seconds_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_seconds_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+            }
+        return stages
+
+stage_scheduler = StageScheduler(SCHEDULER_STAGE_SLOTS, SCHEDULER_CLASS_WEIGHTS)
+transcode_pool = TranscodePool(TRANSCODE_SLOTS, TRANSCODE_QUEUE_LIMIT)
+
+def admit_transcoding(content_type: Optional[str], background: bool) -> None:
+    """Turn a synchronous audio/video upload away with 429 before it is spooled if transcoding is saturated."""
+    if not background and content_type and content_type.startswith(("audio/", "video/")):
+        transcode_pool.check_admission()
+
+def work_class_for(content_type: Optional[str]) -> str:
+    """Audio/video consults are batch work; text, PDF and everything else is interactive."""
+    if content_type and content_type.startswith(("audio/", "video/")):
+        return "batch"
+    return "interactive"
+
+def json_reply_text(response) -> str:
+    """The reply text with any ```json fences removed, ready for json.loads."""
+    text = response.choices[0].message.content.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    elif text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+def is_json_reply(response) -> bool:
+    try:
+        json.loads(json_reply_text(response))
+        return True
+    except (ValueError, TypeError, AttributeError):
+        return False
+
+async def chat_completion(stage: str, cache_if: Optional[Callable] = None, **request):
+    """openai chat.completions.create, run in one of the scheduler's slots for `stage`.
+
+    Answers come from the LLM response cache when possible (a hit takes no slot). Only
+    complete answers (finish_reason "stop") that pass cache_if, when given (e.g.
+    is_json_reply for callers that parse JSON), are cached or served from the cache.
+    """
+    global llm_cache_bypassed
+    cache_key = llm_cache_key(request) if LLM_CACHE_ENABLED else None
+    
+    def cacheable(response) -> bool:
+        return response.choices[0].finish_reason == "stop" and (cache_if is None or cache_if(response))
+    
+    if cache_key and llm_cache_bypass.get():
+        llm_cache_bypassed += 1
+    elif cache_key:
+        cached = await asyncio.to_thread(llm_cache.get, cache_key)
+        if cached is not None:
+            response = openai.types.chat.ChatCompletion.model_validate_json(cached)
+            if cacheable(response):
+                logger.info(f"LLM cache hit ({stage}, {request.get('model')})")
+                return response
+            # Stored before these checks existed: ask again, and the fresh answer replaces it
+            await asyncio.to_thread(llm_cache.delete, cache_key)
+    async with stage_scheduler.slot(stage):
+        response = await openai_client.chat.completions.create(**request)
+    if cache_key and cacheable(response):
+        await asyncio.to_thread(llm_cache.set, cache_key, response.model_dump_json())
+    return response
+
+# Uploads are streamed to this directory in bounded blocks instead of being read into memory
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/tmp")
+UPLOAD_BLOCK_SIZE = 1024 * 1024  # 1 MB
+
+@dataclass
+class StoredUpload:
+    """An upload that has been written to local disk."""
+    path: str
+    size: int
+    sha256: str
+
+def _copy_upload_to_disk(source, destination_path: str) -> StoredUpload:
+    """Copy a file object to disk block by block, measuring size and SHA-256 on the way."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(destination_path, "wb") as destination:
+        while True:
+            block = source.read(UPLOAD_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+            destination.write(block)
+    return StoredUpload(path=destination_path, size=size, sha256=digest.hexdigest())
+
+async def spool_upload(file: UploadFile, unique_filename: str) -> StoredUpload:
+    """Stream an incoming upload to UPLOAD_DIR without holding the whole payload in memory."""
+    destination_path = os.path.join(UPLOAD_DIR, unique_filename)
+    await file.seek(0)
+    try:
+        return await asyncio.to_thread(_copy_upload_to_disk, file.file, destination_path)
+    except Exception:
+        discard_temp_file(destination_path)
+        raise
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file on disk, read in UPLOAD_BLOCK_SIZE blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(UPLOAD_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def discard_temp_file(path: Optional[str]) -> None:
+    """Remove a temporary file (spooled upload, decoded PCM, ...), ignoring files that are already gone."""
+    if not path:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove temporary file {path}: {e}")
+
+def read_text_upload(stored_upload: StoredUpload) -> str:
+    """Decode a spooled text upload as UTF-8."""
+    with open(stored_upload.path, "rb") as text_file:
+        return text_file.read().decode('utf-8')
+
+class DiskCache:
+    """Size-bounded LRU cache of text values, persisted in a local SQLite file.
+
+    With ttl_seconds, entries older than that are treated as missing and dropped. Hit and
+    miss counts are kept for the process (see stats()). Methods are synchronous (and
+    thread-safe); call them via asyncio.to_thread from request handlers.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: Optional[float] = None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL, "
+            "created_at REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(entries)")]
+        if "created_at" not in columns:  # cache files written before entries had a creation time
+            self._conn.execute("ALTER TABLE entries ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed_at ON entries(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and row[1] < time.time() - self.ttl_seconds:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Drop expired entries, then least recently used ones until the cache fits in max_bytes."""
+        if self.ttl_seconds is not None:
+            expired = self._conn.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self.evictions += expired.rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed_at ASC"):
+            if total <= self.max_bytes:
+                break
+            stale_keys.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", stale_keys)
+        self.evictions += len(stale_keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+# Finished transcripts are cached by audio content hash + transcription parameters, so a
+# retried or re-used upload skips ffmpeg and Whisper entirely.
+CACHE_DIR = os.getenv("CACHE_DIR", "/tmp/ai-clinic-cache")
+TRANSCRIPT_CACHE_MAX_MB = int(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "256"))
+transcript_cache = DiskCache(os.path.join(CACHE_DIR, "transcripts.sqlite3"), TRANSCRIPT_CACHE_MAX_MB * 1024 * 1024)
+
+# Chat completions are cached by model, prompt version, every request parameter and a hash
+# of the messages (prompt + input), so re-processing the same transcript or regenerating an
+# unchanged summary doesn't pay OpenAI again. Bump LLM_PROMPT_VERSION to invalidate every
+# entry at once; callers that want a fresh answer wrap the call in bypass_llm_cache().
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "128"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_PROMPT_VERSION = "1"
+llm_cache = DiskCache(os.path.join(CACHE_DIR, "llm_responses.sqlite3"), LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL_HOURS * 3600)
+llm_cache_bypass: contextvars.ContextVar = contextvars.ContextVar("llm_cache_bypass", default=False)
+llm_cache_bypassed = 0
+
+def bypass_llm_cache() -> None:
+    """Make the chat completions of the current task (and tasks it starts) skip cached answers; fresh ones are still stored."""
+    llm_cache_bypass.set(True)
+
+def llm_cache_key(request: dict) -> str:
+    """Cache key: prompt version plus the full request (model, parameters, messages), hashed."""
+    payload = json.dumps({"prompt_version": LLM_PROMPT_VERSION, "request": request}, sort_keys=True, default=str)
+    return f"{request.get('model')}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+# Long-audio transcription settings
+TRANSCRIPTION_CONCURRENCY = int(os.getenv("TRANSCRIPTION_CONCURRENCY", "4"))
+TRANSCRIPTION_MAX_RETRIES = int(os.getenv("TRANSCRIPTION_MAX_RETRIES", "2"))
+TRANSCRIPTION_RETRY_BACKOFF_SECONDS = float(os.getenv("TRANSCRIPTION_RETRY_BACKOFF_SECONDS", "2"))
+
+# Long recordings are decoded once to raw 16 kHz mono PCM; chunks are then sliced from that
+# file instead of running one ffmpeg seek+decode per chunk.
+PCM_SAMPLE_RATE = 16000
+PCM_SAMPLE_WIDTH = 2  # bytes per sample (s16le, mono)
+
+# Chunk planning: cut near a quiet point close to each target boundary and overlap
+# neighbouring chunks slightly so words on the boundary are heard in full by Whisper.
+WHISPER_MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+CHUNK_TARGET_SECONDS = int(os.getenv("CHUNK_TARGET_SECONDS", "1200"))
+CHUNK_SEARCH_WINDOW_SECONDS = float(os.getenv("CHUNK_SEARCH_WINDOW_SECONDS", "20"))
+CHUNK_OVERLAP_SECONDS = float(os.getenv("CHUNK_OVERLAP_SECONDS", "1.5"))
+if CHUNK_SEARCH_WINDOW_SECONDS < 0 or CHUNK_OVERLAP_SECONDS < 0 or CHUNK_TARGET_SECONDS <= CHUNK_SEARCH_WINDOW_SECONDS + CHUNK_OVERLAP_SECONDS:
+    raise ValueError("CHUNK_TARGET_SECONDS must exceed CHUNK_SEARCH_WINDOW_SECONDS + CHUNK_OVERLAP_SECONDS (both non-negative)")
+ENERGY_FRAME_SECONDS = 0.1
+STITCH_MAX_OVERLAP_WORDS = 12
+
+# Chunks are sent to Whisper as low-bitrate mono Opus in OGG (~0.2 MB per minute at 24 kbps)
+# rather than 16-bit WAV (~1.9 MB per minute). Set WHISPER_UPLOAD_FORMAT=wav to go back to WAV.
+WHISPER_UPLOAD_FORMAT = os.getenv("WHISPER_UPLOAD_FORMAT", "ogg").lower()
+OPUS_BITRATE_KBPS = int(os.getenv("OPUS_BITRATE_KBPS", "24"))
+OPUS_SIZE_MARGIN = 0.8  # Opus is VBR; leave headroom under the upload limit
+MIN_CHUNK_SAMPLES = 500  # anything shorter is not worth a Whisper request
+
+# Dead-air trimming: silent stretches longer than DEAD_AIR_MIN_SECONDS are cut out before
+# Whisper sees the audio (a little padding is kept on each side of the remaining speech).
+DEAD_AIR_THRESHOLD_DBFS = float(os.getenv("DEAD_AIR_THRESHOLD_DBFS", "-45"))
+DEAD_AIR_MIN_SECONDS = float(os.getenv("DEAD_AIR_MIN_SECONDS", "2.0"))
+DEAD_AIR_PADDING_SECONDS = float(os.getenv("DEAD_AIR_PADDING_SECONDS", "0.3"))
+ENVELOPE_BLOCK_FRAMES = 6000  # 10 minutes of 100 ms frames per vectorized block
+
+@dataclass
+class TrimResult:
+    """Outcome of dead-air trimming, with a map back to the original timeline.
+
+    offset_map holds (trimmed_start_sample, original_start_sample, length) for every
+    span of audio that was kept, in order.
+    """
+    original_samples: int
+    kept_samples: int
+    offset_map: List[tuple]
+    _trimmed_starts: List[int] = dataclass_field(init=False, repr=False)  # bisect keys, built once
+
+    def __post_init__(self):
+        self._trimmed_starts = [entry[0] for entry in self.offset_map]
+
+    @property
+    def removed_seconds(self) -> float:
+        return (self.original_samples - self.kept_samples) / PCM_SAMPLE_RATE
+
+    def to_original_seconds(self, trimmed_seconds: float) -> float:
+        """Translate a position in the trimmed audio to the same moment in the original recording."""
+        if not self.offset_map:
+            return trimmed_seconds
+        trimmed_sample = int(trimmed_seconds * PCM_SAMPLE_RATE)
+        index = max(0, bisect.bisect_right(self._trimmed_starts, trimmed_sample) - 1)
+        trimmed_start, original_start, length = self.offset_map[index]
+        return (original_start + min(trimmed_sample - trimmed_start, length)) / PCM_SAMPLE_RATE
+
+@dataclass
+class TranscriptSegment:
+    """A stretch of transcript with its start/end time in seconds."""
+    start: float
+    end: float
+    text: str
+
+@dataclass
+class AudioTranscript:
+    """A recording's transcript text plus its time-aligned segments (on the original timeline)."""
+    text: str
+    segments: List[TranscriptSegment]
+
+def segments_text(segments: List[TranscriptSegment]) -> str:
+    return " ".join(segment.text.strip() for segment in segments if segment.text.strip())
 
 # Helper functions for file processing
-async def process_audio_file(file_content: bytes, unique_filename: str, content_type: str) -> str:
-    """Process audio file with Whisper transcription and segmentation for long files."""
+async def decode_to_pcm(input_path: str, pcm_path: str) -> int:
+    """Decode any audio/video input to raw 16 kHz mono s16le PCM in a single ffmpeg pass.
+
+    Returns the number of samples written.
+    """
+    ffmpeg_cmd = [
+        "ffmpeg", "-nostdin", "-i", input_path,
+        "-vn",
+        "-acodec", "pcm_s16le",
+        "-ar", str(PCM_SAMPLE_RATE),
+        "-ac", "1",
+        "-f", "s16le",
+        "-y",  # Overwrite output
+        pcm_path
+    ]
+    await run_subprocess(ffmpeg_cmd)
+    return os.path.getsize(pcm_path) // PCM_SAMPLE_WIDTH
+
+# Audio codecs that can be stream-copied out of a video container, and the container to copy into
+AUDIO_COPY_CONTAINERS = {
+    "aac": "m4a",
+    "alac": "m4a",
+    "mp3": "mp3",
+    "opus": "ogg",
+    "vorbis": "ogg",
+    "flac": "flac",
+    "pcm_s16le": "wav",
+    "pcm_s24le": "wav",
+    "pcm_f32le": "wav",
+}
+
+async def probe_audio_codec(input_path: str) -> Optional[str]:
+    """Codec name of the first audio stream in a media file, or None if it has no audio."""
+    output = await run_subprocess([
+        "ffprobe", "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name",
+        "-of", "json",
+        input_path
+    ])
+    streams = json.loads(output or b"{}").get("streams") or []
+    return streams[0].get("codec_name") if streams else None
+
+async def extract_audio_track(video_path: str, unique_filename: str) -> bool:
+    """Replace a spooled video with just its audio track, stream-copied without re-encoding.
+
+    The audio-only file takes the video's place on disk (ffmpeg probes content, not the
+    extension), so the caller's cleanup and job retries keep working. Returns False when
+    the video has no audio stream. If the codec can't be copied, the video is left as is
+    and decode_to_pcm reads the audio out of it directly.
+    """
+    codec = await probe_audio_codec(video_path)
+    if codec is None:
+        return False
+    container = AUDIO_COPY_CONTAINERS.get(codec)
+    if container is None:
+        logger.info(f"Audio codec {codec} can't be stream-copied; decoding straight from the video")
+        return True
+
+    # Same directory as the upload so the final rename never crosses filesystems
+    audio_path = os.path.join(os.path.dirname(video_path) or ".", f"audio_{unique_filename}.{container}")
     try:
-        logger.info("Starting audio transcription with OpenAI Whisper...")
-        
-        # Create temporary file for processing
-        temp_file_path = f"/tmp/{unique_filename}"
-        with open(temp_file_path, "wb") as temp_file:
-            temp_file.write(file_content)
-        
-        # Use ffmpeg to get audio duration and segment if needed
-        import subprocess
-        import json
-        
-        # Get audio duration using ffprobe
-        logger.info("Getting audio duration with ffprobe...")
+        video_size = os.path.getsize(video_path)
+        await run_subprocess([
+            "ffmpeg", "-nostdin", "-i", video_path,
+            "-map", "0:a:0",
+            "-vn", "-sn", "-dn",
+            "-c:a", "copy",
+            "-y",  # Overwrite output
+            audio_path
+        ])
+        os.replace(audio_path, video_path)
+        logger.info(
+            f"Extracted {codec} audio track from video: "
+            f"{video_size / 1024 / 1024:.1f} MB -> {os.path.getsize(video_path) / 1024 / 1024:.1f} MB"
+        )
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"Audio stream copy failed, decoding straight from the video: {e}")
+    finally:
+        discard_temp_file(audio_path)
+    return True
+
+def write_wav_chunk(pcm_path: str, start_sample: int, end_sample: int, wav_path: str) -> None:
+    """Copy samples [start_sample, end_sample) of a raw PCM file into a standalone WAV file."""
+    import wave
+
+    remaining = (end_sample - start_sample) * PCM_SAMPLE_WIDTH
+    with open(pcm_path, "rb") as pcm_file, wave.open(wav_path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(PCM_SAMPLE_WIDTH)
+        wav_file.setframerate(PCM_SAMPLE_RATE)
+        pcm_file.seek(start_sample * PCM_SAMPLE_WIDTH)
+        while remaining > 0:
+            block = pcm_file.read(min(UPLOAD_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            wav_file.writeframes(block)
+            remaining -= len(block)
+
+async def encode_pcm_chunk(pcm_path: str, start_sample: int, end_sample: int, output_path: str) -> None:
+    """Encode samples [start_sample, end_sample) of a raw PCM file in the Whisper upload format.
+
+    For OGG/Opus, ffmpeg reads the slice straight out of the raw file (seeking in raw PCM
+    is sample-exact), so no intermediate WAV is written.
+    """
+    if WHISPER_UPLOAD_FORMAT == "wav":
+        await asyncio.to_thread(write_wav_chunk, pcm_path, start_sample, end_sample, output_path)
+        return
+
+    ffmpeg_cmd = [
+        "ffmpeg", "-nostdin",
+        "-f", "s16le", "-ar", str(PCM_SAMPLE_RATE), "-ac", "1",
+        "-ss", f"{start_sample / PCM_SAMPLE_RATE:.6f}",
+        "-t", f"{(end_sample - start_sample) / PCM_SAMPLE_RATE:.6f}",
+        "-i", pcm_path,
+        "-c:a", "libopus",
+        "-b:a", f"{OPUS_BITRATE_KBPS}k",
+        "-application", "voip",
+        "-y",  # Overwrite output
+        output_path
+    ]
+    async with transcode_pool.slot(admission=False):
+        await run_subprocess(ffmpeg_cmd)
+
+def load_pcm(pcm_path: str) -> np.ndarray:
+    """Memory-map a raw s16le PCM file as an int16 array (nothing is read until sliced)."""
+    if os.path.getsize(pcm_path) < PCM_SAMPLE_WIDTH:
+        return np.zeros(0, dtype="<i2")
+    return np.memmap(pcm_path, dtype="<i2", mode="r")
+
+def frame_rms(samples: np.ndarray, frame_samples: int) -> np.ndarray:
+    """RMS energy of consecutive, non-overlapping frames (a trailing partial frame is dropped)."""
+    frame_count = len(samples) // frame_samples
+    if frame_count == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = np.asarray(samples[:frame_count * frame_samples], dtype=np.float32).reshape(frame_count, frame_samples)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+def energy_envelope(samples: np.ndarray, frame_samples: int) -> np.ndarray:
+    """RMS envelope of a (memory-mapped) recording, computed in fixed-size vectorized blocks.
+
+    Working block by block keeps the float32 copy bounded instead of materializing the
+    whole recording at once.
+    """
+    block_samples = ENVELOPE_BLOCK_FRAMES * frame_samples
+    blocks = [
+        frame_rms(samples[start:start + block_samples], frame_samples)
+        for start in range(0, len(samples), block_samples)
+    ]
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+def trim_dead_air(pcm_path: str, trimmed_path: str) -> TrimResult:
+    """Write a copy of pcm_path with long silent stretches removed.
+
+    Frames quieter than DEAD_AIR_THRESHOLD_DBFS for at least DEAD_AIR_MIN_SECONDS are
+    dropped, except for DEAD_AIR_PADDING_SECONDS kept next to audible audio so speech is
+    not clipped. A recording with no audible frame at all is dropped entirely. Returns
+    the kept/removed sample counts and the offset map.
+    """
+    samples = load_pcm(pcm_path)
+    total_samples = len(samples)
+    frame_samples = int(ENERGY_FRAME_SECONDS * PCM_SAMPLE_RATE)
+    min_frames = int(DEAD_AIR_MIN_SECONDS / ENERGY_FRAME_SECONDS)
+    padding = int(DEAD_AIR_PADDING_SECONDS * PCM_SAMPLE_RATE)
+
+    cuts = []
+    if min_frames > 0 and total_samples:
+        envelope = energy_envelope(samples, frame_samples)
+        envelope_dbfs = 20 * np.log10(np.maximum(envelope, 1e-3) / 32768)
+        quiet = envelope_dbfs < DEAD_AIR_THRESHOLD_DBFS
+        silent = np.concatenate(([False], quiet, [False]))
+        edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+        for start_frame, end_frame in zip(edges[::2], edges[1::2]):
+            if end_frame - start_frame < min_frames:
+                continue
+            # Leading and trailing silence borders no speech, so it is cut without padding
+            cut_start = int(start_frame) * frame_samples + (padding if start_frame > 0 else 0)
+            cut_end = int(end_frame) * frame_samples - (padding if end_frame < len(quiet) else 0)
+            if cut_end > cut_start:
+                cuts.append((cut_start, cut_end))
+        if quiet.all():
+            # Nothing but silence (even shorter than DEAD_AIR_MIN_SECONDS): nothing for Whisper to hear
+            cuts = [(0, total_samples)]
+
+    offset_map = []
+    kept_samples = 0
+    position = 0
+    with open(trimmed_path, "wb") as trimmed_file:
+        for cut_start, cut_end in cuts + [(total_samples, total_samples)]:
+            length = cut_start - position
+            if length > 0:
+                offset_map.append((kept_samples, position, length))
+                for block_start in range(position, cut_start, UPLOAD_BLOCK_SIZE):
+                    block_end = min(block_start + UPLOAD_BLOCK_SIZE, cut_start)
+                    trimmed_file.write(np.ascontiguousarray(samples[block_start:block_end]).tobytes())
+                kept_samples += length
+            position = cut_end
+
+    return TrimResult(original_samples=total_samples, kept_samples=kept_samples, offset_map=offset_map)
+
+def max_chunk_seconds() -> float:
+    """Longest chunk (including overlap) that still fits under Whisper's upload limit in the upload format."""
+    if WHISPER_UPLOAD_FORMAT == "wav":
+        return (WHISPER_MAX_UPLOAD_BYTES - 1024) / (PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH)
+    return WHISPER_MAX_UPLOAD_BYTES * OPUS_SIZE_MARGIN / (OPUS_BITRATE_KBPS * 1000 / 8)
+
+def find_quiet_cut(samples: np.ndarray, window_start: int, window_end: int, frame_samples: int) -> int:
+    """Sample index at the centre of the quietest frame in samples[window_start:window_end]."""
+    energy = frame_rms(samples[window_start:window_end], frame_samples)
+    if not len(energy):
+        return (window_start + window_end) // 2
+    return window_start + int(np.argmin(energy)) * frame_samples + frame_samples // 2
+
+def plan_chunk_bounds(pcm_path: str, total_samples: int) -> List[tuple]:
+    """Plan (start_sample, end_sample) chunks that end at low-energy points.
+
+    Each cut is placed at the quietest frame within CHUNK_SEARCH_WINDOW_SECONDS of the
+    target length, and each chunk extends CHUNK_OVERLAP_SECONDS past its cuts on both
+    sides. The target is clamped so a chunk never exceeds the Whisper upload limit.
+    """
+    samples = load_pcm(pcm_path)
+    window = int(CHUNK_SEARCH_WINDOW_SECONDS * PCM_SAMPLE_RATE)
+    overlap = int(CHUNK_OVERLAP_SECONDS * PCM_SAMPLE_RATE)
+    frame_samples = int(ENERGY_FRAME_SECONDS * PCM_SAMPLE_RATE)
+    target_seconds = min(
+        CHUNK_TARGET_SECONDS,
+        max_chunk_seconds() - CHUNK_SEARCH_WINDOW_SECONDS - 2 * CHUNK_OVERLAP_SECONDS
+    )
+    target = int(target_seconds * PCM_SAMPLE_RATE)
+
+    bounds = []
+    cursor = 0
+    while total_samples - cursor > target + window:
+        # Never search at or before the previous cut's overlap, so every chunk moves the cursor forward
+        window_start = max(cursor + target - window, cursor + overlap + frame_samples)
+        cut = find_quiet_cut(samples, window_start, max(cursor + target + window, window_start + frame_samples), frame_samples)
+        bounds.append((max(0, cursor - overlap), min(total_samples, cut + overlap)))
+        cursor = cut
+    bounds.append((max(0, cursor - overlap), total_samples))
+    return bounds
+
+def _normalize_word(word: str) -> str:
+    return "".join(character for character in word.lower() if character.isalnum())
+
+def strip_overlapping_words(previous_text: str, next_text: str, max_words: int = STITCH_MAX_OVERLAP_WORDS) -> str:
+    """Drop the words at the start of next_text that repeat the end of previous_text.
+
+    Neighbouring chunks overlap by a second or two of audio, so Whisper usually
+    transcribes the same few words at the end of one chunk and the start of the next.
+    The longest matching suffix/prefix (compared case- and punctuation-insensitively)
+    is removed from next_text. A single-word match only counts for words of 4+ letters.
+    """
+    previous_words = [_normalize_word(word) for word in previous_text.split()[-max_words:]]
+    next_raw_words = next_text.split()
+    next_words = [_normalize_word(word) for word in next_raw_words[:max_words]]
+
+    for size in range(min(len(previous_words), len(next_words)), 0, -1):
+        if previous_words[-size:] != next_words[:size] or not any(next_words[:size]):
+            continue
+        if size == 1 and len(next_words[0]) < 4:
+            break
+        return " ".join(next_raw_words[size:])
+    return next_text
+
+# Transcription backends: OpenAI's hosted Whisper, and an optional local faster-whisper model
+# on the CPU. TRANSCRIPTION_BACKEND=auto routes each chunk to whichever is the better fit.
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "auto").lower()  # auto, openai or local
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_THREADS = int(os.getenv("LOCAL_WHISPER_THREADS", "4"))
+LOCAL_WHISPER_WORKERS = int(os.getenv("LOCAL_WHISPER_WORKERS", str(max(1, (os.cpu_count() or 1) // LOCAL_WHISPER_THREADS))))
+LOCAL_WHISPER_BEAM_SIZE = int(os.getenv("LOCAL_WHISPER_BEAM_SIZE", "1"))
+LOCAL_MAX_AUDIO_SECONDS = float(os.getenv("LOCAL_MAX_AUDIO_SECONDS", "600"))
+
+class TranscriptionBackend:
+    """A speech-to-text engine that turns one audio file into time-aligned segments."""
+    name = "base"
+
+    async def transcribe(self, audio_path: str) -> List[TranscriptSegment]:
+        raise NotImplementedError
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    name = "openai"
+
+    async def transcribe(self, audio_path: str) -> List[TranscriptSegment]:
+        transcription = await openai_client.audio.transcriptions.create(
+            model="whisper-1",
+            file=Path(audio_path),
+            response_format="verbose_json"
+        )
+        if not transcription.segments:
+            text = transcription.text.strip()
+            return [TranscriptSegment(0.0, transcription.duration or 0.0, text)] if text else []
+        return [
+            TranscriptSegment(segment.start, segment.end, segment.text.strip())
+            for segment in transcription.segments
+        ]
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """Quantized faster-whisper on the CPU.
+
+    Runs on a dedicated pool of `workers` threads (CTranslate2 releases the GIL), each decode
+    using `threads` cores, so workers * threads should roughly match the host's cores. The
+    model is loaded on first use.
+    """
+    name = "local"
+
+    def __init__(self, model_size: str, compute_type: str, workers: int, threads: int):
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.workers = max(1, workers)
+        self.threads = max(1, threads)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="local-whisper")
+        self.in_flight = 0
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return WhisperModel is not None
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < self.workers
+
+    def _get_model(self):
+        with self._model_lock:
+            if self._model is None:
+                logger.info(f"Loading local Whisper model '{self.model_size}' ({self.compute_type}, {self.workers}x{self.threads} threads)")
+                self._model = WhisperModel(
+                    self.model_size,
+                    device="cpu",
+                    compute_type=self.compute_type,
+                    cpu_threads=self.threads,
+                    num_workers=self.workers
+                )
+            return self._model
+
+    def _transcribe_sync(self, audio_path: str) -> List[TranscriptSegment]:
+        segments, _info = self._get_model().transcribe(audio_path, beam_size=LOCAL_WHISPER_BEAM_SIZE)
+        return [TranscriptSegment(segment.start, segment.end, segment.text.strip()) for segment in segments]
+
+    async def transcribe(self, audio_path: str) -> List[TranscriptSegment]:
+        if not self.available:
+            raise RuntimeError("Local transcription requires the faster-whisper package")
+        self.in_flight += 1
         try:
-            duration_cmd = [
-                "ffprobe", "-v", "quiet", "-print_format", "json",
-                "-show_format", temp_file_path
-            ]
-            duration_result = subprocess.run(duration_cmd, capture_output=True, text=True, check=True)
-            duration_info = json.loads(duration_result.stdout)
-            duration_seconds = float(duration_info["format"]["duration"])
-            duration_minutes = duration_seconds / 60
-            logger.info(f"Audio duration: {duration_minutes:.2f} minutes ({duration_seconds:.1f} seconds)")
-        except Exception as e:
-            logger.error(f"Failed to get duration with ffprobe: {e}")
-            # Fallback: assume it's a long file and try segmentation anyway
-            duration_minutes = 15  # Default to assume it's long
-            duration_seconds = duration_minutes * 60  # Convert to seconds
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self._transcribe_sync, audio_path)
+        finally:
+            self.in_flight -= 1
+
+remote_transcriber = OpenAIWhisperBackend()
+local_transcriber = LocalWhisperBackend(LOCAL_WHISPER_MODEL, LOCAL_WHISPER_COMPUTE_TYPE, LOCAL_WHISPER_WORKERS, LOCAL_WHISPER_THREADS)
+
+# "local" is a promise that audio stays on this host, so it must not quietly become "openai"
+if TRANSCRIPTION_BACKEND not in ("auto", "openai", "local"):
+    raise ValueError(f"TRANSCRIPTION_BACKEND must be auto, openai or local (got {TRANSCRIPTION_BACKEND!r})")
+if TRANSCRIPTION_BACKEND == "local" and not local_transcriber.available:
+    raise ValueError("TRANSCRIPTION_BACKEND=local requires the faster-whisper package (pip install faster-whisper)")
+
+def choose_transcription_backend(duration_seconds: float) -> TranscriptionBackend:
+    """Pick the engine for one chunk.
+
+    In auto mode a chunk goes to the local model when a local worker is free and the
+    chunk is short enough to finish quickly on the CPU; everything else (long chunks, or
+    overflow while the local workers are busy) goes to OpenAI, which scales out.
+    """
+    if TRANSCRIPTION_BACKEND == "local":
+        return local_transcriber
+    if TRANSCRIPTION_BACKEND == "openai" or not local_transcriber.available:
+        return remote_transcriber
+    if duration_seconds <= LOCAL_MAX_AUDIO_SECONDS and local_transcriber.has_capacity():
+        return local_transcriber
+    return remote_transcriber
+
+async def _transcribe_pcm_chunk(pcm_path: str, unique_filename: str, chunk_number: int, start_sample: int, end_sample: int) -> List[TranscriptSegment]:
+    """Slice one chunk out of the decoded PCM and transcribe it with the routed backend.
+
+    Returns the chunk's segments (possibly none), timed from the start of pcm_path. Raises
+    on Whisper failure so the caller can decide whether to retry.
+    """
+    chunk_filename = os.path.join(UPLOAD_DIR, f"chunk_{chunk_number}_{unique_filename}.{WHISPER_UPLOAD_FORMAT}")
+    logger.info(f"Creating chunk {chunk_number} starting at {start_sample / PCM_SAMPLE_RATE:.1f}s")
+
+    try:
+        # Check if chunk has content
+        if end_sample - start_sample < MIN_CHUNK_SAMPLES:
+            logger.warning(f"Chunk {chunk_number} too small")
+            return []
+
+        await encode_pcm_chunk(pcm_path, start_sample, end_sample, chunk_filename)
+        duration_seconds = (end_sample - start_sample) / PCM_SAMPLE_RATE
+        async with stage_scheduler.slot("transcription", cost=duration_seconds):
+            backend = choose_transcription_backend(duration_seconds)
+            logger.info(f"Chunk {chunk_number} created successfully ({os.path.getsize(chunk_filename) / 1024:.0f} KB), transcribing with {backend.name} backend")
+            try:
+                segments = await backend.transcribe(chunk_filename)
+            except openai.APIConnectionError:
+                # Keep working through a network outage if a local model is installed
+                if backend is not remote_transcriber or not local_transcriber.available:
+                    raise
+                logger.warning(f"OpenAI unreachable, transcribing chunk {chunk_number} locally")
+                segments = await local_transcriber.transcribe(chunk_filename)
+        chunk_offset = start_sample / PCM_SAMPLE_RATE
+        return [TranscriptSegment(chunk_offset + segment.start, chunk_offset + segment.end, segment.text) for segment in segments]
+
+    finally:
+        discard_temp_file(chunk_filename)
+
+async def transcribe_chunks_concurrently(pcm_path: str, unique_filename: str, chunk_bounds: List[tuple], checkpoint_prefix: Optional[str] = None, on_chunk: Optional[Callable[[int, str], None]] = None) -> Tuple[List[str], List[TranscriptSegment]]:
+    """Transcribe chunks of a decoded recording in parallel.
+
+    At most TRANSCRIPTION_CONCURRENCY chunks are in flight at once. Chunks that fail are
+    retried on their own (up to TRANSCRIPTION_MAX_RETRIES extra rounds) while successful
+    ones are kept. Returns one text per chunk, in original chunk order (a chunk that kept
+    failing yields "Transcription failed: ..." and a silent chunk yields ""), plus the
+    de-duplicated segments of all chunks, timed from the start of pcm_path.
+    With checkpoint_prefix, each finished chunk is kept in the transcript cache, so when the
+    recording is processed again only the chunks that failed last time are sent.
+    on_chunk(index, text) is called as each chunk finishes, in completion order.
+    """
+    semaphore = asyncio.Semaphore(max(1, TRANSCRIPTION_CONCURRENCY))
+    results: List[Optional[List[TranscriptSegment]]] = [None] * len(chunk_bounds)
+    errors: dict = {}
+
+    async def run_chunk(index: int) -> None:
+        chunk_number = index + 1
+        start_sample, end_sample = chunk_bounds[index]
+        checkpoint_key = f"{checkpoint_prefix}:chunk:{start_sample}-{end_sample}" if checkpoint_prefix else None
+        if checkpoint_key:
+            checkpoint = await asyncio.to_thread(transcript_cache.get, checkpoint_key)
+            if checkpoint is not None:
+                results[index] = decode_cached_transcript(checkpoint).segments
+                logger.info(f"Chunk {chunk_number} loaded from checkpoint")
+                if on_chunk:
+                    on_chunk(index, segments_text(results[index]))
+                return
+        async with semaphore:
+            try:
+                results[index] = await _transcribe_pcm_chunk(
+                    pcm_path, unique_filename, chunk_number, start_sample, end_sample
+                )
+                errors.pop(index, None)
+                if checkpoint_key:
+                    await asyncio.to_thread(
+                        transcript_cache.set, checkpoint_key,
+                        encode_cached_transcript(AudioTranscript(segments_text(results[index]), results[index]))
+                    )
+                if results[index]:
+                    logger.info(f"Chunk {chunk_number} transcribed: {segments_text(results[index])[:50]}...")
+                else:
+                    logger.warning(f"Chunk {chunk_number} produced empty transcript")
+                if on_chunk:
+                    on_chunk(index, segments_text(results[index]))
+            except Exception as e:
+                errors[index] = e
+                logger.error(f"Failed to transcribe chunk {chunk_number}: {str(e)}")
+
+    pending = list(range(len(chunk_bounds)))
+    for attempt in range(TRANSCRIPTION_MAX_RETRIES + 1):
+        if attempt:
+            logger.info(f"Retrying {len(pending)} failed chunk(s), attempt {attempt + 1}")
+            await asyncio.sleep(TRANSCRIPTION_RETRY_BACKOFF_SECONDS * attempt)
+        await asyncio.gather(*(run_chunk(index) for index in pending))
+        pending = sorted(errors)
+        if not pending:
+            break
+
+    chunk_transcripts = stitch_chunk_transcripts([
+        f"Transcription failed: {str(errors[index])}" if index in errors else segments_text(chunk_segments or [])
+        for index, chunk_segments in enumerate(results)
+    ])
+    return chunk_transcripts, merge_chunk_segments([chunk_segments or [] for chunk_segments in results], chunk_bounds)
+
+def merge_chunk_segments(chunk_segments: List[List[TranscriptSegment]], chunk_bounds: List[tuple]) -> List[TranscriptSegment]:
+    """Combine per-chunk segments into one timeline without the copies heard in both overlaps.
+
+    Neighbouring chunks share an overlap; its midpoint is where the cut was planned. Each
+    segment is kept only by the chunk that owns its midpoint.
+    """
+    boundaries = [
+        (chunk_bounds[index - 1][1] + chunk_bounds[index][0]) / 2 / PCM_SAMPLE_RATE
+        for index in range(1, len(chunk_bounds))
+    ]
+    merged = []
+    for index, segments in enumerate(chunk_segments):
+        owned_start = boundaries[index - 1] if index > 0 else float("-inf")
+        owned_end = boundaries[index] if index < len(boundaries) else float("inf")
+        merged.extend(
+            segment for segment in segments
+            if owned_start <= (segment.start + segment.end) / 2 < owned_end
+        )
+    return merged
+
+def stitch_chunk_transcripts(chunk_transcripts: List[str]) -> List[str]:
+    """Remove words duplicated by the overlap between neighbouring chunk transcripts."""
+    stitched = list(chunk_transcripts)
+    for index in range(len(stitched) - 1, 0, -1):
+        previous_text, text = stitched[index - 1], stitched[index]
+        if previous_text and text and not any(
+            chunk_text.startswith("Transcription failed") for chunk_text in (previous_text, text)
+        ):
+            stitched[index] = strip_overlapping_words(previous_text, text)
+    return stitched
+
+def join_segment_transcripts(chunk_transcripts: List[str]) -> str:
+    """Label chunk transcripts as "[Segment N] ..." and join them (a single chunk is left unlabeled)."""
+    if len(chunk_transcripts) == 1:
+        return chunk_transcripts[0]
+    return "\n\n".join(
+        f"[Segment {chunk_number}] {chunk_transcript}"
+        for chunk_number, chunk_transcript in enumerate(chunk_transcripts, 1)
+        if chunk_transcript
+    )
+
+def transcription_cache_key(content_sha256: str) -> str:
+    """Cache key for a transcript: the audio content hash plus every parameter that affects the output."""
+    parameters = {
+        "audio_sha256": content_sha256,
+        "model": "whisper-1",
+        "backend": [TRANSCRIPTION_BACKEND, LOCAL_WHISPER_MODEL if local_transcriber.available else None],
+        "sample_rate": PCM_SAMPLE_RATE,
+        "upload_format": [WHISPER_UPLOAD_FORMAT, OPUS_BITRATE_KBPS],
+        "dead_air": [DEAD_AIR_THRESHOLD_DBFS, DEAD_AIR_MIN_SECONDS, DEAD_AIR_PADDING_SECONDS],
+        "chunking": [CHUNK_TARGET_SECONDS, CHUNK_SEARCH_WINDOW_SECONDS, CHUNK_OVERLAP_SECONDS],
+        "format": "segments-v1",
+    }
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()
+
+def encode_cached_transcript(transcript: AudioTranscript) -> str:
+    """Compact cache form: the text plus [start, end, text] triples rounded to centiseconds."""
+    return json.dumps({
+        "text": transcript.text,
+        "segments": [[round(segment.start, 2), round(segment.end, 2), segment.text] for segment in transcript.segments],
+    })
+
+def decode_cached_transcript(value: str) -> AudioTranscript:
+    data = json.loads(value)
+    return AudioTranscript(text=data["text"], segments=[TranscriptSegment(*segment) for segment in data["segments"]])
+
+async def process_audio_file(temp_file_path: str, unique_filename: str, content_type: str, content_sha256: Optional[str] = None, on_chunk: Optional[Callable[[int, str], None]] = None) -> AudioTranscript:
+    """Process audio file with Whisper transcription and segmentation for long files.
+
+    Video uploads are first reduced to their audio track by stream copy. The recording is
+    decoded once to 16 kHz mono PCM, long silences are trimmed out, and the remaining
+    audio is cut at quiet points into chunks that are transcribed in parallel.
+    Segment times are mapped back to the original (untrimmed) recording. When
+    content_sha256 is given, finished transcripts are served from / stored in the
+    transcript cache. temp_file_path is the spooled upload on disk; it is owned (and
+    removed) by the caller. On failure the text is a "Transcription failed: ..." message.
+    on_chunk is passed on to transcribe_chunks_concurrently (not called on a cache hit).
+    """
+    pcm_path = f"/tmp/pcm_{unique_filename}.raw"
+    trimmed_path = f"/tmp/trimmed_{unique_filename}.raw"
+    cache_key = transcription_cache_key(content_sha256) if content_sha256 else None
+    try:
+        if cache_key:
+            cached_transcript = await asyncio.to_thread(transcript_cache.get, cache_key)
+            if cached_transcript is not None:
+                logger.info(f"Transcript cache hit for audio {content_sha256[:12]}")
+                return decode_cached_transcript(cached_transcript)
         
-        if duration_minutes > 10:
-            logger.info(f"Long audio detected ({duration_minutes:.2f} min). Segmenting into 5-minute chunks...")
-            
-            # Segment audio into 5-minute chunks using ffmpeg
-            chunk_duration = 300  # 5 minutes in seconds
-            transcripts = []
-            chunk_number = 0
-            
-            start_time = 0
-            while start_time < duration_seconds:
-                chunk_number += 1
-                chunk_filename = f"/tmp/chunk_{chunk_number}_{unique_filename}.wav"
-                
-                logger.info(f"Creating chunk {chunk_number} starting at {start_time:.1f}s")
-                
-                # Use ffmpeg to extract chunk
+        logger.info("Starting audio transcription with OpenAI Whisper...")
+        
+        async with transcode_pool.slot():
+            # Drop the video payload before anything else touches the file
+            if content_type and content_type.startswith('video/'):
                 try:
-                    ffmpeg_cmd = [
-                        "ffmpeg", "-i", temp_file_path,
-                        "-ss", str(start_time),
-                        "-t", str(chunk_duration),
-                        "-acodec", "pcm_s16le",
-                        "-ar", "16000",
-                        "-ac", "1",
-                        "-y",  # Overwrite output
-                        chunk_filename
-                    ]
-                    subprocess.run(ffmpeg_cmd, capture_output=True, check=True)
-                    
-                    # Check if chunk file was created and has content
-                    if os.path.exists(chunk_filename) and os.path.getsize(chunk_filename) > 1000:
-                        logger.info(f"Chunk {chunk_number} created successfully")
-                        
-                        # Transcribe this chunk
-                        try:
-                            with open(chunk_filename, "rb") as chunk_file:
-                                chunk_transcription = openai.audio.transcriptions.create(
-                                    model="whisper-1",
-                                    file=chunk_file,
-                                    response_format="text"
-                                )
-                                chunk_transcript = chunk_transcription.strip()
-                                
-                            if chunk_transcript:
-                                transcripts.append(f"[Segment {chunk_number}] {chunk_transcript}")
-                                logger.info(f"Chunk {chunk_number} transcribed: {chunk_transcript[:50]}...")
-                            else:
-                                logger.warning(f"Chunk {chunk_number} produced empty transcript")
-                                
-                        except Exception as e:
-                            logger.error(f"Failed to transcribe chunk {chunk_number}: {str(e)}")
-                            transcripts.append(f"[Segment {chunk_number}] Transcription failed: {str(e)}")
-                    else:
-                        logger.warning(f"Chunk {chunk_number} file not created or too small")
-                        
+                    if not await extract_audio_track(temp_file_path, unique_filename):
+                        logger.error("Video has no audio track")
+                        return AudioTranscript("Transcription failed: Video has no audio track", [])
                 except subprocess.CalledProcessError as e:
-                    logger.error(f"FFmpeg failed for chunk {chunk_number}: {e}")
-                    transcripts.append(f"[Segment {chunk_number}] Segmentation failed")
-                
-                finally:
-                    # Clean up chunk file
-                    try:
-                        if os.path.exists(chunk_filename):
-                            os.unlink(chunk_filename)
-                    except:
-                        pass
-                
-                start_time += chunk_duration
+                    logger.warning(f"FFprobe failed on video upload, decoding it directly: {e}")
             
-            # Combine all transcripts
-            if transcripts:
-                transcript = "\n\n".join(transcripts)
-                logger.info(f"Segmented transcription completed. Total segments: {len(transcripts)}")
-            else:
-                transcript = "Transcription failed: No segments could be processed"
-                logger.error("No successful segment transcriptions")
-                
+            try:
+                total_samples = await decode_to_pcm(temp_file_path, pcm_path)
+            except subprocess.CalledProcessError as e:
+                logger.error(f"FFmpeg decoding failed: {e}")
+                return AudioTranscript("Transcription failed: Audio decoding failed", [])
+        
+        # Cut dead air before paying Whisper for it
+        trim = await asyncio.to_thread(trim_dead_air, pcm_path, trimmed_path)
+        discard_temp_file(pcm_path)
+        duration_seconds = total_samples / PCM_SAMPLE_RATE
+        logger.info(
+            f"Audio duration: {duration_seconds / 60:.2f} minutes ({duration_seconds:.1f} seconds); "
+            f"dead air removed: {trim.removed_seconds:.1f} seconds "
+            f"({100 * trim.removed_seconds / max(duration_seconds, 1e-9):.0f}%)"
+        )
+        
+        if trim.kept_samples == 0:
+            logger.warning("No speech detected in recording")
+            return AudioTranscript("", [])
+        
+        chunk_bounds = await asyncio.to_thread(plan_chunk_bounds, trimmed_path, trim.kept_samples)
+        if len(chunk_bounds) > 1:
+            logger.info(f"Long audio: planned {len(chunk_bounds)} chunk(s) cut at quiet points")
+        chunk_transcripts, trimmed_segments = await transcribe_chunks_concurrently(trimmed_path, unique_filename, chunk_bounds, cache_key, on_chunk)
+        segments = [
+            TranscriptSegment(trim.to_original_seconds(segment.start), trim.to_original_seconds(segment.end), segment.text)
+            for segment in trimmed_segments
+        ]
+        
+        transcript = join_segment_transcripts(chunk_transcripts)
+        if not transcript and len(chunk_bounds) > 1:
+            transcript = "Transcription failed: No segments could be processed"
+            logger.error("No successful segment transcriptions")
         else:
-            # File is short enough, transcribe directly
-            logger.info("Short audio file, transcribing directly...")
-            
-            # Check file size first (25MB limit)
-            file_size_mb = len(file_content) / (1024 * 1024)
-            logger.info(f"File size: {file_size_mb:.2f} MB")
-            
-            if file_size_mb > 25:
-                # Convert to a more compressed format using ffmpeg
-                logger.info("File too large, converting to compressed format with ffmpeg...")
-                compressed_path = f"/tmp/compressed_{unique_filename}.wav"
-                
-                try:
-                    compress_cmd = [
-                        "ffmpeg", "-i", temp_file_path,
-                        "-acodec", "pcm_s16le",
-                        "-ar", "16000",
-                        "-ac", "1",
-                        "-y",  # Overwrite output
-                        compressed_path
-                    ]
-                    subprocess.run(compress_cmd, capture_output=True, check=True)
-                    
-                    # Check compressed size
-                    compressed_size_mb = os.path.getsize(compressed_path) / (1024 * 1024)
-                    logger.info(f"Compressed file size: {compressed_size_mb:.2f} MB")
-                    
-                    if compressed_size_mb <= 25:
-                        with open(compressed_path, "rb") as audio_file:
-                            transcription_response = openai.audio.transcriptions.create(
-                                model="whisper-1",
-                                file=audio_file,
-                                response_format="text"
-                            )
-                            transcript = transcription_response.strip()
-                    else:
-                        transcript = f"File too large even after compression ({compressed_size_mb:.2f} MB)"
-                    
-                except subprocess.CalledProcessError as e:
-                    logger.error(f"FFmpeg compression failed: {e}")
-                    transcript = "Transcription failed: Audio compression failed"
-                
-                # Clean up compressed file
-                try:
-                    if os.path.exists(compressed_path):
-                        os.unlink(compressed_path)
-                except:
-                    pass
-            else:
-                # Direct transcription
-                with open(temp_file_path, "rb") as audio_file:
-                    transcription_response = openai.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=audio_file,
-                        response_format="text"
-                    )
-                    transcript = transcription_response.strip()
-            
-            logger.info(f"Direct transcription completed: {transcript[:100]}...")
+            logger.info(f"Transcription completed ({len(chunk_bounds)} segment(s)): {transcript[:100]}...")
         
-        # Clean up main temp file
-        try:
-            os.unlink(temp_file_path)
-        except:
-            pass
+        # Only cache complete transcripts; a partial failure should be retried next time
+        result = AudioTranscript(transcript, segments)
+        if cache_key and not any(text.startswith("Transcription failed") for text in chunk_transcripts):
+            await asyncio.to_thread(transcript_cache.set, cache_key, encode_cached_transcript(result))
         
-        return transcript
+        return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Audio transcription failed: {str(e)}")
-        return f"Audio transcription failed: {str(e)}"
+        return AudioTranscript(f"Audio transcription failed: {str(e)}", [])
+    finally:
+        discard_temp_file(pcm_path)
+        discard_temp_file(trimmed_path)
+
+# PDF text extraction: pages are parsed in batches on a process pool (pypdf is pure Python
+# and CPU bound), each worker reading only its own pages from the file. Pages with (almost)
+# no text layer are scans; when pdftoppm and tesseract are installed they are rendered and
+# OCR'd as soon as their batch comes back, sharing the transcoding slots with ffmpeg.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+PDF_OCR_MIN_CHARS = int(os.getenv("PDF_OCR_MIN_CHARS", "20"))
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "300"))
+PDF_OCR_LANGUAGES = os.getenv("PDF_OCR_LANGUAGES", "eng")
+
+pdf_executor: Optional[ProcessPoolExecutor] = None
 
-async def process_pdf_file(file_content: bytes, unique_filename: str) -> str:
-    """Extract text from PDF file."""
+def get_pdf_executor() -> ProcessPoolExecutor:
+    """The PDF worker pool, started on first use (spawned, so workers import only pdf_text)."""
+    global pdf_executor
+    if pdf_executor is None:
+        pdf_executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return pdf_executor
+
+def pdf_ocr_available() -> bool:
+    return bool(shutil.which("pdftoppm") and shutil.which("tesseract"))
+
+async def ocr_pdf_page(file_path: str, page_index: int, unique_filename: str) -> str:
+    """Render one page to a grayscale PNG and read it with tesseract ("" on failure)."""
+    image_prefix = f"/tmp/ocr_{unique_filename}_{page_index + 1}"
+    try:
+        async with transcode_pool.slot(admission=False):
+            await run_subprocess([
+                "pdftoppm", "-f", str(page_index + 1), "-l", str(page_index + 1),
+                "-r", str(PDF_OCR_DPI), "-gray", "-singlefile", "-png",
+                file_path, image_prefix
+            ])
+            output = await run_subprocess(["tesseract", f"{image_prefix}.png", "stdout", "-l", PDF_OCR_LANGUAGES])
+        return output.decode("utf-8", errors="replace").strip()
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"OCR failed on PDF page {page_index + 1}: {e}")
+        return ""
+    finally:
+        discard_temp_file(f"{image_prefix}.png")
+
+async def process_pdf_file(file_path: str, unique_filename: str) -> str:
+    """Extract the text of a PDF (referral letter, pathology report, ...) for summarization.
+
+    Multi-page documents come back as "[Page N] ..." blocks, like segmented transcripts.
+    Scanned pages are OCR'd when the tools are installed. On failure the text is a
+    "PDF processing failed: ..." message.
+    """
+    if pdf_text.PdfReader is None:
+        logger.error("pypdf is not installed; cannot extract PDF text")
+        return f"PDF file uploaded: {unique_filename}\n\n[PDF text extraction unavailable - please use manual transcript entry for PDF content]"
     try:
-        # For now, return a placeholder - PDF text extraction requires additional libraries
-        logger.info("PDF processing - placeholder implementation")
-        return f"PDF file uploaded: {unique_filename}\n\n[PDF text extraction not yet implemented - please use manual transcript entry for PDF content]"
+        loop = asyncio.get_running_loop()
+        executor = get_pdf_executor()
+        started = time.perf_counter()
+        total_pages = await loop.run_in_executor(executor, pdf_text.page_count, file_path)
+        page_texts = [""] * total_pages
+        use_ocr = pdf_ocr_available()
+        ocr_pages = []
+        
+        async def read_batch(first_page: int) -> None:
+            last_page = min(first_page + PDF_PAGES_PER_TASK, total_pages)
+            texts = await loop.run_in_executor(executor, pdf_text.extract_pages, file_path, first_page, last_page)
+            scanned = []
+            for page_index, text in enumerate(texts, first_page):
+                page_texts[page_index] = text.strip()
+                if use_ocr and len(page_texts[page_index]) < PDF_OCR_MIN_CHARS:
+                    scanned.append(page_index)
+            ocr_texts = await asyncio.gather(*(ocr_pdf_page(file_path, page_index, unique_filename) for page_index in scanned))
+            for page_index, text in zip(scanned, ocr_texts):
+                if text:
+                    page_texts[page_index] = text
+                    ocr_pages.append(page_index)
+        
+        await asyncio.gather(*(read_batch(first_page) for first_page in range(0, total_pages, PDF_PAGES_PER_TASK)))
+        logger.info(
+            f"PDF text extracted: {total_pages} page(s), {len(ocr_pages)} OCR'd, "
+            f"{sum(len(text) for text in page_texts)} characters in {time.perf_counter() - started:.2f}s"
+        )
+        
+        if not any(page_texts):
+            return f"PDF processing failed: No text could be extracted from {total_pages} page(s)" + (
+                "" if use_ocr else " (scanned PDFs need pdftoppm and tesseract installed)"
+            )
+        if total_pages == 1:
+            return page_texts[0]
+        return "\n\n".join(
+            f"[Page {page_number}] {text}"
+            for page_number, text in enumerate(page_texts, 1)
+            if text
+        )
     except Exception as e:
         logger.error(f"PDF processing failed: {str(e)}")
         return f"PDF processing failed: {str(e)}"
 
+@app.on_event("shutdown")
+async def stop_pdf_workers():
+    if pdf_executor is not None:
+        pdf_executor.shutdown(wait=False, cancel_futures=True)
+
+# Live transcription: the browser streams MediaRecorder frames over a WebSocket while the
+# consultation is being recorded. Decoded audio is cut into short chunks as it arrives, so
+# only the final chunk is left to transcribe when the clinician presses stop.
+LIVE_CHUNK_SECONDS = float(os.getenv("LIVE_CHUNK_SECONDS", "30"))
+LIVE_SEARCH_WINDOW_SECONDS = float(os.getenv("LIVE_SEARCH_WINDOW_SECONDS", "5"))
+LIVE_DECODER_READ_BYTES = 64 * 1024
+
+def is_silent_pcm(samples: np.ndarray) -> bool:
+    """True when no 100 ms frame of the samples rises above the dead-air threshold."""
+    envelope = frame_rms(samples, int(ENERGY_FRAME_SECONDS * PCM_SAMPLE_RATE))
+    return not np.any(20 * np.log10(np.maximum(envelope, 1e-3) / 32768) >= DEAD_AIR_THRESHOLD_DBFS)
+
+class LiveTranscription:
+    """Cut a growing PCM stream into chunks at quiet points and transcribe each as soon as it is complete.
+
+    feed() takes decoded s16le PCM as it arrives; every time LIVE_CHUNK_SECONDS (plus the
+    search window) are buffered, a chunk is cut at the quietest frame near the target and
+    sent to Whisper in the background. on_segment is awaited with (chunk_number, text) as
+    each chunk finishes. finish() cuts the remainder and returns the stitched chunk texts.
+    """
+
+    def __init__(self, session_id: str, on_segment: Callable[[int, str], Awaitable[None]]):
+        self.session_id = session_id
+        self.on_segment = on_segment
+        self.buffer = bytearray()
+        self.lead_samples = 0  # overlap carried over from the previous chunk
+        self.tasks: List[asyncio.Task] = []
+        self.semaphore = asyncio.Semaphore(max(1, TRANSCRIPTION_CONCURRENCY))
+        self.target = int(LIVE_CHUNK_SECONDS * PCM_SAMPLE_RATE)
+        self.window = int(min(LIVE_SEARCH_WINDOW_SECONDS, LIVE_CHUNK_SECONDS / 2) * PCM_SAMPLE_RATE)
+        self.overlap = min(int(CHUNK_OVERLAP_SECONDS * PCM_SAMPLE_RATE), self.window)
+        self.frame_samples = int(ENERGY_FRAME_SECONDS * PCM_SAMPLE_RATE)
+
+    def feed(self, pcm: bytes) -> None:
+        self.buffer.extend(pcm)
+        while len(self.buffer) // PCM_SAMPLE_WIDTH - self.lead_samples > self.target + self.window:
+            window_start = self.lead_samples + self.target - self.window
+            window_end = self.lead_samples + self.target + self.window
+            window_samples = np.frombuffer(
+                bytes(self.buffer[window_start * PCM_SAMPLE_WIDTH:window_end * PCM_SAMPLE_WIDTH]), dtype="<i2"
+            )
+            cut = window_start + find_quiet_cut(window_samples, 0, len(window_samples), self.frame_samples)
+            self._start_chunk(bytes(self.buffer[:(cut + self.overlap) * PCM_SAMPLE_WIDTH]))
+            del self.buffer[:(cut - self.overlap) * PCM_SAMPLE_WIDTH]
+            self.lead_samples = self.overlap
+
+    async def finish(self) -> List[str]:
+        if len(self.buffer) // PCM_SAMPLE_WIDTH > self.lead_samples:
+            self._start_chunk(bytes(self.buffer[:len(self.buffer) - len(self.buffer) % PCM_SAMPLE_WIDTH]))
+        self.buffer.clear()
+        return stitch_chunk_transcripts(list(await asyncio.gather(*self.tasks)))
+
+    def cancel(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+
+    def _start_chunk(self, pcm: bytes) -> None:
+        self.tasks.append(asyncio.create_task(self._transcribe_chunk(len(self.tasks) + 1, pcm)))
+
+    async def _transcribe_chunk(self, chunk_number: int, pcm: bytes) -> str:
+        raw_path = f"/tmp/live_{self.session_id}_{chunk_number}.raw"
+        text = ""
+        try:
+            if is_silent_pcm(np.frombuffer(pcm, dtype="<i2")):
+                logger.info(f"Live chunk {chunk_number} is silent, skipping Whisper")
+            else:
+                async with self.semaphore:
+                    await asyncio.to_thread(Path(raw_path).write_bytes, pcm)
+                    for attempt in range(TRANSCRIPTION_MAX_RETRIES + 1):
+                        try:
+                            text = segments_text(await _transcribe_pcm_chunk(
+                                raw_path, f"live_{self.session_id}", chunk_number, 0, len(pcm) // PCM_SAMPLE_WIDTH
+                            ))
+                            break
+                        except Exception as e:
+                            logger.error(f"Failed to transcribe live chunk {chunk_number}: {str(e)}")
+                            if attempt == TRANSCRIPTION_MAX_RETRIES:
+                                text = f"Transcription failed: {str(e)}"
+                            else:
+                                await asyncio.sleep(TRANSCRIPTION_RETRY_BACKOFF_SECONDS * (attempt + 1))
+        finally:
+            discard_temp_file(raw_path)
+
+        try:
+            await self.on_segment(chunk_number, text)
+        except Exception as e:
+            logger.warning(f"Could not deliver live chunk {chunk_number}: {str(e)}")
+        return text
+
+async def start_stream_decoder() -> asyncio.subprocess.Process:
+    """Start an ffmpeg process that decodes a container stream on stdin to 16 kHz mono s16le on stdout."""
+    return await asyncio.create_subprocess_exec(
+        "ffmpeg", "-loglevel", "error", "-i", "pipe:0",
+        "-vn",
+        "-acodec", "pcm_s16le",
+        "-ar", str(PCM_SAMPLE_RATE),
+        "-ac", "1",
+        "-f", "s16le",
+        "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+
+async def pump_decoded_pcm(decoder: asyncio.subprocess.Process, live: LiveTranscription) -> None:
+    while True:
+        block = await decoder.stdout.read(LIVE_DECODER_READ_BYTES)
+        if not block:
+            break
+        live.feed(block)
+
 # Response models
 class Patient(BaseModel):
     id: str
@@ -307,6 +1544,33 @@ class UploadResponse(BaseModel):
     created_at: datetime
     extraction_metadata: Optional[dict] = None  # New field to show which fields were extracted
 
+class JobStatus(BaseModel):
+    id: str
+    kind: str
+    status: str  # queued, running, succeeded, failed
+    stage: Optional[str] = None
+    progress: float = 0.0
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    total_size: int
+    content_type: Optional[str] = None
+    kind: str = "upload"  # which consultation pipeline the finished file goes to
+    patient_id: Optional[str] = None
+
+class UploadSessionStatus(BaseModel):
+    upload_id: str
+    kind: str
+    filename: str
+    offset: int
+    total_size: int
+    complete: bool
+    upload_url: str
+
 class ErrorResponse(BaseModel):
     error: str
     detail: Optional[str] = None
@@ -323,18 +1587,8 @@ class NewPatientConsultationData(BaseModel):
     national_id: Optional[str] = None
 
 # AI Summary Generation Function
-async def generate_consultation_summary(transcript: str) -> str:
-    """Generate AI-powered consultation summary using GPT-4."""
-    try:
-        logger.info("Generating AI consultation summary with GPT-4...")
-        
-        # Skip summary if transcript is too short
-        if len(transcript.strip()) < 50:
-            logger.info("Transcript too short for meaningful summary")
-            return "Transcript too short for summary generation."
-        
-        # Medical prompt for GPT-4 - always respond in English
-        medical_prompt = """You are a medical assistant helping an oncologist. You can understand multiple languages but must always respond in English.
+# Medical prompt for GPT-4 - always respond in English
+CONSULTATION_SUMMARY_PROMPT = """You are a medical assistant helping an oncologist. You can understand multiple languages but must always respond in English.
 
 IMPORTANT: Always respond in ENGLISH regardless of the input language. Even if the transcript is in Arabic, French, Spanish, or any other language, your summary must be in English.
 
@@ -345,15 +1599,237 @@ Given the following transcript, create bullet points focusing on:
 - comorbidities and relevant medical history
 
 Only include direct facts, no generic comments. Be precise and use a clinical tone. Always write your summary in English."""
+
+# Long recordings are summarized part by part while later chunks are still being transcribed;
+# once the last chunk lands, the partial notes are merged into the usual summary.
+PARTIAL_SUMMARY_PROMPT = """You are a medical assistant helping an oncologist. You can understand multiple languages but must always respond in English.
+
+You are given ONE PART of a longer consultation transcript. Write concise bullet-point notes of every clinical fact stated in this part:
+- history of present illness
+- significant past events
+- planned investigations or treatments
+- comorbidities and relevant medical history
+- medications, allergies, doses, dates and test results, exactly as stated
+
+Only include facts from this part, no generic comments and no conclusions about parts you have not seen. Always write in English."""
+
+MERGE_SUMMARY_PROMPT = """You are a medical assistant helping an oncologist. Always respond in English.
+
+You are given clinical notes taken from consecutive parts of ONE consultation, in order. Combine them into the final consultation summary as bullet points focusing on:
+- history of present illness  
+- significant past events
+- planned investigations or treatments
+- comorbidities and relevant medical history
+
+Merge facts repeated across parts into one bullet. When parts disagree, keep what was said later in the consultation. Keep every specific fact (drugs, doses, dates, results). Only include direct facts, no generic comments. Be precise and use a clinical tone."""
+
+# Token-aware summarization. gpt-4 has an 8k context, and latency grows with input length,
+# so a transcript over SUMMARY_SINGLE_PASS_TOKENS is split on its "[Segment N]" (or
+# "[Page N]") labels into parts of at most SUMMARY_PART_TOKENS, the parts are summarized
+# concurrently, and the notes are merged, in rounds if they don't fit one merge call.
+SUMMARY_CONTEXT_TOKENS = int(os.getenv("SUMMARY_CONTEXT_TOKENS", "8192"))
+SUMMARY_SINGLE_PASS_TOKENS = int(os.getenv("SUMMARY_SINGLE_PASS_TOKENS", "3000"))
+SUMMARY_PART_TOKENS = int(os.getenv("SUMMARY_PART_TOKENS", "2500"))
+SUMMARY_RESPONSE_TOKENS = 500  # max_tokens of the single-shot and merge calls
+SEGMENT_LABEL = re.compile(r"(?=\[(?:Segment|Page) \d+\])")
+token_encodings: dict = {}
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Tokens in text for model; without tiktoken, a deliberately high estimate (one per 3 UTF-8 bytes)."""
+    if tiktoken is not None and model not in token_encodings:
+        try:
+            try:
+                token_encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                token_encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # tiktoken downloads its BPE files on first use, which fails on an offline host
+            logger.warning(f"Could not load the tiktoken encoding for {model} ({str(e)}), estimating token counts")
+            token_encodings[model] = None
+    if tiktoken is None or token_encodings[model] is None:
+        return math.ceil(len(text.encode("utf-8")) / 3)
+    return len(token_encodings[model].encode(text, disallowed_special=()))
+
+def split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """Split one oversized piece of text on word boundaries into pieces of about max_tokens."""
+    words = text.split()
+    if not words:
+        return []
+    words_per_piece = max(1, int(len(words) * max_tokens / max(count_tokens(text), 1)))
+    return [" ".join(words[start:start + words_per_piece]) for start in range(0, len(words), words_per_piece)]
+
+def split_transcript(transcript: str, max_tokens: int = SUMMARY_PART_TOKENS) -> List[str]:
+    """Pack consecutive segments into parts of at most max_tokens, keeping each segment whole when it fits."""
+    parts: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for segment in (piece.strip() for piece in SEGMENT_LABEL.split(transcript)):
+        if not segment:
+            continue
+        tokens = count_tokens(segment)
+        pieces = [(segment, tokens)] if tokens <= max_tokens else [
+            (piece, count_tokens(piece)) for piece in split_by_tokens(segment, max_tokens)
+        ]
+        for piece, piece_tokens in pieces:
+            if current and current_tokens + piece_tokens > max_tokens:
+                parts.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        parts.append("\n\n".join(current))
+    return parts
+
+async def summarize_transcript_part(part_text: str, part_number: int) -> str:
+    """Bullet-point notes for one part of a long transcript (raises on failure)."""
+    response = await chat_completion(
+        "summary",
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": PARTIAL_SUMMARY_PROMPT},
+            {"role": "user", "content": f"Part {part_number} of the consultation transcript:\n\n{part_text}"}
+        ],
+        max_tokens=400,
+        temperature=0.3
+    )
+    return response.choices[0].message.content.strip()
+
+async def merge_partial_summaries(partial_summaries: List[str]) -> str:
+    """Merge per-part notes, in consultation order, into one summary (raises on failure).
+
+    When the notes are too long for one call, consecutive groups are merged concurrently
+    first and their results merged again, until one call can take them all. A note longer
+    than half a merge call is truncated, so every group takes at least two notes and each
+    round shrinks the list.
+    """
+    merge_budget = SUMMARY_CONTEXT_TOKENS - count_tokens(MERGE_SUMMARY_PROMPT) - SUMMARY_RESPONSE_TOKENS - 100
+    note_limit = merge_budget // 2 - 10  # minus the "[Part N]" label
+    partial_summaries = list(partial_summaries)
+    for index, partial_summary in enumerate(partial_summaries):
+        if count_tokens(partial_summary) > note_limit:
+            logger.warning(f"Partial summary {index + 1} is over {note_limit} tokens, truncating it for the merge")
+            partial_summaries[index] = split_by_tokens(partial_summary, note_limit)[0]
+    groups: List[List[str]] = [[]]
+    group_tokens = 0
+    for partial_summary in partial_summaries:
+        tokens = count_tokens(partial_summary) + 10  # plus the "[Part N]" label
+        if groups[-1] and group_tokens + tokens > merge_budget:
+            groups.append([])
+            group_tokens = 0
+        groups[-1].append(partial_summary)
+        group_tokens += tokens
+    if len(groups) > 1:
+        logger.info(f"Merging {len(partial_summaries)} partial summaries in {len(groups)} groups first")
+        merged = iter(await asyncio.gather(*(merge_partial_summaries(group) for group in groups if len(group) > 1)))
+        return await merge_partial_summaries([next(merged) if len(group) > 1 else group[0] for group in groups])
+
+    notes = "\n\n".join(
+        f"[Part {part_number}]\n{partial_summary}"
+        for part_number, partial_summary in enumerate(partial_summaries, 1)
+    )
+    response = await chat_completion(
+        "summary",
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": MERGE_SUMMARY_PROMPT},
+            {"role": "user", "content": notes}
+        ],
+        max_tokens=SUMMARY_RESPONSE_TOKENS,
+        temperature=0.3
+    )
+    return response.choices[0].message.content.strip()
+
+async def summarize_transcript_parts(text: str, first_part_number: int = 1) -> List[str]:
+    """Notes for text split into parts of at most SUMMARY_PART_TOKENS, summarized concurrently (raises on failure)."""
+    parts = split_transcript(text)
+    return list(await asyncio.gather(
+        *(summarize_transcript_part(part, part_number) for part_number, part in enumerate(parts, first_part_number))
+    ))
+
+async def map_reduce_summary(transcript: str) -> str:
+    """Summarize a long transcript part by part, concurrently, then merge the notes (raises on failure)."""
+    started = time.perf_counter()
+    partial_summaries = await summarize_transcript_parts(transcript)
+    summary = await merge_partial_summaries(partial_summaries)
+    logger.info(f"Map-reduce summary of {len(partial_summaries)} parts in {time.perf_counter() - started:.1f}s")
+    return summary
+
+class StreamingSummary:
+    """Summarize a recording's chunks as they are transcribed, then merge the notes.
+
+    Pass add_chunk as the chunk callback of process_audio_file. Chunk notes are written
+    while the remaining chunks are still transcribing, so only the merge is left once the
+    transcript is complete. With fewer than two usable chunks (short audio, text, PDF, a
+    cached transcript) or if any part fails, finish() falls back to a single-shot summary.
+    """
+
+    def __init__(self):
+        self._parts: dict = {}  # chunk index -> task returning the chunk's partial summaries
+
+    def add_chunk(self, index: int, text: str) -> None:
+        # A chunk longer than SUMMARY_PART_TOKENS (dense or non-English speech) is summarized in sub-parts
+        if len(text.strip()) >= 50 and not text.startswith("Transcription failed") and index not in self._parts:
+            self._parts[index] = asyncio.create_task(summarize_transcript_parts(text, index + 1))
+
+    @property
+    def streaming(self) -> bool:
+        """True once enough chunks were summarized for finish() to merge them."""
+        return len(self._parts) >= 2
+
+    def cancel(self) -> None:
+        for task in self._parts.values():
+            task.cancel()
+
+    async def finish(self, transcript: str) -> str:
+        if not self.streaming:
+            self.cancel()
+            return await generate_consultation_summary(transcript)
+        pending = sum(not task.done() for task in self._parts.values())
+        started = time.perf_counter()
+        try:
+            partial_summaries = [note for index in sorted(self._parts) for note in await self._parts[index]]
+            summary = await merge_partial_summaries(partial_summaries)
+        except Exception as e:
+            logger.warning(f"Streaming summary failed ({str(e)}), falling back to a single-shot summary")
+            self.cancel()
+            return await generate_consultation_summary(transcript)
+        logger.info(
+            f"Merged {len(partial_summaries)} partial summaries ({len(self._parts) - pending} ready when "
+            f"transcription finished) in {time.perf_counter() - started:.1f}s: {len(summary)} characters"
+        )
+        return summary
+
+async def generate_consultation_summary(transcript: str) -> str:
+    """Generate AI-powered consultation summary using GPT-4."""
+    try:
+        logger.info("Generating AI consultation summary with GPT-4...")
+        
+        # Skip summary if transcript is too short
+        if len(transcript.strip()) < 50:
+            logger.info("Transcript too short for meaningful summary")
+            return "Transcript too short for summary generation."
+        
+        # Long transcripts would overflow gpt-4's context (and are slow in one call): map-reduce them
+        transcript_tokens = count_tokens(transcript)
+        single_pass_limit = min(
+            SUMMARY_SINGLE_PASS_TOKENS,
+            SUMMARY_CONTEXT_TOKENS - count_tokens(CONSULTATION_SUMMARY_PROMPT) - SUMMARY_RESPONSE_TOKENS - 100
+        )
+        if transcript_tokens > single_pass_limit:
+            logger.info(f"Transcript is {transcript_tokens} tokens, summarizing it in parts")
+            summary = await map_reduce_summary(transcript)
+            logger.info(f"Generated summary: {len(summary)} characters")
+            return summary
         
         # Create the chat completion request
-        response = openai.chat.completions.create(
+        response = await chat_completion(
+            "summary",
             model="gpt-4",
             messages=[
-                {"role": "system", "content": medical_prompt},
+                {"role": "system", "content": CONSULTATION_SUMMARY_PROMPT},
                 {"role": "user", "content": transcript}
             ],
-            max_tokens=500,
+            max_tokens=SUMMARY_RESPONSE_TOKENS,
             temperature=0.3
         )
         
@@ -451,14 +1927,16 @@ Format:
             }
         ]
         
-        response = openai.chat.completions.create(
+        response = await chat_completion(
+            "extraction",
             model="gpt-4o-mini",
             messages=messages,
             temperature=0.1,
-            max_tokens=2000
+            max_tokens=2000,
+            cache_if=is_json_reply
         )
         
-        demographics_text = response.choices[0].message.content.strip()
+        demographics_text = json_reply_text(response)
         
         # Parse the JSON response
         import json
@@ -481,8 +1959,6 @@ Format:
 async def parse_clinical_data_from_summary(summary: str) -> dict:
     """Parse structured clinical data from consultation summary using OpenAI."""
     try:
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        
         prompt = f"""
         Please extract both CLINICAL and DEMOGRAPHIC information from the following consultation summary.
         Return a JSON object with the following fields:
@@ -524,27 +2000,21 @@ async def parse_clinical_data_from_summary(summary: str) -> dict:
         Return only valid JSON:
         """
         
-        response = client.chat.completions.create(
+        response = await chat_completion(
+            "extraction",
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are a medical assistant that extracts structured clinical and demographic data from consultation notes. Always return valid JSON only. Only extract information explicitly mentioned in the conversation."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.1,
-            max_tokens=1500
+            max_tokens=1500,
+            cache_if=is_json_reply
         )
         
-        # Parse the JSON response
-        clinical_data = response.choices[0].message.content.strip()
-        
-        # Remove any markdown formatting if present
-        if clinical_data.startswith("```json"):
-            clinical_data = clinical_data[7:]
-        if clinical_data.endswith("```"):
-            clinical_data = clinical_data[:-3]
-        
+        # Parse the JSON response (without any markdown formatting)
         import json
-        return json.loads(clinical_data)
+        return json.loads(json_reply_text(response))
         
     except Exception as e:
         logger.error(f"Failed to parse clinical data: {str(e)}")
@@ -568,15 +2038,15 @@ async def parse_clinical_data_from_summary(summary: str) -> dict:
             "city_of_birth": None,
             "address": None,
             "emergency_contact": None,
-            "insurance": None
+            "insurance": None,
+            "extraction_error": str(e)
         }
 
-async def extract_comprehensive_clinical_data(transcript: str, summary: str) -> dict:
-    """Extract comprehensive clinical data including symptoms, biomarkers, response, risk factors."""
-    try:
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        
-        prompt = f"""
+# gpt-4 has an 8k context: when the transcript would overflow it, the call gets only the
+# (map-reduced) summary instead of the transcript and summary
+COMPREHENSIVE_RESPONSE_TOKENS = 2000
+
+COMPREHENSIVE_EXTRACTION_PROMPT = """
         Extract comprehensive oncology clinical data from this consultation transcript and summary.
         
         Return a JSON object with these sections:
@@ -602,7 +2072,7 @@ async def extract_comprehensive_clinical_data(transcript: str, summary: str) ->
         TREATMENT RESPONSE (if applicable):
         - response_type: "complete", "partial", "stable", "progression"
         - response_criteria: "RECIST", "WHO", etc.
-        - adverse_events: [{"event": "", "grade": 1-5, "attribution": "related/unrelated"}]
+        - adverse_events: [{{"event": "", "grade": 1-5, "attribution": "related/unrelated"}}]
         - dose_modifications: true/false
         
         RISK ASSESSMENT:
@@ -610,7 +2080,7 @@ async def extract_comprehensive_clinical_data(transcript: str, summary: str) ->
         - pack_years: calculated value if smoking history given
         - quit_date: date if former smoker
         - asbestos_exposure: true/false
-        - family_cancer_history: [{"relation": "", "cancer_type": "", "age_at_diagnosis": ""}]
+        - family_cancer_history: [{{"relation": "", "cancer_type": "", "age_at_diagnosis": ""}}]
         
         PSYCHOSOCIAL:
         - depression_screening_result: if mental health mentioned
@@ -627,32 +2097,36 @@ async def extract_comprehensive_clinical_data(transcript: str, summary: str) ->
         
         Use null for fields not mentioned. Only extract information explicitly stated.
         
-        Transcript: {transcript}
-        Summary: {summary}
+        {sources}
         
         Return only valid JSON:
         """
-        
-        response = client.chat.completions.create(
+
+async def extract_comprehensive_clinical_data(transcript: str, summary: str) -> dict:
+    """Extract comprehensive clinical data including symptoms, biomarkers, response, risk factors."""
+    try:
+        sources = f"Transcript: {transcript}\n        Summary: {summary}"
+        prompt_budget = SUMMARY_CONTEXT_TOKENS - COMPREHENSIVE_RESPONSE_TOKENS - 100
+        if count_tokens(COMPREHENSIVE_EXTRACTION_PROMPT.format(sources=sources)) > prompt_budget:
+            logger.info("Transcript too long for comprehensive extraction, extracting from the summary only")
+            sources = f"Summary: {summary}"
+        prompt = COMPREHENSIVE_EXTRACTION_PROMPT.format(sources=sources)
+        
+        response = await chat_completion(
+            "extraction",
             model="gpt-4",
             messages=[
                 {"role": "system", "content": "You are a medical AI that extracts structured oncology data. Always return valid JSON only."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.1,
-            max_tokens=2000
+            max_tokens=COMPREHENSIVE_RESPONSE_TOKENS,
+            cache_if=is_json_reply
         )
         
-        clinical_text = response.choices[0].message.content.strip()
-        
         # Clean and parse JSON
-        if clinical_text.startswith("```json"):
-            clinical_text = clinical_text[7:]
-        if clinical_text.endswith("```"):
-            clinical_text = clinical_text[:-3]
-        
         import json
-        return json.loads(clinical_text)
+        return json.loads(json_reply_text(response))
         
     except Exception as e:
         logger.error(f"Failed to extract comprehensive clinical data: {str(e)}")
@@ -666,6 +2140,591 @@ async def extract_comprehensive_clinical_data(transcript: str, summary: str) ->
             "extraction_error": str(e)
         }
 
+# Unified extraction: the summary, demographics, basic clinical fields and (for comprehensive
+# consultations) the six oncology domains come from ONE JSON-schema-constrained call over the
+# transcript, instead of re-sending the same content to four prompts. Adapters return the
+# exact shapes of the separate extractors, which remain the fallback if the call fails
+# (EXTRACTION_MODE=separate restores them outright).
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "unified")
+UNIFIED_EXTRACTION_MODEL = os.getenv("UNIFIED_EXTRACTION_MODEL", "gpt-4o")
+UNIFIED_EXTRACTION_CONTEXT_TOKENS = int(os.getenv("UNIFIED_EXTRACTION_CONTEXT_TOKENS", "128000"))
+UNIFIED_RESPONSE_TOKENS = 3000
+
+DEMOGRAPHIC_FIELD_TYPES = {
+    "first_name": "string", "last_name": "string", "father_name": "string", "mother_name": "string",
+    "age": "integer", "date_of_birth": "string", "gender": "string",
+    "phone_1": "string", "phone_2": "string", "email": "string", "address": "string",
+    "occupation": "string", "education": "string", "marital_status": "string", "children_count": "integer",
+    "country_of_birth": "string", "city_of_birth": "string", "national_id": "string",
+    "file_reference": "string", "case_number": "string",
+    "referring_physician_name": "string", "referring_physician_phone_1": "string", "referring_physician_email": "string",
+    "third_party_payer": "string", "medical_ref_number": "string",
+}
+CLINICAL_FIELD_TYPES = {
+    "chief_complaint": "string", "history_present_illness": "string", "past_medical_history": "string",
+    "medications": "string", "allergies": "string", "diagnosis": "string", "plan": "string",
+    "age": "integer", "gender": "string", "occupation": "string", "education": "string",
+    "marital_status": "string", "children_count": "integer", "smoking": "boolean",
+    "country_of_birth": "string", "city_of_birth": "string", "address": "string",
+    "emergency_contact": "string", "insurance": "string",
+}
+
+def _nullable(json_type: str, **extra) -> dict:
+    return {"type": [json_type, "null"], **extra}
+
+def _object_schema(properties: dict) -> dict:
+    # Structured outputs (strict mode) need every property listed as required; absence is null
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+ONCOLOGY_DOMAIN_SCHEMAS = {
+    "symptom_assessment": _object_schema({
+        "pain_scale": _nullable("integer"),
+        "fatigue_level": _nullable("string"),
+        "appetite_change": _nullable("string"),
+        "weight_change_lbs": _nullable("number"),
+        "weight_change_timeframe": _nullable("string"),
+        "karnofsky_score": _nullable("integer"),
+        "nccn_distress_score": _nullable("integer"),
+        "activities_daily_living": _nullable("string"),
+    }),
+    "biomarker_results": _object_schema({
+        "egfr_status": _nullable("string"),
+        "alk_status": _nullable("string"),
+        "pdl1_expression": _nullable("string"),
+        "msi_status": _nullable("string"),
+        "tumor_mutational_burden": _nullable("string"),
+        "germline_testing_recommended": _nullable("boolean"),
+    }),
+    "treatment_response": _object_schema({
+        "response_type": _nullable("string"),
+        "response_criteria": _nullable("string"),
+        "adverse_events": _nullable("array", items=_object_schema({
+            "event": {"type": "string"}, "grade": _nullable("integer"), "attribution": _nullable("string"),
+        })),
+        "dose_modifications": _nullable("boolean"),
+    }),
+    "risk_assessment": _object_schema({
+        "smoking_status": _nullable("string"),
+        "pack_years": _nullable("number"),
+        "quit_date": _nullable("string"),
+        "asbestos_exposure": _nullable("boolean"),
+        "family_cancer_history": _nullable("array", items=_object_schema({
+            "relation": {"type": "string"}, "cancer_type": _nullable("string"), "age_at_diagnosis": _nullable("string"),
+        })),
+    }),
+    "psychosocial": _object_schema({
+        "depression_screening_result": _nullable("string"),
+        "primary_caregiver": _nullable("string"),
+        "transportation_barriers": _nullable("boolean"),
+        "financial_distress": _nullable("boolean"),
+        "prognosis_discussed": _nullable("boolean"),
+    }),
+    "clinical_trials": _object_schema({
+        "trial_name": _nullable("string"),
+        "eligibility_assessed": _nullable("boolean"),
+        "tumor_board_date": _nullable("string"),
+        "second_opinion_requested": _nullable("boolean"),
+    }),
+}
+
+def unified_extraction_schema(include_summary: bool, include_demographics: bool, include_oncology: bool) -> dict:
+    """The response schema, limited to the sections a pipeline actually uses."""
+    properties = {}
+    if include_summary:
+        properties["summary"] = {"type": "string"}
+    if include_demographics:
+        properties["demographics"] = _object_schema({
+            **{field: _nullable(json_type) for field, json_type in DEMOGRAPHIC_FIELD_TYPES.items()},
+            "confidence_level": {"type": "string", "enum": ["high", "medium", "low"]},
+        })
+    properties["clinical"] = _object_schema({field: _nullable(json_type) for field, json_type in CLINICAL_FIELD_TYPES.items()})
+    if include_oncology:
+        properties.update(ONCOLOGY_DOMAIN_SCHEMAS)
+    return _object_schema(properties)
+
+UNIFIED_EXTRACTION_PROMPT = """You are a medical assistant helping an oncologist. The consultation transcript may be in any language (Arabic, English, French, ...), but everything you return MUST be in English: translate names, places, occupations and all other values.
+
+Fill in the JSON schema from the transcript:
+- summary: bullet points on the history of present illness, significant past events, planned investigations or treatments, and comorbidities and relevant medical history. Only direct facts, no generic comments; precise, clinical tone.
+- demographics: the patient's identity and contact details, family, social and administrative data (file/case/medical reference numbers, referring physician, third-party payer). Give age as a number and date_of_birth as YYYY-MM-DD. confidence_level is your confidence in the demographics overall.
+- clinical: chief complaint, history of present illness, past medical history, medications, allergies, diagnosis or impression, plan, and the listed social fields. smoking is true for a smoker, false for an explicit non-smoker.
+- Any oncology sections: symptoms (pain 0-10, fatigue none/mild/moderate/severe, Karnofsky 0-100, NCCN distress 0-10, ADL independent/assisted/dependent), biomarkers, treatment response (complete/partial/stable/progression, adverse events with CTCAE grade), risk factors (smoking never/former/current, pack-years, exposures, family cancer history), psychosocial needs, and clinical trial / tumor board information.
+
+Use null for anything that is not explicitly stated or is unclear. Never guess."""
+
+def unified_extraction_fits(text: str, include_summary: bool, include_demographics: bool, include_oncology: bool) -> bool:
+    """Whether text, with the prompt, the schema and the response, fits UNIFIED_EXTRACTION_MODEL's context."""
+    schema = unified_extraction_schema(include_summary, include_demographics, include_oncology)
+    overhead = (
+        count_tokens(UNIFIED_EXTRACTION_PROMPT, UNIFIED_EXTRACTION_MODEL)
+        + count_tokens(json.dumps(schema), UNIFIED_EXTRACTION_MODEL)
+        + UNIFIED_RESPONSE_TOKENS + 100
+    )
+    return count_tokens(text, UNIFIED_EXTRACTION_MODEL) + overhead <= UNIFIED_EXTRACTION_CONTEXT_TOKENS
+
+async def extract_consultation_unified(transcript: str, include_summary: bool = True, include_demographics: bool = True, include_oncology: bool = False, from_summary: bool = False) -> Optional[dict]:
+    """Run the single structured extraction call; None if it fails (callers fall back to the separate extractors).
+
+    With from_summary, transcript is the consultation's merged summary rather than its transcript.
+    """
+    if not unified_extraction_fits(transcript, include_summary, include_demographics, include_oncology):
+        logger.warning(f"{'Summary' if from_summary else 'Transcript'} is too long for unified extraction, falling back to separate calls")
+        return None
+    try:
+        started = time.perf_counter()
+        response = await chat_completion(
+            "extraction",
+            model=UNIFIED_EXTRACTION_MODEL,
+            messages=[
+                {"role": "system", "content": UNIFIED_EXTRACTION_PROMPT},
+                {"role": "user", "content": f"Consultation {'summary' if from_summary else 'transcript'}:\n\n{transcript}"}
+            ],
+            response_format={
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "consultation_extraction",
+                    "strict": True,
+                    "schema": unified_extraction_schema(include_summary, include_demographics, include_oncology),
+                },
+            },
+            temperature=0.1,
+            max_tokens=UNIFIED_RESPONSE_TOKENS,
+            cache_if=is_json_reply
+        )
+        data = json.loads(response.choices[0].message.content)
+        usage = response.usage
+        logger.info(
+            f"Unified extraction in {time.perf_counter() - started:.1f}s"
+            + (f": {usage.prompt_tokens} prompt + {usage.completion_tokens} completion tokens" if usage else "")
+        )
+        return data
+    except Exception as e:
+        logger.error(f"Unified extraction failed, falling back to separate calls: {str(e)}")
+        return None
+
+def unified_demographics(data: dict) -> dict:
+    """Unified result in the shape of extract_patient_demographics_from_transcript."""
+    section = dict(data["demographics"])
+    confidence_level = section.pop("confidence_level", "medium")
+    section["extraction_metadata"] = {
+        "extracted_fields": [field for field in DEMOGRAPHIC_FIELD_TYPES if section.get(field) is not None],
+        "not_found_fields": [field for field in DEMOGRAPHIC_FIELD_TYPES if section.get(field) is None],
+        "confidence_level": confidence_level,
+    }
+    return section
+
+def unified_clinical(data: dict) -> dict:
+    """Unified result in the shape of parse_clinical_data_from_summary."""
+    return dict(data["clinical"])
+
+def unified_comprehensive(data: dict) -> dict:
+    """Unified result in the shape of extract_comprehensive_clinical_data."""
+    return {domain: data[domain] for domain in ONCOLOGY_DOMAIN_SCHEMAS}
+
+class ConsultationExtractor:
+    """Summary and structured extraction for one consultation, via the unified call when possible.
+
+    All four methods share one unified call, started by whichever runs first. When the
+    StreamingSummary already summarized a long recording chunk by chunk, the summary comes
+    from its merge and the unified call covers only the structured sections. A transcript
+    too long for the unified call is summarized part by part first, and the structured
+    sections are extracted from that merged summary. Any section the unified call could
+    not provide falls back to its separate extractor.
+    """
+
+    def __init__(self, summarizer: "StreamingSummary", include_demographics: bool = True, include_oncology: bool = False):
+        self.summarizer = summarizer
+        self.include_demographics = include_demographics
+        self.include_oncology = include_oncology
+        self._unified: Optional[asyncio.Task] = None
+        self._summary: Optional[asyncio.Task] = None
+
+    def _merged_summary(self, transcript: str) -> Awaitable[str]:
+        if self._summary is None:
+            self._summary = asyncio.create_task(self.summarizer.finish(transcript))
+        return self._summary
+
+    def _unified_result(self, transcript: str) -> Awaitable[Optional[dict]]:
+        if self._unified is None:
+            self._unified = asyncio.create_task(self._extract_unified(transcript))
+        return self._unified
+
+    async def _extract_unified(self, transcript: str) -> Optional[dict]:
+        include_summary = not self.summarizer.streaming
+        if unified_extraction_fits(transcript, include_summary, self.include_demographics, self.include_oncology):
+            return await extract_consultation_unified(
+                transcript,
+                include_summary=include_summary,
+                include_demographics=self.include_demographics,
+                include_oncology=self.include_oncology
+            )
+        logger.info("Transcript is too long for unified extraction, extracting from its merged summary")
+        return await extract_consultation_unified(
+            await self._merged_summary(transcript),
+            include_summary=False,
+            include_demographics=self.include_demographics,
+            include_oncology=self.include_oncology,
+            from_summary=True
+        )
+
+    async def _unified_data(self, transcript: str) -> Optional[dict]:
+        if EXTRACTION_MODE != "unified" or len(transcript.strip()) < 50:
+            return None
+        return await self._unified_result(transcript)
+
+    async def summary(self, transcript: str) -> str:
+        if self.summarizer.streaming:
+            if EXTRACTION_MODE == "unified" and len(transcript.strip()) >= 50:
+                self._unified_result(transcript)  # structured sections run alongside the merge
+            return await self._merged_summary(transcript)
+        data = await self._unified_data(transcript)
+        if data and data.get("summary"):
+            return data["summary"].strip()
+        return await self._merged_summary(transcript)
+
+    async def clinical(self, transcript: str, summary: str) -> dict:
+        data = await self._unified_data(transcript)
+        if data:
+            return unified_clinical(data)
+        return await parse_clinical_data_from_summary(summary)
+
+    async def demographics(self, transcript: str) -> dict:
+        data = await self._unified_data(transcript) if self.include_demographics else None
+        if data:
+            return unified_demographics(data)
+        return await extract_patient_demographics_from_transcript(transcript)
+
+    async def comprehensive(self, transcript: str, summary: str) -> dict:
+        data = await self._unified_data(transcript) if self.include_oncology else None
+        if data:
+            return unified_comprehensive(data)
+        return await extract_comprehensive_clinical_data(transcript, summary)
+
+# ===============================
+# BACKGROUND CONSULTATION JOBS
+# ===============================
+
+# Idempotency-Key of the request being handled (set by the idempotency middleware)
+request_idempotency_key: contextvars.ContextVar = contextvars.ContextVar("request_idempotency_key", default=None)
+
+def new_run_scope() -> str:
+    """Checkpoint scope for a new consultation: its Idempotency-Key, so a retried request resumes, else a fresh id."""
+    key = request_idempotency_key.get()
+    return f"key:{key}" if key else uuid.uuid4().hex
+
+@dataclass
+class ConsultationInput:
+    """A spooled upload plus the request fields a consultation pipeline needs."""
+    upload: StoredUpload
+    filename: str
+    unique_filename: str
+    content_type: Optional[str]
+    patient_id: Optional[str] = None
+    run_scope: str = dataclass_field(default_factory=new_run_scope)  # kept in job params, so a job retry resumes too
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConsultationInput":
+        return cls(**{**data, "upload": StoredUpload(**data["upload"])})
+
+def enter_work_context(consultation: ConsultationInput) -> None:
+    """Tag the current task (and the tasks it starts) with the consultation's scheduling class and patient."""
+    work_class.set(work_class_for(consultation.content_type))
+    work_tenant.set(consultation.patient_id or consultation.unique_filename)
+
+# Pipelines call report_progress(stage, fraction) as they move from stage to stage
+ProgressCallback = Callable[[str, float], Awaitable[None]]
+
+async def ignore_progress(stage: str, progress: float) -> None:
+    pass
+
+class JobStore:
+    """Background jobs persisted in a local SQLite file so they survive a restart."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, stage TEXT, "
+            "progress REAL NOT NULL DEFAULT 0, params TEXT NOT NULL, result TEXT, error TEXT, "
+            "created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def create(self, kind: str, params: dict) -> dict:
+        now = datetime.utcnow().isoformat()
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, stage, progress, params, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', 'queued', 0, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), now, now)
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def update(self, job_id: str, **fields) -> None:
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def unfinished(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def failed_before(self, max_age_hours: float) -> List[dict]:
+        """Failed jobs that have not been updated (retried) for max_age_hours."""
+        cutoff = datetime.utcfromtimestamp(time.time() - max_age_hours * 3600).isoformat()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'failed' AND updated_at < ?", (cutoff,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+STATE_DIR = os.getenv("STATE_DIR", "/tmp/ai-clinic-state")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# A failed job keeps its upload so it can be retried (POST /jobs/{id}/retry) for this long
+FAILED_JOB_RETENTION_HOURS = float(os.getenv("FAILED_JOB_RETENTION_HOURS", "24"))
+job_store = JobStore(os.path.join(STATE_DIR, "jobs.sqlite3"))
+job_queue: asyncio.PriorityQueue = asyncio.PriorityQueue()  # (class rank, created_at, job id)
+JOB_CLASS_RANKS = {"interactive": 0, "batch": 1}
+job_worker_tasks: List[asyncio.Task] = []
+
+# Pipeline checkpoints: each completed stage of a consultation run (transcript, summary,
+# extractions, ids of rows already written) is persisted, so a retry of the same upload for
+# the same patient resumes after the last completed stage. Checkpoints are dropped once a
+# run succeeds, or after CHECKPOINT_TTL_HOURS.
+CHECKPOINT_TTL_HOURS = float(os.getenv("CHECKPOINT_TTL_HOURS", "72"))
+
+class CheckpointStore:
+    """Completed pipeline stages, persisted in a local SQLite file."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "run_key TEXT NOT NULL, stage TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (run_key, stage))"
+        )
+        self._conn.commit()
+
+    def get(self, run_key: str, stage: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM checkpoints WHERE run_key = ? AND stage = ?", (run_key, stage)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, run_key: str, stage: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (run_key, stage, value, updated_at) VALUES (?, ?, ?, ?)",
+                (run_key, stage, value, time.time())
+            )
+            self._conn.commit()
+
+    def clear(self, run_key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE run_key = ?", (run_key,))
+            self._conn.commit()
+
+    def purge_older_than(self, max_age_seconds: float) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE updated_at < ?", (time.time() - max_age_seconds,))
+            self._conn.commit()
+
+pipeline_checkpoints = CheckpointStore(os.path.join(STATE_DIR, "checkpoints.sqlite3"))
+
+class PipelineRun:
+    """One consultation pipeline run, identified by pipeline kind + upload content + patient + run scope.
+
+    The run scope (see new_run_scope) keeps two requests for the same content apart: only a
+    retry of the same request (same Idempotency-Key, or the same job) shares checkpoints.
+    """
+
+    def __init__(self, kind: str, consultation: ConsultationInput):
+        self.run_key = self.key_for(kind, consultation)
+
+    @staticmethod
+    def key_for(kind: str, consultation: ConsultationInput) -> str:
+        return hashlib.sha256(
+            json.dumps([kind, consultation.upload.sha256, consultation.patient_id, consultation.run_scope]).encode("utf-8")
+        ).hexdigest()
+
+    async def stage(self, name: str, compute: Callable, is_complete: Callable = None,
+                    encode: Callable = json.dumps, decode: Callable = json.loads):
+        """Return the checkpointed result of stage `name`, or compute it and checkpoint it.
+
+        compute may return a value or an awaitable. Results that is_complete rejects (the
+        "... failed" fallbacks of the LLM helpers) are returned but not checkpointed, so a
+        retry runs that stage again.
+        """
+        stored = await asyncio.to_thread(pipeline_checkpoints.get, self.run_key, name)
+        if stored is not None:
+            logger.info(f"Resuming pipeline run {self.run_key[:12]}: '{name}' loaded from checkpoint")
+            return decode(stored)
+        value = compute()
+        if inspect.isawaitable(value):
+            value = await value
+        if is_complete is None or is_complete(value):
+            await asyncio.to_thread(pipeline_checkpoints.set, self.run_key, name, encode(value))
+        return value
+
+    async def transcribe_audio(self, consultation: ConsultationInput, on_chunk: Optional[Callable[[int, str], None]] = None) -> AudioTranscript:
+        return await self.stage(
+            "transcript",
+            lambda: process_audio_file(consultation.upload.path, consultation.unique_filename, consultation.content_type, consultation.upload.sha256, on_chunk),
+            is_complete=lambda audio: not audio.text.startswith(("Transcription failed", "Audio transcription failed")),
+            encode=encode_cached_transcript,
+            decode=decode_cached_transcript
+        )
+
+    async def complete(self) -> None:
+        await asyncio.to_thread(pipeline_checkpoints.clear, self.run_key)
+
+pipeline_run_locks: dict = {}  # run key -> [asyncio.Lock, number of holders and waiters]
+
+def exclusive_run(kind: str):
+    """Decorate a pipeline so only one run per run key is active; a second one waits, then resumes from checkpoints."""
+    def decorate(pipeline):
+        @functools.wraps(pipeline)
+        async def run_exclusively(consultation: ConsultationInput, *args, **kwargs):
+            run_key = PipelineRun.key_for(kind, consultation)
+            entry = pipeline_run_locks.setdefault(run_key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    return await pipeline(consultation, *args, **kwargs)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del pipeline_run_locks[run_key]
+        return run_exclusively
+    return decorate
+
+def summary_is_complete(summary: str) -> bool:
+    return not summary.startswith("Summary generation failed")
+
+def extraction_is_complete(data: dict) -> bool:
+    return "extraction_error" not in data and not (data.get("extraction_metadata") or {}).get("error")
+
+async def insert_row(table: str, record: dict) -> Optional[dict]:
+    """Insert one row and return it as stored (None if nothing came back)."""
+    response = await db_execute(supabase.table(table).insert(record))
+    return response.data[0] if response.data else None
+
+async def queue_job(job: dict) -> None:
+    """Put a stored job on the worker queue; interactive (text) jobs are picked up before batch audio."""
+    priority_class = work_class_for(job["params"].get("content_type"))
+    await job_queue.put((JOB_CLASS_RANKS.get(priority_class, 1), job["created_at"], job["id"]))
+
+def discard_failed_job_uploads() -> None:
+    """Delete the uploads of failed jobs that were not retried within FAILED_JOB_RETENTION_HOURS."""
+    for job in job_store.failed_before(FAILED_JOB_RETENTION_HOURS):
+        discard_temp_file(job["params"]["upload"]["path"])
+
+async def enqueue_job(kind: str, consultation: ConsultationInput) -> dict:
+    """Persist a job for a spooled upload and hand it to the worker pool."""
+    await asyncio.to_thread(discard_failed_job_uploads)
+    job = await asyncio.to_thread(job_store.create, kind, asdict(consultation))
+    await queue_job(job)
+    logger.info(f"Queued {kind} job {job['id']} for {consultation.filename}")
+    return job
+
+def job_accepted_response(job: dict) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job["id"], "status": job["status"], "status_url": f"/jobs/{job['id']}"}
+    )
+
+async def run_job(job_id: str) -> None:
+    """Run one queued job through its pipeline and record the outcome."""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if not job or job["status"] not in ("queued", "running"):
+        return
+    consultation = ConsultationInput.from_dict(job["params"])
+    transcode_can_wait.set(True)
+
+    async def report_progress(stage: str, progress: float) -> None:
+        await asyncio.to_thread(job_store.update, job_id, stage=stage, progress=progress)
+
+    try:
+        if not os.path.exists(consultation.upload.path):
+            raise RuntimeError("Uploaded file is no longer available; please upload it again")
+        await asyncio.to_thread(job_store.update, job_id, status="running", stage="started", error=None)
+        pipeline = JOB_PIPELINES[job["kind"]]
+        response = await pipeline(consultation, report_progress)
+        await asyncio.to_thread(
+            job_store.update, job_id,
+            status="succeeded", stage="completed", progress=1.0, result=response.model_dump(mode="json")
+        )
+        logger.info(f"Job {job_id} completed")
+    except Exception as e:
+        # The upload is kept so the job can be retried; its checkpoints let the retry resume
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.error(f"Job {job_id} failed: {error}")
+        await asyncio.to_thread(job_store.update, job_id, status="failed", error=error)
+        return
+    discard_temp_file(consultation.upload.path)
+
+async def job_worker(worker_number: int) -> None:
+    while True:
+        _rank, _created_at, job_id = await job_queue.get()
+        try:
+            # In its own task, so the context variables a job sets don't carry over to the next one
+            await asyncio.create_task(run_job(job_id))
+        except Exception as e:
+            logger.error(f"Job worker {worker_number} crashed on job {job_id}: {str(e)}")
+        finally:
+            job_queue.task_done()
+
+@app.on_event("startup")
+async def start_job_workers():
+    """Re-queue jobs interrupted by the last shutdown, then start the worker pool."""
+    await asyncio.to_thread(pipeline_checkpoints.purge_older_than, CHECKPOINT_TTL_HOURS * 3600)
+    await asyncio.to_thread(idempotency_store.purge_older_than, IDEMPOTENCY_TTL_HOURS * 3600)
+    await asyncio.to_thread(discard_failed_job_uploads)
+    for job in await asyncio.to_thread(job_store.unfinished):
+        if job["status"] == "running":
+            await asyncio.to_thread(job_store.update, job["id"], status="queued", stage="requeued")
+        await queue_job(job)
+        logger.info(f"Resuming {job['kind']} job {job['id']}")
+    for worker_number in range(max(1, JOB_WORKERS)):
+        job_worker_tasks.append(asyncio.create_task(job_worker(worker_number)))
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    # Interrupted jobs stay 'running' in the store and are re-queued on the next startup
+    for task in job_worker_tasks:
+        task.cancel()
+    await asyncio.gather(*job_worker_tasks, return_exceptions=True)
+    job_worker_tasks.clear()
+
 # NOTE: File storage functionality removed per user request
 # System now works with transcripts and AI processing only
 
@@ -693,7 +2752,7 @@ async def search_patients(
             # Search in both phone_1 and phone fields
             query = query.or_(f"phone_1.ilike.%{phone.strip()}%,phone.ilike.%{phone.strip()}%")
         
-        response = query.execute()
+        response = await db_execute(query)
         
         logger.info(f"Search results: {len(response.data)} patients found")
         return response.data
@@ -712,7 +2771,7 @@ async def create_patient(patient_data: PatientCreate) -> Patient:
         logger.info(f"Creating new patient: {patient_data.first_name} {patient_data.last_name}")
         
         # Check if patient already exists
-        existing = supabase.table("patients").select("*").eq("first_name", patient_data.first_name.strip()).eq("last_name", patient_data.last_name.strip()).eq("date_of_birth", patient_data.date_of_birth.strip()).execute()
+        existing = await db_execute(supabase.table("patients").select("*").eq("first_name", patient_data.first_name.strip()).eq("last_name", patient_data.last_name.strip()).eq("date_of_birth", patient_data.date_of_birth.strip()))
         
         if existing.data:
             logger.info("Patient already exists, returning existing record")
@@ -775,7 +2834,7 @@ async def create_patient(patient_data: PatientCreate) -> Patient:
         if patient_data.clinical_notes:
             patient_record["clinical_notes"] = patient_data.clinical_notes.strip()
         
-        response = supabase.table("patients").insert(patient_record).execute()
+        response = await db_execute(supabase.table("patients").insert(patient_record))
         logger.info(f"Created patient with ID: {patient_id}")
         
         return response.data[0]
@@ -787,10 +2846,197 @@ async def create_patient(patient_data: PatientCreate) -> Patient:
             detail=f"Failed to create patient: {str(e)}"
         )
 
+@exclusive_run("upload")
+async def run_upload_pipeline(consultation: ConsultationInput, report_progress: ProgressCallback = ignore_progress) -> UploadResponse:
+    """Transcribe/read an upload, summarize it, save the recording and enrich the linked patient."""
+    enter_work_context(consultation)
+    run = PipelineRun("upload", consultation)
+    summarizer = StreamingSummary()
+    patient_id = consultation.patient_id
+    
+    # Generate IDs for database (kept across retries so the recording row is upserted, not duplicated)
+    recording_id = await run.stage("recording_id", lambda: str(uuid.uuid4()))
+    current_time = datetime.utcnow()
+    
+    await report_progress("transcribing", 0.1)
+    
+    # Process file based on type
+    transcript = ""
+    segments: List[TranscriptSegment] = []
+    
+    if consultation.content_type and consultation.content_type.startswith('audio/'):
+        # Audio file - transcribe with Whisper and DO NOT store the audio file
+        logger.info("Processing audio file with Whisper transcription")
+        audio_transcript = await run.transcribe_audio(consultation, summarizer.add_chunk)
+        transcript, segments = audio_transcript.text, audio_transcript.segments
+        logger.info(f"Audio transcription completed: {len(transcript)} characters")
+        
+    elif consultation.content_type and consultation.content_type.startswith('text/'):
+        # Text file - use content directly
+        logger.info("Processing text file")
+        transcript = read_text_upload(consultation.upload)
+        
+    elif consultation.content_type == 'application/pdf':
+        # PDF file - extract text (placeholder for now)
+        logger.info("Processing PDF file")
+        transcript = await process_pdf_file(consultation.upload.path, consultation.unique_filename)
+        
+    else:
+        # Try to decode as text for other file types
+        try:
+            transcript = read_text_upload(consultation.upload)
+            logger.info("Successfully decoded file as text")
+        except UnicodeDecodeError:
+            logger.warning(f"Unsupported file type: {consultation.content_type}")
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Unsupported file type: {consultation.content_type}"
+            )
+    
+    # NOTE: We explicitly DO NOT store the audio file anywhere
+    # Only the transcript is stored in the database
+    
+    await report_progress("summarizing", 0.5)
+    
+    # Post-transcription steps run as a dependency graph: the summary, the demographics
+    # extraction (transcript only) and the patient fetch start together, and clinical
+    # parsing starts as soon as the summary is ready.
+    logger.info("Generating AI consultation summary...")
+    extractor = ConsultationExtractor(summarizer)
+    summary_task = asyncio.create_task(run.stage("summary", lambda: extractor.summary(transcript), summary_is_complete))
+    
+    async def parse_clinical() -> dict:
+        summary = await summary_task
+        await report_progress("extracting", 0.7)
+        return await run.stage("clinical", lambda: extractor.clinical(transcript, summary), extraction_is_complete)
+    
+    async def fetch_patient():
+        # Fetched after transcription (not before) so fields filled in meanwhile are not overwritten
+        return await db_execute(supabase.table("patients").select("*").eq("id", patient_id)) if patient_id else None
+    
+    summary, clinical_data, demographics, current_patient = await asyncio.gather(
+        summary_task,
+        parse_clinical(),
+        # Extract comprehensive demographic data from transcript (for existing patients too)
+        run.stage("demographics", lambda: extractor.demographics(transcript), extraction_is_complete),
+        fetch_patient()
+    )
+    
+    # NOTE: File storage disabled by user request - only storing transcript and metadata
+    public_url = None
+    
+    await report_progress("saving", 0.9)
+    
+    # Create recording record with required fields
+    recording_record = {
+        "id": recording_id,
+        "filename": consultation.unique_filename,
+        "transcript": transcript,
+        "summary": summary,
+        "patient_id": patient_id,
+        "created_at": current_time.isoformat()
+    }
+    
+    recording_response = await db_execute(supabase.table("recordings").upsert(recording_record))
+    
+    if not recording_response.data:
+        logger.error("Database insert failed: No data returned")
+        raise HTTPException(status_code=500, detail="Failed to save recording record")
+    
+    await save_recording_segments(recording_id, segments)
+    
+    # Update patient record with extracted clinical and demographic data
+    if patient_id:  # If linked to a patient, update their record
+        patient_update = {}
+        
+        # Add clinical data to patient record (only basic fields)
+        if clinical_data.get('diagnosis'):
+            patient_update["diagnosis"] = clinical_data.get('diagnosis')
+        if clinical_data.get('allergies'):
+            patient_update["allergies"] = clinical_data.get('allergies')
+        if clinical_data.get('medications'):
+            patient_update["medications"] = clinical_data.get('medications')
+        
+        # Current patient data (fetched above) shows what's missing
+        if current_patient.data:
+            patient_data = current_patient.data[0]
+            
+            # Enhanced demographic data extraction from transcript (comprehensive approach)
+            # Update demographic fields if they're missing or incomplete
+            demographic_fields = [
+                'father_name', 'mother_name', 'occupation', 'education', 
+                'marital_status', 'country_of_birth', 'city_of_birth',
+                'file_reference', 'case_number', 'referring_physician_name',
+                'referring_physician_phone_1', 'referring_physician_email',
+                'third_party_payer', 'medical_ref_number'
+            ]
+            
+            for field in demographic_fields:
+                if not patient_data.get(field) and demographics.get(field):
+                    patient_update[field] = demographics.get(field).strip()
+            
+            # Handle special cases for certain fields
+            if not patient_data.get('children_count') and demographics.get('children_count'):
+                try:
+                    patient_update["children_count"] = int(demographics.get('children_count'))
+                except (ValueError, TypeError):
+                    pass
+            
+            if patient_data.get('smoking') is None and demographics.get('smoking') is not None:
+                patient_update["smoking"] = demographics.get('smoking')
+            
+            # Update phone numbers if missing
+            if not patient_data.get('phone_2') and demographics.get('phone_2'):
+                patient_update["phone_2"] = demographics.get('phone_2').strip()
+            
+            # Update email if missing
+            if not patient_data.get('email') and demographics.get('email'):
+                patient_update["email"] = demographics.get('email').strip()
+            
+            # Enhance address if current one is empty or very basic
+            if demographics.get('address') and (
+                not patient_data.get('address') or 
+                len(patient_data.get('address', '')) < 20
+            ):
+                patient_update["address"] = demographics.get('address').strip()
+            
+            # Also update from clinical data as fallback
+            clinical_demographic_fields = ['occupation', 'education', 'marital_status']
+            for field in clinical_demographic_fields:
+                if not patient_data.get(field) and not patient_update.get(field) and clinical_data.get(field):
+                    patient_update[field] = clinical_data.get(field)
+            
+            if not patient_data.get('children_count') and not patient_update.get('children_count') and clinical_data.get('children_count'):
+                try:
+                    patient_update["children_count"] = int(clinical_data.get('children_count'))
+                except (ValueError, TypeError):
+                    pass
+            
+            if patient_data.get('smoking') is None and not patient_update.get('smoking') and clinical_data.get('smoking') is not None:
+                patient_update["smoking"] = clinical_data.get('smoking')
+        
+        # Apply updates if any
+        if patient_update:
+            update_response = await db_execute(supabase.table("patients").update(patient_update).eq("id", patient_id))
+            logger.info(f"Enhanced patient record with extracted data: {list(patient_update.keys())}")
+            logger.info(f"Updated demographic fields: {[k for k in patient_update.keys() if k not in ['diagnosis', 'allergies', 'medications']]}")
+    
+    await run.complete()
+    return UploadResponse(
+        id=recording_id,
+        filename=consultation.filename,
+        transcript=transcript,
+        summary=summary,
+        patient_id=patient_id,
+        created_at=current_time,
+        extraction_metadata=demographics.get('extraction_metadata')
+    )
+
 @app.post("/upload", response_model=UploadResponse)
 async def upload_file(
     file: UploadFile = File(...), 
-    patient_id: Optional[str] = Form(None)
+    patient_id: Optional[str] = Form(None),
+    background: bool = Query(False, description="Run as a background job and return 202 with a job id")
 ):
     """
     Process different file types: audio files (transcribe with Whisper), 
@@ -798,171 +3044,32 @@ async def upload_file(
     Store ONLY transcript/content in database linked to patient.
     NEVER store audio files to save storage space.
     """
-    try:
-        logger.info(f"Received file upload: {file.filename}, content_type: {file.content_type}, patient_id: {patient_id}")
-        
-        # Generate unique filename for identification (not for storage)
-        file_extension = Path(file.filename or "upload").suffix.lower()
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        
-        # Read file content
-        file_content = await file.read()
-        logger.info(f"File size: {len(file_content)} bytes")
-        
-        # Generate IDs for database
-        recording_id = str(uuid.uuid4())
-        current_time = datetime.utcnow()
-        
-        # Process file based on type
-        transcript = ""
-        
-        if file.content_type and file.content_type.startswith('audio/'):
-            # Audio file - transcribe with Whisper and DO NOT store the audio file
-            logger.info("Processing audio file with Whisper transcription")
-            transcript = await process_audio_file(file_content, unique_filename, file.content_type)
-            logger.info(f"Audio transcription completed: {len(transcript)} characters")
-            
-        elif file.content_type and file.content_type.startswith('text/'):
-            # Text file - use content directly
-            logger.info("Processing text file")
-            transcript = file_content.decode('utf-8')
-            
-        elif file.content_type == 'application/pdf':
-            # PDF file - extract text (placeholder for now)
-            logger.info("Processing PDF file")
-            transcript = await process_pdf_file(file_content, unique_filename)
-            
-        else:
-            # Try to decode as text for other file types
-            try:
-                transcript = file_content.decode('utf-8')
-                logger.info("Successfully decoded file as text")
-            except UnicodeDecodeError:
-                logger.warning(f"Unsupported file type: {file.content_type}")
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Unsupported file type: {file.content_type}"
-                )
-        
-        # NOTE: We explicitly DO NOT store the audio file anywhere
-        # Only the transcript is stored in the database
-        
-        # Generate AI summary after transcription
-        logger.info("Generating AI consultation summary...")
-        summary = await generate_consultation_summary(transcript)
-        
-        # Parse clinical and demographic data from summary
-        clinical_data = await parse_clinical_data_from_summary(summary)
-        
-        # Extract comprehensive demographic data from transcript (for existing patients too)
-        demographics = await extract_patient_demographics_from_transcript(transcript)
-        
-        # NOTE: File storage disabled by user request - only storing transcript and metadata
-        public_url = None
-        
-        # Create recording record with required fields
-        recording_record = {
-            "id": recording_id,
-            "filename": unique_filename,
-            "transcript": transcript,
-            "summary": summary,
-            "patient_id": patient_id,
-            "created_at": current_time.isoformat()
-        }
-        
-        recording_response = supabase.table("recordings").insert(recording_record).execute()
-        
-        if not recording_response.data:
-            logger.error("Database insert failed: No data returned")
-            raise HTTPException(status_code=500, detail="Failed to save recording record")
-        
-        # Update patient record with extracted clinical and demographic data
-        if patient_id:  # If linked to a patient, update their record
-            patient_update = {}
-            
-            # Add clinical data to patient record (only basic fields)
-            if clinical_data.get('diagnosis'):
-                patient_update["diagnosis"] = clinical_data.get('diagnosis')
-            if clinical_data.get('allergies'):
-                patient_update["allergies"] = clinical_data.get('allergies')
-            if clinical_data.get('medications'):
-                patient_update["medications"] = clinical_data.get('medications')
-            
-            # Get current patient data to check what's missing
-            current_patient = supabase.table("patients").select("*").eq("id", patient_id).execute()
-            
-            if current_patient.data:
-                patient_data = current_patient.data[0]
-                
-                # Enhanced demographic data extraction from transcript (comprehensive approach)
-                # Update demographic fields if they're missing or incomplete
-                demographic_fields = [
-                    'father_name', 'mother_name', 'occupation', 'education', 
-                    'marital_status', 'country_of_birth', 'city_of_birth',
-                    'file_reference', 'case_number', 'referring_physician_name',
-                    'referring_physician_phone_1', 'referring_physician_email',
-                    'third_party_payer', 'medical_ref_number'
-                ]
-                
-                for field in demographic_fields:
-                    if not patient_data.get(field) and demographics.get(field):
-                        patient_update[field] = demographics.get(field).strip()
-                
-                # Handle special cases for certain fields
-                if not patient_data.get('children_count') and demographics.get('children_count'):
-                    try:
-                        patient_update["children_count"] = int(demographics.get('children_count'))
-                    except (ValueError, TypeError):
-                        pass
-                
-                if patient_data.get('smoking') is None and demographics.get('smoking') is not None:
-                    patient_update["smoking"] = demographics.get('smoking')
-                
-                # Update phone numbers if missing
-                if not patient_data.get('phone_2') and demographics.get('phone_2'):
-                    patient_update["phone_2"] = demographics.get('phone_2').strip()
-                
-                # Update email if missing
-                if not patient_data.get('email') and demographics.get('email'):
-                    patient_update["email"] = demographics.get('email').strip()
-                
-                # Enhance address if current one is empty or very basic
-                if demographics.get('address') and (
-                    not patient_data.get('address') or 
-                    len(patient_data.get('address', '')) < 20
-                ):
-                    patient_update["address"] = demographics.get('address').strip()
-                
-                # Also update from clinical data as fallback
-                clinical_demographic_fields = ['occupation', 'education', 'marital_status']
-                for field in clinical_demographic_fields:
-                    if not patient_data.get(field) and not patient_update.get(field) and clinical_data.get(field):
-                        patient_update[field] = clinical_data.get(field)
-                
-                if not patient_data.get('children_count') and not patient_update.get('children_count') and clinical_data.get('children_count'):
-                    try:
-                        patient_update["children_count"] = int(clinical_data.get('children_count'))
-                    except (ValueError, TypeError):
-                        pass
-                
-                if patient_data.get('smoking') is None and not patient_update.get('smoking') and clinical_data.get('smoking') is not None:
-                    patient_update["smoking"] = clinical_data.get('smoking')
-            
-            # Apply updates if any
-            if patient_update:
-                update_response = supabase.table("patients").update(patient_update).eq("id", patient_id).execute()
-                logger.info(f"Enhanced patient record with extracted data: {list(patient_update.keys())}")
-                logger.info(f"Updated demographic fields: {[k for k in patient_update.keys() if k not in ['diagnosis', 'allergies', 'medications']]}")
-        
-        return UploadResponse(
-            id=recording_id,
+    stored_upload = None
+    try:
+        logger.info(f"Received file upload: {file.filename}, content_type: {file.content_type}, patient_id: {patient_id}")
+        
+        # Generate unique filename for identification (not for storage)
+        file_extension = Path(file.filename or "upload").suffix.lower()
+        unique_filename = f"{uuid.uuid4()}{file_extension}"
+        
+        # Stream file content to disk (never held in memory as a whole)
+        admit_transcoding(file.content_type, background)
+        stored_upload = await spool_upload(file, unique_filename)
+        logger.info(f"File size: {stored_upload.size} bytes, sha256: {stored_upload.sha256}")
+        
+        consultation = ConsultationInput(
+            upload=stored_upload,
             filename=file.filename,
-            transcript=transcript,
-            summary=summary,
-            patient_id=patient_id,
-            created_at=current_time,
-            extraction_metadata=extraction_metadata
+            unique_filename=unique_filename,
+            content_type=file.content_type,
+            patient_id=patient_id
         )
+        if background:
+            job = await enqueue_job("upload", consultation)
+            stored_upload = None  # the job owns the spooled file now
+            return job_accepted_response(job)
+        
+        return await run_upload_pipeline(consultation)
         
     except HTTPException:
         raise
@@ -972,12 +3079,79 @@ async def upload_file(
             status_code=500, 
             detail=f"Internal server error: {str(e)}"
         )
+    finally:
+        # The spooled upload is only needed until the transcript is extracted
+        if stored_upload:
+            discard_temp_file(stored_upload.path)
+
+@app.websocket("/ws/transcribe")
+async def live_transcribe(websocket: WebSocket):
+    """
+    Transcribe a consultation while it is being recorded.
+    The client sends MediaRecorder output as binary frames and {"type": "stop"} when done.
+    Each chunk is answered with {"type": "segment", "segment": n, "text": ...} (not yet
+    de-duplicated against its neighbours), then {"type": "final", "transcript": ...}.
+    """
+    await websocket.accept()
+    session_id = str(uuid.uuid4())
+    send_lock = asyncio.Lock()
+
+    async def send_segment(chunk_number: int, text: str) -> None:
+        async with send_lock:
+            await websocket.send_json({"type": "segment", "segment": chunk_number, "text": text})
+
+    live = LiveTranscription(session_id, send_segment)
+    decoder = None
+    pump = None
+    try:
+        decoder = await start_stream_decoder()
+        pump = asyncio.create_task(pump_decoded_pcm(decoder, live))
+        logger.info(f"Live transcription session {session_id} started")
+        
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                decoder.stdin.write(message["bytes"])
+                await decoder.stdin.drain()
+            elif message.get("text") and json.loads(message["text"]).get("type") == "stop":
+                break
+        
+        # Only the audio after the last cut is still pending at this point
+        decoder.stdin.close()
+        await pump
+        await decoder.wait()
+        chunk_transcripts = await live.finish()
+        transcript = join_segment_transcripts(chunk_transcripts)
+        logger.info(f"Live transcription session {session_id} finished with {len(chunk_transcripts)} segment(s)")
+        
+        async with send_lock:
+            await websocket.send_json({"type": "final", "transcript": transcript, "segments": len(chunk_transcripts)})
+        await websocket.close()
+        
+    except WebSocketDisconnect:
+        logger.info(f"Live transcription session {session_id} disconnected before stop")
+    except Exception as e:
+        logger.error(f"Live transcription session {session_id} failed: {str(e)}")
+        try:
+            await websocket.send_json({"type": "error", "detail": str(e)})
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        live.cancel()
+        if pump:
+            pump.cancel()
+        if decoder and decoder.returncode is None:
+            decoder.kill()
+            await decoder.wait()
 
 @app.get("/patients")
 async def get_patients():
     """Get all patients from the database."""
     try:
-        response = supabase.table("patients").select("*").order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("patients").select("*").order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch patients: {str(e)}")
@@ -990,7 +3164,7 @@ async def get_patients():
 async def get_patient(patient_id: str):
     """Get a specific patient by ID."""
     try:
-        response = supabase.table("patients").select("*").eq("id", patient_id).execute()
+        response = await db_execute(supabase.table("patients").select("*").eq("id", patient_id))
         if not response.data:
             raise HTTPException(status_code=404, detail="Patient not found")
         return response.data[0]
@@ -1007,7 +3181,7 @@ async def get_patient(patient_id: str):
 async def get_patient_recordings(patient_id: str):
     """Get all recordings for a specific patient."""
     try:
-        response = supabase.table("recordings").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("recordings").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch patient recordings: {str(e)}")
@@ -1020,7 +3194,7 @@ async def get_patient_recordings(patient_id: str):
 async def get_recordings():
     """Get all recordings from the database."""
     try:
-        response = supabase.table("recordings").select("*").order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("recordings").select("*").order("created_at", desc=True))
         return {"recordings": response.data}
     except Exception as e:
         logger.error(f"Failed to fetch recordings: {str(e)}")
@@ -1034,7 +3208,7 @@ async def get_recording(recording_id: str):
     """Get a specific recording by ID with patient information."""
     try:
         # First get the recording
-        recording_response = supabase.table("recordings").select("*").eq("id", recording_id).execute()
+        recording_response = await db_execute(supabase.table("recordings").select("*").eq("id", recording_id))
         if not recording_response.data:
             raise HTTPException(status_code=404, detail="Recording not found")
         
@@ -1042,7 +3216,7 @@ async def get_recording(recording_id: str):
         
         # Get patient information if patient_id exists
         if recording.get("patient_id"):
-            patient_response = supabase.table("patients").select("*").eq("id", recording["patient_id"]).execute()
+            patient_response = await db_execute(supabase.table("patients").select("*").eq("id", recording["patient_id"]))
             if patient_response.data:
                 recording["patients"] = patient_response.data[0]
         
@@ -1056,12 +3230,95 @@ async def get_recording(recording_id: str):
             detail=f"Failed to fetch recording: {str(e)}"
         )
 
+RECORDING_SEGMENTS_INSERT_BATCH = 500
+
+async def save_recording_segments(recording_id: str, segments: List[TranscriptSegment]) -> None:
+    """Store a recording's time-aligned transcript segments, replacing any from an earlier run (best effort; the recording is already saved)."""
+    rows = [
+        {
+            "recording_id": recording_id,
+            "segment_index": segment_index,
+            "start_seconds": round(segment.start, 2),
+            "end_seconds": round(segment.end, 2),
+            "text": segment.text,
+        }
+        for segment_index, segment in enumerate(segments)
+    ]
+    try:
+        # A resumed or re-run pipeline may produce fewer segments than the run that first saved them
+        await db_execute(supabase.table("recording_segments").delete().eq("recording_id", recording_id))
+        for batch_start in range(0, len(rows), RECORDING_SEGMENTS_INSERT_BATCH):
+            await db_execute(supabase.table("recording_segments").insert(rows[batch_start:batch_start + RECORDING_SEGMENTS_INSERT_BATCH]))
+        if rows:
+            logger.info(f"Saved {len(rows)} transcript segments for recording {recording_id}")
+    except Exception as e:
+        logger.warning(f"Failed to save transcript segments for recording {recording_id}: {str(e)}")
+
+@app.get("/recordings/{recording_id}/segments")
+async def get_recording_segments(
+    recording_id: str,
+    start: float = Query(0, ge=0, description="Start of the time range in seconds"),
+    end: Optional[float] = Query(None, ge=0, description="End of the time range in seconds (default: end of recording)")
+):
+    """Get the transcript spoken between start and end seconds, with the matching segments."""
+    try:
+        query = supabase.table("recording_segments").select(
+            "segment_index,start_seconds,end_seconds,text"
+        ).eq("recording_id", recording_id).gt("end_seconds", start)
+        if end is not None:
+            query = query.lt("start_seconds", end)
+        response = await db_execute(query.order("start_seconds"))
+        
+        return {
+            "recording_id": recording_id,
+            "start": start,
+            "end": end,
+            "text": " ".join(segment["text"] for segment in response.data),
+            "segments": response.data
+        }
+    except Exception as e:
+        logger.error(f"Failed to fetch recording segments: {str(e)}")
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Failed to fetch recording segments: {str(e)}"
+        )
+
+@app.get("/recordings/{recording_id}/segments/search")
+async def search_recording_segments(
+    recording_id: str,
+    q: str = Query(..., min_length=2, description="Phrase to find"),
+    limit: int = Query(20, ge=1, le=200)
+):
+    """Find where a phrase was said: the time range of every segment containing it (case-insensitive)."""
+    try:
+        pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        response = await db_execute(
+            supabase.table("recording_segments")
+            .select("segment_index,start_seconds,end_seconds,text")
+            .eq("recording_id", recording_id)
+            .ilike("text", f"%{pattern}%")
+            .order("start_seconds")
+            .limit(limit)
+        )
+        return {"recording_id": recording_id, "query": q, "matches": response.data}
+    except Exception as e:
+        logger.error(f"Failed to search recording segments: {str(e)}")
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Failed to search recording segments: {str(e)}"
+        )
+
 @app.post("/recordings/{recording_id}/regenerate-summary")
-async def regenerate_summary(recording_id: str):
+async def regenerate_summary(
+    recording_id: str,
+    refresh: bool = Query(False, description="Ask GPT-4 again instead of reusing a cached summary of the same transcript")
+):
     """Regenerate AI summary for an existing recording."""
     try:
+        if refresh:
+            bypass_llm_cache()
         # First get the recording
-        recording_response = supabase.table("recordings").select("*").eq("id", recording_id).execute()
+        recording_response = await db_execute(supabase.table("recordings").select("*").eq("id", recording_id))
         if not recording_response.data:
             raise HTTPException(status_code=404, detail="Recording not found")
         
@@ -1076,9 +3333,9 @@ async def regenerate_summary(recording_id: str):
         summary = await generate_consultation_summary(transcript)
         
         # Update the recording with new summary
-        update_response = supabase.table("recordings").update({
+        update_response = await db_execute(supabase.table("recordings").update({
             "summary": summary
-        }).eq("id", recording_id).execute()
+        }).eq("id", recording_id))
         
         if not update_response.data:
             raise HTTPException(status_code=500, detail="Failed to update recording with new summary")
@@ -1107,7 +3364,7 @@ async def update_patient(patient_id: str, patient_data: PatientCreate) -> Patien
         logger.info(f"Updating patient: {patient_id}")
         
         # Check if patient exists
-        existing = supabase.table("patients").select("*").eq("id", patient_id).execute()
+        existing = await db_execute(supabase.table("patients").select("*").eq("id", patient_id))
         if not existing.data:
             raise HTTPException(status_code=404, detail="Patient not found")
         
@@ -1161,7 +3418,7 @@ async def update_patient(patient_id: str, patient_data: PatientCreate) -> Patien
         if patient_data.medical_ref_number:
             updated_data["medical_ref_number"] = patient_data.medical_ref_number.strip()
         
-        response = supabase.table("patients").update(updated_data).eq("id", patient_id).execute()
+        response = await db_execute(supabase.table("patients").update(updated_data).eq("id", patient_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Patient not found")
@@ -1219,12 +3476,12 @@ async def update_patient_field(patient_id: str, field_data: dict):
             raise HTTPException(status_code=400, detail="No valid fields to update")
         
         # Check if patient exists first
-        existing = supabase.table("patients").select("id").eq("id", patient_id).execute()
+        existing = await db_execute(supabase.table("patients").select("id").eq("id", patient_id))
         if not existing.data:
             raise HTTPException(status_code=404, detail="Patient not found")
         
         # Update the patient
-        response = supabase.table("patients").update(update_data).eq("id", patient_id).execute()
+        response = await db_execute(supabase.table("patients").update(update_data).eq("id", patient_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Patient not found")
@@ -1249,7 +3506,7 @@ async def update_patient_field(patient_id: str, field_data: dict):
 async def get_patient_histories(patient_id: str):
     """Get all patient histories for a specific patient."""
     try:
-        response = supabase.table("patient_histories").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("patient_histories").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch patient histories: {str(e)}")
@@ -1262,7 +3519,7 @@ async def get_patient_histories(patient_id: str):
 async def get_patient_previous_chemotherapy(patient_id: str):
     """Get all previous chemotherapy treatments for a specific patient."""
     try:
-        response = supabase.table("patient_previous_chemotherapy").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("patient_previous_chemotherapy").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch previous chemotherapy: {str(e)}")
@@ -1275,7 +3532,7 @@ async def get_patient_previous_chemotherapy(patient_id: str):
 async def get_patient_previous_radiotherapy(patient_id: str):
     """Get all previous radiotherapy treatments for a specific patient."""
     try:
-        response = supabase.table("patient_previous_radiotherapy").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("patient_previous_radiotherapy").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch previous radiotherapy: {str(e)}")
@@ -1288,7 +3545,7 @@ async def get_patient_previous_radiotherapy(patient_id: str):
 async def get_patient_previous_surgeries(patient_id: str):
     """Get all previous surgeries for a specific patient."""
     try:
-        response = supabase.table("patient_previous_surgeries").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("patient_previous_surgeries").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch previous surgeries: {str(e)}")
@@ -1301,7 +3558,7 @@ async def get_patient_previous_surgeries(patient_id: str):
 async def get_patient_previous_other_treatments(patient_id: str):
     """Get all previous other treatments for a specific patient."""
     try:
-        response = supabase.table("patient_previous_other_treatments").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("patient_previous_other_treatments").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch previous other treatments: {str(e)}")
@@ -1314,7 +3571,7 @@ async def get_patient_previous_other_treatments(patient_id: str):
 async def get_patient_concomitant_medications(patient_id: str):
     """Get all concomitant medications for a specific patient."""
     try:
-        response = supabase.table("patient_concomitant_medications").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("patient_concomitant_medications").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch concomitant medications: {str(e)}")
@@ -1327,7 +3584,7 @@ async def get_patient_concomitant_medications(patient_id: str):
 async def get_patient_baselines(patient_id: str):
     """Get all baselines for a specific patient."""
     try:
-        response = supabase.table("patient_baselines").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("patient_baselines").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch patient baselines: {str(e)}")
@@ -1340,7 +3597,7 @@ async def get_patient_baselines(patient_id: str):
 async def get_baseline(baseline_id: str):
     """Get a specific baseline by ID."""
     try:
-        response = supabase.table("patient_baselines").select("*").eq("id", baseline_id).execute()
+        response = await db_execute(supabase.table("patient_baselines").select("*").eq("id", baseline_id))
         if not response.data:
             raise HTTPException(status_code=404, detail="Baseline not found")
         return response.data[0]
@@ -1357,7 +3614,7 @@ async def get_baseline(baseline_id: str):
 async def get_baseline_tumors(baseline_id: str):
     """Get all tumors for a specific baseline."""
     try:
-        response = supabase.table("baseline_tumors").select("*").eq("baseline_id", baseline_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("baseline_tumors").select("*").eq("baseline_id", baseline_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to fetch baseline tumors: {str(e)}")
@@ -1371,14 +3628,14 @@ async def create_baseline_tumor(baseline_id: str, tumor_data: dict):
     """Create a new tumor for a specific baseline."""
     try:
         # Verify baseline exists
-        baseline_response = supabase.table("patient_baselines").select("id").eq("id", baseline_id).execute()
+        baseline_response = await db_execute(supabase.table("patient_baselines").select("id").eq("id", baseline_id))
         if not baseline_response.data:
             raise HTTPException(status_code=404, detail="Baseline not found")
         
         # Add baseline_id to tumor data
         tumor_data["baseline_id"] = baseline_id
         
-        response = supabase.table("baseline_tumors").insert(tumor_data).execute()
+        response = await db_execute(supabase.table("baseline_tumors").insert(tumor_data))
         
         if not response.data:
             raise HTTPException(status_code=400, detail="Failed to create tumor")
@@ -1423,12 +3680,12 @@ async def update_baseline_tumor(tumor_id: str, field_data: dict):
             raise HTTPException(status_code=400, detail="No valid fields to update")
         
         # Check if tumor exists first
-        existing = supabase.table("baseline_tumors").select("id").eq("id", tumor_id).execute()
+        existing = await db_execute(supabase.table("baseline_tumors").select("id").eq("id", tumor_id))
         if not existing.data:
             raise HTTPException(status_code=404, detail="Tumor not found")
         
         # Update the tumor
-        response = supabase.table("baseline_tumors").update(update_data).eq("id", tumor_id).execute()
+        response = await db_execute(supabase.table("baseline_tumors").update(update_data).eq("id", tumor_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Tumor not found")
@@ -1452,12 +3709,12 @@ async def delete_baseline_tumor(tumor_id: str):
     """Delete a specific tumor."""
     try:
         # Check if tumor exists first
-        existing = supabase.table("baseline_tumors").select("id").eq("id", tumor_id).execute()
+        existing = await db_execute(supabase.table("baseline_tumors").select("id").eq("id", tumor_id))
         if not existing.data:
             raise HTTPException(status_code=404, detail="Tumor not found")
         
         # Delete the tumor
-        response = supabase.table("baseline_tumors").delete().eq("id", tumor_id).execute()
+        response = await db_execute(supabase.table("baseline_tumors").delete().eq("id", tumor_id))
         
         logger.info(f"Deleted tumor {tumor_id}")
         
@@ -1474,21 +3731,21 @@ async def get_patient_complete_data(patient_id: str):
     """Get complete patient data including all related records."""
     try:
         # Get patient data
-        patient_response = supabase.table("patients").select("*").eq("id", patient_id).execute()
+        patient_response = await db_execute(supabase.table("patients").select("*").eq("id", patient_id))
         if not patient_response.data:
             raise HTTPException(status_code=404, detail="Patient not found")
         
         patient = patient_response.data[0]
         
         # Get all related data
-        histories = supabase.table("patient_histories").select("*").eq("patient_id", patient_id).execute()
-        chemotherapy = supabase.table("patient_previous_chemotherapy").select("*").eq("patient_id", patient_id).execute()
-        radiotherapy = supabase.table("patient_previous_radiotherapy").select("*").eq("patient_id", patient_id).execute()
-        surgeries = supabase.table("patient_previous_surgeries").select("*").eq("patient_id", patient_id).execute()
-        other_treatments = supabase.table("patient_previous_other_treatments").select("*").eq("patient_id", patient_id).execute()
-        medications = supabase.table("patient_concomitant_medications").select("*").eq("patient_id", patient_id).execute()
-        baselines = supabase.table("patient_baselines").select("*").eq("patient_id", patient_id).execute()
-        recordings = supabase.table("recordings").select("*").eq("patient_id", patient_id).execute()
+        histories = await db_execute(supabase.table("patient_histories").select("*").eq("patient_id", patient_id))
+        chemotherapy = await db_execute(supabase.table("patient_previous_chemotherapy").select("*").eq("patient_id", patient_id))
+        radiotherapy = await db_execute(supabase.table("patient_previous_radiotherapy").select("*").eq("patient_id", patient_id))
+        surgeries = await db_execute(supabase.table("patient_previous_surgeries").select("*").eq("patient_id", patient_id))
+        other_treatments = await db_execute(supabase.table("patient_previous_other_treatments").select("*").eq("patient_id", patient_id))
+        medications = await db_execute(supabase.table("patient_concomitant_medications").select("*").eq("patient_id", patient_id))
+        baselines = await db_execute(supabase.table("patient_baselines").select("*").eq("patient_id", patient_id))
+        recordings = await db_execute(supabase.table("recordings").select("*").eq("patient_id", patient_id))
         
         return {
             "patient": patient,
@@ -1513,7 +3770,7 @@ async def create_patient_history(patient_id: str, history_data: dict):
         # Add patient_id to the data
         history_data["patient_id"] = patient_id
         
-        response = supabase.table("patient_histories").insert(history_data).execute()
+        response = await db_execute(supabase.table("patient_histories").insert(history_data))
         
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create history record")
@@ -1527,7 +3784,7 @@ async def create_patient_history(patient_id: str, history_data: dict):
 async def update_patient_history(history_id: str, history_data: dict):
     """Update a patient history record."""
     try:
-        response = supabase.table("patient_histories").update(history_data).eq("id", history_id).execute()
+        response = await db_execute(supabase.table("patient_histories").update(history_data).eq("id", history_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="History record not found")
@@ -1541,7 +3798,7 @@ async def update_patient_history(history_id: str, history_data: dict):
 async def delete_patient_history(history_id: str):
     """Delete a patient history record."""
     try:
-        response = supabase.table("patient_histories").delete().eq("id", history_id).execute()
+        response = await db_execute(supabase.table("patient_histories").delete().eq("id", history_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="History record not found")
@@ -1558,7 +3815,7 @@ async def create_patient_chemotherapy(patient_id: str, chemo_data: dict):
     try:
         chemo_data["patient_id"] = patient_id
         
-        response = supabase.table("patient_previous_chemotherapy").insert(chemo_data).execute()
+        response = await db_execute(supabase.table("patient_previous_chemotherapy").insert(chemo_data))
         
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create chemotherapy record")
@@ -1572,7 +3829,7 @@ async def create_patient_chemotherapy(patient_id: str, chemo_data: dict):
 async def update_patient_chemotherapy(chemo_id: str, chemo_data: dict):
     """Update a patient chemotherapy record."""
     try:
-        response = supabase.table("patient_previous_chemotherapy").update(chemo_data).eq("id", chemo_id).execute()
+        response = await db_execute(supabase.table("patient_previous_chemotherapy").update(chemo_data).eq("id", chemo_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Chemotherapy record not found")
@@ -1586,7 +3843,7 @@ async def update_patient_chemotherapy(chemo_id: str, chemo_data: dict):
 async def delete_patient_chemotherapy(chemo_id: str):
     """Delete a patient chemotherapy record."""
     try:
-        response = supabase.table("patient_previous_chemotherapy").delete().eq("id", chemo_id).execute()
+        response = await db_execute(supabase.table("patient_previous_chemotherapy").delete().eq("id", chemo_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Chemotherapy record not found")
@@ -1603,7 +3860,7 @@ async def create_patient_radiotherapy(patient_id: str, radio_data: dict):
     try:
         radio_data["patient_id"] = patient_id
         
-        response = supabase.table("patient_previous_radiotherapy").insert(radio_data).execute()
+        response = await db_execute(supabase.table("patient_previous_radiotherapy").insert(radio_data))
         
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create radiotherapy record")
@@ -1617,7 +3874,7 @@ async def create_patient_radiotherapy(patient_id: str, radio_data: dict):
 async def update_patient_radiotherapy(radio_id: str, radio_data: dict):
     """Update a patient radiotherapy record."""
     try:
-        response = supabase.table("patient_previous_radiotherapy").update(radio_data).eq("id", radio_id).execute()
+        response = await db_execute(supabase.table("patient_previous_radiotherapy").update(radio_data).eq("id", radio_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Radiotherapy record not found")
@@ -1631,7 +3888,7 @@ async def update_patient_radiotherapy(radio_id: str, radio_data: dict):
 async def delete_patient_radiotherapy(radio_id: str):
     """Delete a patient radiotherapy record."""
     try:
-        response = supabase.table("patient_previous_radiotherapy").delete().eq("id", radio_id).execute()
+        response = await db_execute(supabase.table("patient_previous_radiotherapy").delete().eq("id", radio_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Radiotherapy record not found")
@@ -1648,7 +3905,7 @@ async def create_patient_surgery(patient_id: str, surgery_data: dict):
     try:
         surgery_data["patient_id"] = patient_id
         
-        response = supabase.table("patient_previous_surgeries").insert(surgery_data).execute()
+        response = await db_execute(supabase.table("patient_previous_surgeries").insert(surgery_data))
         
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create surgery record")
@@ -1662,7 +3919,7 @@ async def create_patient_surgery(patient_id: str, surgery_data: dict):
 async def update_patient_surgery(surgery_id: str, surgery_data: dict):
     """Update a patient surgery record."""
     try:
-        response = supabase.table("patient_previous_surgeries").update(surgery_data).eq("id", surgery_id).execute()
+        response = await db_execute(supabase.table("patient_previous_surgeries").update(surgery_data).eq("id", surgery_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Surgery record not found")
@@ -1676,7 +3933,7 @@ async def update_patient_surgery(surgery_id: str, surgery_data: dict):
 async def delete_patient_surgery(surgery_id: str):
     """Delete a patient surgery record."""
     try:
-        response = supabase.table("patient_previous_surgeries").delete().eq("id", surgery_id).execute()
+        response = await db_execute(supabase.table("patient_previous_surgeries").delete().eq("id", surgery_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Surgery record not found")
@@ -1693,7 +3950,7 @@ async def create_patient_other_treatment(patient_id: str, treatment_data: dict):
     try:
         treatment_data["patient_id"] = patient_id
         
-        response = supabase.table("patient_previous_other_treatments").insert(treatment_data).execute()
+        response = await db_execute(supabase.table("patient_previous_other_treatments").insert(treatment_data))
         
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create other treatment record")
@@ -1707,7 +3964,7 @@ async def create_patient_other_treatment(patient_id: str, treatment_data: dict):
 async def update_patient_other_treatment(treatment_id: str, treatment_data: dict):
     """Update a patient other treatment record."""
     try:
-        response = supabase.table("patient_previous_other_treatments").update(treatment_data).eq("id", treatment_id).execute()
+        response = await db_execute(supabase.table("patient_previous_other_treatments").update(treatment_data).eq("id", treatment_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Other treatment record not found")
@@ -1721,7 +3978,7 @@ async def update_patient_other_treatment(treatment_id: str, treatment_data: dict
 async def delete_patient_other_treatment(treatment_id: str):
     """Delete a patient other treatment record."""
     try:
-        response = supabase.table("patient_previous_other_treatments").delete().eq("id", treatment_id).execute()
+        response = await db_execute(supabase.table("patient_previous_other_treatments").delete().eq("id", treatment_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Other treatment record not found")
@@ -1738,7 +3995,7 @@ async def create_patient_medication(patient_id: str, medication_data: dict):
     try:
         medication_data["patient_id"] = patient_id
         
-        response = supabase.table("patient_concomitant_medications").insert(medication_data).execute()
+        response = await db_execute(supabase.table("patient_concomitant_medications").insert(medication_data))
         
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create medication record")
@@ -1752,7 +4009,7 @@ async def create_patient_medication(patient_id: str, medication_data: dict):
 async def update_patient_medication(medication_id: str, medication_data: dict):
     """Update a patient medication record."""
     try:
-        response = supabase.table("patient_concomitant_medications").update(medication_data).eq("id", medication_id).execute()
+        response = await db_execute(supabase.table("patient_concomitant_medications").update(medication_data).eq("id", medication_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Medication record not found")
@@ -1766,7 +4023,7 @@ async def update_patient_medication(medication_id: str, medication_data: dict):
 async def delete_patient_medication(medication_id: str):
     """Delete a patient medication record."""
     try:
-        response = supabase.table("patient_concomitant_medications").delete().eq("id", medication_id).execute()
+        response = await db_execute(supabase.table("patient_concomitant_medications").delete().eq("id", medication_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Medication record not found")
@@ -1783,7 +4040,7 @@ async def create_patient_baseline(patient_id: str, baseline_data: dict):
     try:
         baseline_data["patient_id"] = patient_id
         
-        response = supabase.table("patient_baselines").insert(baseline_data).execute()
+        response = await db_execute(supabase.table("patient_baselines").insert(baseline_data))
         
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create baseline record")
@@ -1797,7 +4054,7 @@ async def create_patient_baseline(patient_id: str, baseline_data: dict):
 async def update_patient_baseline(baseline_id: str, baseline_data: dict):
     """Update a patient baseline record."""
     try:
-        response = supabase.table("patient_baselines").update(baseline_data).eq("id", baseline_id).execute()
+        response = await db_execute(supabase.table("patient_baselines").update(baseline_data).eq("id", baseline_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Baseline record not found")
@@ -1811,7 +4068,7 @@ async def update_patient_baseline(baseline_id: str, baseline_data: dict):
 async def delete_patient_baseline(baseline_id: str):
     """Delete a patient baseline record."""
     try:
-        response = supabase.table("patient_baselines").delete().eq("id", baseline_id).execute()
+        response = await db_execute(supabase.table("patient_baselines").delete().eq("id", baseline_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Baseline record not found")
@@ -1821,207 +4078,259 @@ async def delete_patient_baseline(baseline_id: str):
         logger.error(f"Error deleting patient baseline: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to delete baseline record")
 
-@app.post("/consultation/new_patient", response_model=UploadResponse)
-async def create_new_patient_consultation(
-    file: UploadFile = File(...)
-):
-    """Create a new patient and process their first consultation recording using AI demographic extraction."""
-    try:
-        logger.info("Creating new patient consultation with AI demographic extraction")
-        
-        # Process the audio file (similar to existing upload endpoint)
-        file_content = await file.read()
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        
-        # Process file based on type
-        transcript = ""
-        if file.content_type and (file.content_type.startswith('audio/') or file.content_type.startswith('video/')):
-            transcript = await process_audio_file(file_content, unique_filename, file.content_type)
-        elif file.content_type == 'text/plain' or file_extension.lower() == '.txt':
-            transcript = file_content.decode('utf-8')
-        elif file.content_type == 'application/pdf' or file_extension.lower() == '.pdf':
-            transcript = await process_pdf_file(file_content, unique_filename)
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
-        
-        # Extract patient demographics from transcript
-        demographics = await extract_patient_demographics_from_transcript(transcript)
-        
-        # Generate summary
-        summary = await generate_consultation_summary(transcript)
+@exclusive_run("new_patient")
+async def run_new_patient_pipeline(consultation: ConsultationInput, report_progress: ProgressCallback = ignore_progress) -> UploadResponse:
+    """Create (or match) a patient from the transcript's demographics and save their first consultation."""
+    enter_work_context(consultation)
+    run = PipelineRun("new_patient", consultation)
+    summarizer = StreamingSummary()
+    file_extension = Path(consultation.filename).suffix
+    
+    await report_progress("transcribing", 0.1)
+    
+    # Process file based on type
+    transcript = ""
+    segments: List[TranscriptSegment] = []
+    if consultation.content_type and (consultation.content_type.startswith('audio/') or consultation.content_type.startswith('video/')):
+        audio_transcript = await run.transcribe_audio(consultation, summarizer.add_chunk)
+        transcript, segments = audio_transcript.text, audio_transcript.segments
+    elif consultation.content_type == 'text/plain' or file_extension.lower() == '.txt':
+        transcript = read_text_upload(consultation.upload)
+    elif consultation.content_type == 'application/pdf' or file_extension.lower() == '.pdf':
+        transcript = await process_pdf_file(consultation.upload.path, consultation.unique_filename)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {consultation.content_type}")
+    
+    await report_progress("extracting", 0.5)
+    
+    # Dependency graph: demographics (then the existing-patient lookup) runs alongside the
+    # summary (then clinical parsing); each step starts as soon as its input is ready.
+    extractor = ConsultationExtractor(summarizer)
+    demographics_task = asyncio.create_task(
+        run.stage("demographics", lambda: extractor.demographics(transcript), extraction_is_complete)
+    )
+    summary_task = asyncio.create_task(run.stage("summary", lambda: extractor.summary(transcript), summary_is_complete))
+    
+    async def parse_clinical() -> dict:
+        summary = await summary_task
+        return await run.stage("clinical", lambda: extractor.clinical(transcript, summary), extraction_is_complete)
+    
+    async def find_existing_patients():
+        demographics = await demographics_task
+        if not (demographics.get('first_name') and demographics.get('last_name')):
+            return None
+        return await db_execute(supabase.table("patients").select("*").eq(
+            "first_name", demographics['first_name'].strip()
+        ).eq(
+            "last_name", demographics['last_name'].strip()
+        ))
+    
+    demographics, summary, clinical_data, existing = await asyncio.gather(
+        demographics_task, summary_task, parse_clinical(), find_existing_patients()
+    )
+    
+    await report_progress("saving", 0.9)
+    
+    # Create patient with extracted demographics
+    patient_id = None
+    extraction_metadata = demographics.get('extraction_metadata', {})
+    
+    # Check if we have minimum required information to create a patient
+    if demographics.get('first_name') and demographics.get('last_name'):
+        # Check if patient already exists (looked up above)
+        if existing.data and demographics.get('phone_1'):
+            # Also check phone if available
+            existing_with_phone = [p for p in existing.data if p.get('phone_1') == demographics['phone_1'].strip()]
+            if existing_with_phone:
+                logger.info("Patient already exists, using existing record")
+                patient_id = existing_with_phone[0]['id']
+                extraction_metadata['patient_status'] = 'existing'
+            else:
+                existing = None
         
-        # Parse clinical data from summary
-        clinical_data = await parse_clinical_data_from_summary(summary)
-        
-        # Create patient with extracted demographics
-        patient_id = None
-        extraction_metadata = demographics.get('extraction_metadata', {})
-        
-        # Check if we have minimum required information to create a patient
-        if demographics.get('first_name') and demographics.get('last_name'):
-            # Check if patient already exists
-            existing = supabase.table("patients").select("*").eq(
-                "first_name", demographics['first_name'].strip()
-            ).eq(
-                "last_name", demographics['last_name'].strip()
-            ).execute()
-            
-            if existing.data and demographics.get('phone_1'):
-                # Also check phone if available
-                existing_with_phone = [p for p in existing.data if p.get('phone_1') == demographics['phone_1'].strip()]
-                if existing_with_phone:
-                    logger.info("Patient already exists, using existing record")
-                    patient_id = existing_with_phone[0]['id']
-                    extraction_metadata['patient_status'] = 'existing'
-                else:
-                    existing = None
-            
-            if not existing or not existing.data:
-                # Create new patient with extracted demographics
-                patient_id = str(uuid.uuid4())
-                current_time = datetime.utcnow()
-                
-                patient_record = {
-                    "id": patient_id,
-                    "created_at": current_time.isoformat()
-                }
-                
-                # Add extracted demographic fields
-                if demographics.get('first_name'):
-                    patient_record["first_name"] = demographics['first_name'].strip()
-                if demographics.get('last_name'):
-                    patient_record["last_name"] = demographics['last_name'].strip()
-                if demographics.get('father_name'):
-                    patient_record["father_name"] = demographics['father_name'].strip()
-                if demographics.get('mother_name'):
-                    patient_record["mother_name"] = demographics['mother_name'].strip()
-                if demographics.get('date_of_birth'):
-                    patient_record["date_of_birth"] = demographics['date_of_birth']
-                elif demographics.get('age'):
-                    # Calculate approximate date of birth from age
-                    current_year = datetime.utcnow().year
-                    birth_year = current_year - int(demographics['age'])
-                    patient_record["date_of_birth"] = f"{birth_year}-01-01"
-                
-                if demographics.get('gender'):
-                    patient_record["gender"] = demographics['gender']
-                if demographics.get('phone_1'):
-                    patient_record["phone_1"] = demographics['phone_1'].strip()
-                if demographics.get('phone_2'):
-                    patient_record["phone_2"] = demographics['phone_2'].strip()
-                if demographics.get('email'):
-                    patient_record["email"] = demographics['email'].strip()
-                if demographics.get('address'):
-                    patient_record["address"] = demographics['address'].strip()
-                if demographics.get('occupation'):
-                    patient_record["occupation"] = demographics['occupation'].strip()
-                if demographics.get('education'):
-                    patient_record["education"] = demographics['education'].strip()
-                if demographics.get('marital_status'):
-                    patient_record["marital_status"] = demographics['marital_status']
-                
-                # Add all extracted fields to patient record
-                if demographics.get('children_count'):
-                    patient_record["children_count"] = int(demographics['children_count'])
-                if demographics.get('education'):
-                    patient_record["education"] = demographics['education'].strip()
-                if demographics.get('file_reference'):
-                    patient_record["file_reference"] = demographics['file_reference'].strip()
-                if demographics.get('case_number'):
-                    patient_record["case_number"] = demographics['case_number'].strip()
-                if demographics.get('referring_physician_name'):
-                    patient_record["referring_physician_name"] = demographics['referring_physician_name'].strip()
-                if demographics.get('referring_physician_phone_1'):
-                    patient_record["referring_physician_phone_1"] = demographics['referring_physician_phone_1'].strip()
-                if demographics.get('referring_physician_email'):
-                    patient_record["referring_physician_email"] = demographics['referring_physician_email'].strip()
-                if demographics.get('third_party_payer'):
-                    patient_record["third_party_payer"] = demographics['third_party_payer'].strip()
-                if demographics.get('medical_ref_number'):
-                    patient_record["medical_ref_number"] = demographics['medical_ref_number'].strip()
-                
-                response = supabase.table("patients").insert(patient_record).execute()
-                logger.info(f"Created new patient with ID: {patient_id}")
-                extraction_metadata['patient_status'] = 'created'
-                
-        else:
-            # Create a placeholder patient if minimum info not available
-            logger.warning("Insufficient demographic information extracted, creating placeholder patient")
-            patient_id = str(uuid.uuid4())
+        if not existing or not existing.data:
+            # Create new patient with extracted demographics
+            patient_id = await run.stage("patient_id", lambda: str(uuid.uuid4()))
             current_time = datetime.utcnow()
             
             patient_record = {
                 "id": patient_id,
-                "first_name": "Unknown",
-                "last_name": "Patient",
-                "date_of_birth": "1900-01-01",
-                "phone_1": "000-000-0000",
                 "created_at": current_time.isoformat()
             }
             
-            response = supabase.table("patients").insert(patient_record).execute()
-            logger.info(f"Created placeholder patient with ID: {patient_id}")
-            extraction_metadata['patient_status'] = 'placeholder'
-            extraction_metadata['note'] = 'Insufficient demographic information extracted'
-        
-        # NOTE: File storage disabled by user request - only storing transcript and metadata
-        public_url = None
-        
-        # Create recording record with required fields
-        recording_id = str(uuid.uuid4())
+            # Add extracted demographic fields
+            if demographics.get('first_name'):
+                patient_record["first_name"] = demographics['first_name'].strip()
+            if demographics.get('last_name'):
+                patient_record["last_name"] = demographics['last_name'].strip()
+            if demographics.get('father_name'):
+                patient_record["father_name"] = demographics['father_name'].strip()
+            if demographics.get('mother_name'):
+                patient_record["mother_name"] = demographics['mother_name'].strip()
+            if demographics.get('date_of_birth'):
+                patient_record["date_of_birth"] = demographics['date_of_birth']
+            elif demographics.get('age'):
+                # Calculate approximate date of birth from age
+                current_year = datetime.utcnow().year
+                birth_year = current_year - int(demographics['age'])
+                patient_record["date_of_birth"] = f"{birth_year}-01-01"
+            
+            if demographics.get('gender'):
+                patient_record["gender"] = demographics['gender']
+            if demographics.get('phone_1'):
+                patient_record["phone_1"] = demographics['phone_1'].strip()
+            if demographics.get('phone_2'):
+                patient_record["phone_2"] = demographics['phone_2'].strip()
+            if demographics.get('email'):
+                patient_record["email"] = demographics['email'].strip()
+            if demographics.get('address'):
+                patient_record["address"] = demographics['address'].strip()
+            if demographics.get('occupation'):
+                patient_record["occupation"] = demographics['occupation'].strip()
+            if demographics.get('education'):
+                patient_record["education"] = demographics['education'].strip()
+            if demographics.get('marital_status'):
+                patient_record["marital_status"] = demographics['marital_status']
+            
+            # Add all extracted fields to patient record
+            if demographics.get('children_count'):
+                patient_record["children_count"] = int(demographics['children_count'])
+            if demographics.get('education'):
+                patient_record["education"] = demographics['education'].strip()
+            if demographics.get('file_reference'):
+                patient_record["file_reference"] = demographics['file_reference'].strip()
+            if demographics.get('case_number'):
+                patient_record["case_number"] = demographics['case_number'].strip()
+            if demographics.get('referring_physician_name'):
+                patient_record["referring_physician_name"] = demographics['referring_physician_name'].strip()
+            if demographics.get('referring_physician_phone_1'):
+                patient_record["referring_physician_phone_1"] = demographics['referring_physician_phone_1'].strip()
+            if demographics.get('referring_physician_email'):
+                patient_record["referring_physician_email"] = demographics['referring_physician_email'].strip()
+            if demographics.get('third_party_payer'):
+                patient_record["third_party_payer"] = demographics['third_party_payer'].strip()
+            if demographics.get('medical_ref_number'):
+                patient_record["medical_ref_number"] = demographics['medical_ref_number'].strip()
+            
+            response = await db_execute(supabase.table("patients").upsert(patient_record))
+            logger.info(f"Created new patient with ID: {patient_id}")
+            extraction_metadata['patient_status'] = 'created'
+            
+    else:
+        # Create a placeholder patient if minimum info not available
+        logger.warning("Insufficient demographic information extracted, creating placeholder patient")
+        patient_id = await run.stage("patient_id", lambda: str(uuid.uuid4()))
         current_time = datetime.utcnow()
         
-        recording_record = {
-            "id": recording_id,
-            "filename": unique_filename,
-            "transcript": transcript,
-            "summary": summary,
-            "patient_id": patient_id,
+        patient_record = {
+            "id": patient_id,
+            "first_name": "Unknown",
+            "last_name": "Patient",
+            "date_of_birth": "1900-01-01",
+            "phone_1": "000-000-0000",
             "created_at": current_time.isoformat()
         }
         
-        recording_response = supabase.table("recordings").insert(recording_record).execute()
-        
-        if not recording_response.data:
-            logger.error("Database insert failed: No data returned")
-            raise HTTPException(status_code=500, detail="Failed to save recording record")
-        
-        # Update patient record with additional clinical data if available
-        if patient_id and clinical_data:
-            patient_update = {}
-            
-            # Add clinical data to patient record (only basic fields)
-            if clinical_data.get('diagnosis'):
-                patient_update["diagnosis"] = clinical_data.get('diagnosis')
-            if clinical_data.get('allergies'):
-                patient_update["allergies"] = clinical_data.get('allergies')
-            if clinical_data.get('medications'):
-                patient_update["medications"] = clinical_data.get('medications')
-            
-            # Apply updates if any
-            if patient_update:
-                update_response = supabase.table("patients").update(patient_update).eq("id", patient_id).execute()
-                logger.info(f"Enhanced patient record with clinical data: {list(patient_update.keys())}")
+        response = await db_execute(supabase.table("patients").upsert(patient_record))
+        logger.info(f"Created placeholder patient with ID: {patient_id}")
+        extraction_metadata['patient_status'] = 'placeholder'
+        extraction_metadata['note'] = 'Insufficient demographic information extracted'
+    
+    # NOTE: File storage disabled by user request - only storing transcript and metadata
+    public_url = None
+    
+    # Create recording record with required fields
+    recording_id = await run.stage("recording_id", lambda: str(uuid.uuid4()))
+    current_time = datetime.utcnow()
+    
+    recording_record = {
+        "id": recording_id,
+        "filename": consultation.unique_filename,
+        "transcript": transcript,
+        "summary": summary,
+        "patient_id": patient_id,
+        "created_at": current_time.isoformat()
+    }
+    
+    recording_response = await db_execute(supabase.table("recordings").upsert(recording_record))
+    
+    if not recording_response.data:
+        logger.error("Database insert failed: No data returned")
+        raise HTTPException(status_code=500, detail="Failed to save recording record")
+    
+    await save_recording_segments(recording_id, segments)
+    
+    # Update patient record with additional clinical data if available
+    if patient_id and clinical_data:
+        patient_update = {}
+        
+        # Add clinical data to patient record (only basic fields)
+        if clinical_data.get('diagnosis'):
+            patient_update["diagnosis"] = clinical_data.get('diagnosis')
+        if clinical_data.get('allergies'):
+            patient_update["allergies"] = clinical_data.get('allergies')
+        if clinical_data.get('medications'):
+            patient_update["medications"] = clinical_data.get('medications')
+        
+        # Apply updates if any
+        if patient_update:
+            update_response = await db_execute(supabase.table("patients").update(patient_update).eq("id", patient_id))
+            logger.info(f"Enhanced patient record with clinical data: {list(patient_update.keys())}")
+    
+    logger.info(f"Successfully created consultation for patient ID: {patient_id}")
+    await run.complete()
+    
+    return UploadResponse(
+        id=recording_id,
+        filename=consultation.filename,
+        transcript=transcript,
+        summary=summary,
+        patient_id=patient_id,
+        created_at=current_time,
+        extraction_metadata=extraction_metadata
+    )
+
+@app.post("/consultation/new_patient", response_model=UploadResponse)
+async def create_new_patient_consultation(
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="Run as a background job and return 202 with a job id")
+):
+    """Create a new patient and process their first consultation recording using AI demographic extraction."""
+    stored_upload = None
+    try:
+        logger.info("Creating new patient consultation with AI demographic extraction")
         
-        logger.info(f"Successfully created consultation for patient ID: {patient_id}")
+        # Process the audio file (similar to existing upload endpoint)
+        file_extension = Path(file.filename).suffix
+        unique_filename = f"{uuid.uuid4()}{file_extension}"
+        admit_transcoding(file.content_type, background)
+        stored_upload = await spool_upload(file, unique_filename)
+        logger.info(f"File size: {stored_upload.size} bytes, sha256: {stored_upload.sha256}")
         
-        return UploadResponse(
-            id=recording_id,
+        consultation = ConsultationInput(
+            upload=stored_upload,
             filename=file.filename,
-            transcript=transcript,
-            summary=summary,
-            patient_id=patient_id,
-            created_at=current_time,
-            extraction_metadata=extraction_metadata
+            unique_filename=unique_filename,
+            content_type=file.content_type
         )
+        if background:
+            job = await enqueue_job("new_patient", consultation)
+            stored_upload = None  # the job owns the spooled file now
+            return job_accepted_response(job)
         
+        return await run_new_patient_pipeline(consultation)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to create patient consultation: {str(e)}")
         raise HTTPException(
             status_code=500, 
             detail=f"Failed to create patient consultation: {str(e)}"
         )
+    finally:
+        if stored_upload:
+            discard_temp_file(stored_upload.path)
 
 # ===============================
 # COMPREHENSIVE CLINICAL DATA ENDPOINTS
@@ -2032,7 +4341,7 @@ async def create_new_patient_consultation(
 async def get_patient_symptom_assessments(patient_id: str):
     """Get all symptom assessments for a patient."""
     try:
-        response = supabase.table("patient_symptom_assessments").select("*").eq("patient_id", patient_id).order("assessment_date", desc=True).execute()
+        response = await db_execute(supabase.table("patient_symptom_assessments").select("*").eq("patient_id", patient_id).order("assessment_date", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to get symptom assessments: {str(e)}")
@@ -2043,7 +4352,7 @@ async def create_symptom_assessment(patient_id: str, assessment_data: dict):
     """Create a new symptom assessment."""
     try:
         assessment_data["patient_id"] = patient_id
-        response = supabase.table("patient_symptom_assessments").insert(assessment_data).execute()
+        response = await db_execute(supabase.table("patient_symptom_assessments").insert(assessment_data))
         if not response.data:
             raise HTTPException(status_code=400, detail="Failed to create symptom assessment")
         logger.info(f"Created symptom assessment for patient {patient_id}")
@@ -2057,7 +4366,7 @@ async def create_symptom_assessment(patient_id: str, assessment_data: dict):
 async def get_patient_biomarkers(patient_id: str):
     """Get all biomarker results for a patient."""
     try:
-        response = supabase.table("patient_biomarkers").select("*").eq("patient_id", patient_id).order("test_date", desc=True).execute()
+        response = await db_execute(supabase.table("patient_biomarkers").select("*").eq("patient_id", patient_id).order("test_date", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to get biomarkers: {str(e)}")
@@ -2068,7 +4377,7 @@ async def create_biomarker(patient_id: str, biomarker_data: dict):
     """Create a new biomarker result."""
     try:
         biomarker_data["patient_id"] = patient_id
-        response = supabase.table("patient_biomarkers").insert(biomarker_data).execute()
+        response = await db_execute(supabase.table("patient_biomarkers").insert(biomarker_data))
         if not response.data:
             raise HTTPException(status_code=400, detail="Failed to create biomarker result")
         logger.info(f"Created biomarker result for patient {patient_id}")
@@ -2082,7 +4391,7 @@ async def create_biomarker(patient_id: str, biomarker_data: dict):
 async def get_patient_treatment_responses(patient_id: str):
     """Get all treatment responses for a patient."""
     try:
-        response = supabase.table("patient_treatment_responses").select("*").eq("patient_id", patient_id).order("assessment_date", desc=True).execute()
+        response = await db_execute(supabase.table("patient_treatment_responses").select("*").eq("patient_id", patient_id).order("assessment_date", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to get treatment responses: {str(e)}")
@@ -2093,7 +4402,7 @@ async def create_treatment_response(patient_id: str, response_data: dict):
     """Create a new treatment response assessment."""
     try:
         response_data["patient_id"] = patient_id
-        response = supabase.table("patient_treatment_responses").insert(response_data).execute()
+        response = await db_execute(supabase.table("patient_treatment_responses").insert(response_data))
         if not response.data:
             raise HTTPException(status_code=400, detail="Failed to create treatment response")
         logger.info(f"Created treatment response for patient {patient_id}")
@@ -2107,7 +4416,7 @@ async def create_treatment_response(patient_id: str, response_data: dict):
 async def get_patient_risk_assessments(patient_id: str):
     """Get all risk assessments for a patient."""
     try:
-        response = supabase.table("patient_risk_assessments").select("*").eq("patient_id", patient_id).order("assessment_date", desc=True).execute()
+        response = await db_execute(supabase.table("patient_risk_assessments").select("*").eq("patient_id", patient_id).order("assessment_date", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to get risk assessments: {str(e)}")
@@ -2118,7 +4427,7 @@ async def create_risk_assessment(patient_id: str, risk_data: dict):
     """Create a new risk assessment."""
     try:
         risk_data["patient_id"] = patient_id
-        response = supabase.table("patient_risk_assessments").insert(risk_data).execute()
+        response = await db_execute(supabase.table("patient_risk_assessments").insert(risk_data))
         if not response.data:
             raise HTTPException(status_code=400, detail="Failed to create risk assessment")
         logger.info(f"Created risk assessment for patient {patient_id}")
@@ -2132,7 +4441,7 @@ async def create_risk_assessment(patient_id: str, risk_data: dict):
 async def get_patient_psychosocial_assessments(patient_id: str):
     """Get all psychosocial assessments for a patient."""
     try:
-        response = supabase.table("patient_psychosocial_assessments").select("*").eq("patient_id", patient_id).order("assessment_date", desc=True).execute()
+        response = await db_execute(supabase.table("patient_psychosocial_assessments").select("*").eq("patient_id", patient_id).order("assessment_date", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to get psychosocial assessments: {str(e)}")
@@ -2143,7 +4452,7 @@ async def create_psychosocial_assessment(patient_id: str, psychosocial_data: dic
     """Create a new psychosocial assessment."""
     try:
         psychosocial_data["patient_id"] = patient_id
-        response = supabase.table("patient_psychosocial_assessments").insert(psychosocial_data).execute()
+        response = await db_execute(supabase.table("patient_psychosocial_assessments").insert(psychosocial_data))
         if not response.data:
             raise HTTPException(status_code=400, detail="Failed to create psychosocial assessment")
         logger.info(f"Created psychosocial assessment for patient {patient_id}")
@@ -2157,7 +4466,7 @@ async def create_psychosocial_assessment(patient_id: str, psychosocial_data: dic
 async def get_patient_clinical_trials(patient_id: str):
     """Get all clinical trial information for a patient."""
     try:
-        response = supabase.table("patient_clinical_trials").select("*").eq("patient_id", patient_id).order("created_at", desc=True).execute()
+        response = await db_execute(supabase.table("patient_clinical_trials").select("*").eq("patient_id", patient_id).order("created_at", desc=True))
         return response.data
     except Exception as e:
         logger.error(f"Failed to get clinical trials: {str(e)}")
@@ -2168,7 +4477,7 @@ async def create_clinical_trial(patient_id: str, trial_data: dict):
     """Create a new clinical trial record."""
     try:
         trial_data["patient_id"] = patient_id
-        response = supabase.table("patient_clinical_trials").insert(trial_data).execute()
+        response = await db_execute(supabase.table("patient_clinical_trials").insert(trial_data))
         if not response.data:
             raise HTTPException(status_code=400, detail="Failed to create clinical trial record")
         logger.info(f"Created clinical trial record for patient {patient_id}")
@@ -2178,122 +4487,865 @@ async def create_clinical_trial(patient_id: str, trial_data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 # Enhanced consultation processing with comprehensive data extraction
+@exclusive_run("comprehensive")
+async def run_comprehensive_pipeline(consultation: ConsultationInput, report_progress: ProgressCallback = ignore_progress) -> UploadResponse:
+    """Transcribe a consultation, run basic and comprehensive extraction and store the results."""
+    enter_work_context(consultation)
+    run = PipelineRun("comprehensive", consultation)
+    summarizer = StreamingSummary()
+    patient_id = consultation.patient_id
+    file_extension = Path(consultation.filename).suffix
+    
+    await report_progress("transcribing", 0.1)
+    
+    # Process based on file type
+    transcript = ""
+    segments: List[TranscriptSegment] = []
+    if consultation.content_type and (consultation.content_type.startswith('audio/') or consultation.content_type.startswith('video/')):
+        audio_transcript = await run.transcribe_audio(consultation, summarizer.add_chunk)
+        transcript, segments = audio_transcript.text, audio_transcript.segments
+    elif consultation.content_type == 'text/plain' or file_extension.lower() == '.txt':
+        transcript = read_text_upload(consultation.upload)
+    elif consultation.content_type == 'application/pdf' or file_extension.lower() == '.pdf':
+        transcript = await process_pdf_file(consultation.upload.path, consultation.unique_filename)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {consultation.content_type}")
+    
+    await report_progress("summarizing", 0.5)
+    
+    # Generate summary
+    extractor = ConsultationExtractor(summarizer, include_demographics=False, include_oncology=True)
+    summary = await run.stage("summary", lambda: extractor.summary(transcript), summary_is_complete)
+    
+    await report_progress("extracting", 0.6)
+    
+    # Both extractions only need the transcript and summary, so they run concurrently
+    basic_clinical_data, comprehensive_data = await asyncio.gather(
+        # Extract basic clinical data
+        run.stage("clinical", lambda: extractor.clinical(transcript, summary), extraction_is_complete),
+        # Extract comprehensive clinical data
+        run.stage("comprehensive", lambda: extractor.comprehensive(transcript, summary), extraction_is_complete)
+    )
+    
+    await report_progress("saving", 0.9)
+    
+    # Create recording record
+    recording_id = await run.stage("recording_id", lambda: str(uuid.uuid4()))
+    current_time = datetime.utcnow()
+    
+    recording_record = {
+        "id": recording_id,
+        "filename": consultation.unique_filename,
+        "transcript": transcript,
+        "summary": summary,
+        "patient_id": patient_id,
+        "created_at": current_time.isoformat()
+    }
+    
+    recording_response = await db_execute(supabase.table("recordings").upsert(recording_record))
+    
+    if not recording_response.data:
+        raise HTTPException(status_code=500, detail="Failed to save recording record")
+    
+    await save_recording_segments(recording_id, segments)
+    
+    # Store comprehensive clinical data in respective tables
+    stored_data = {}
+    
+    # Store symptom assessment if data exists
+    if comprehensive_data.get("symptom_assessment") and any(comprehensive_data["symptom_assessment"].values()):
+        symptom_data = comprehensive_data["symptom_assessment"].copy()
+        symptom_data.update({
+            "patient_id": patient_id,
+            "assessment_date": current_time.date().isoformat()
+        })
+        try:
+            stored_data["symptom_assessment"] = await run.stage("store:symptom_assessment", lambda: insert_row("patient_symptom_assessments", symptom_data))
+        except Exception as e:
+            logger.warning(f"Failed to store symptom assessment: {str(e)}")
+    
+    # Store biomarker results if data exists
+    if comprehensive_data.get("biomarker_results") and any(comprehensive_data["biomarker_results"].values()):
+        biomarker_data = comprehensive_data["biomarker_results"].copy()
+        biomarker_data.update({
+            "patient_id": patient_id,
+            "test_date": current_time.date().isoformat()
+        })
+        try:
+            stored_data["biomarker_results"] = await run.stage("store:biomarker_results", lambda: insert_row("patient_biomarkers", biomarker_data))
+        except Exception as e:
+            logger.warning(f"Failed to store biomarker results: {str(e)}")
+    
+    # Store risk assessment if data exists
+    if comprehensive_data.get("risk_assessment") and any(comprehensive_data["risk_assessment"].values()):
+        risk_data = comprehensive_data["risk_assessment"].copy()
+        risk_data.update({
+            "patient_id": patient_id,
+            "assessment_date": current_time.date().isoformat()
+        })
+        try:
+            stored_data["risk_assessment"] = await run.stage("store:risk_assessment", lambda: insert_row("patient_risk_assessments", risk_data))
+        except Exception as e:
+            logger.warning(f"Failed to store risk assessment: {str(e)}")
+    
+    logger.info(f"Comprehensive consultation created with extracted data: {list(stored_data.keys())}")
+    await run.complete()
+    
+    return UploadResponse(
+        id=recording_id,
+        filename=consultation.filename,
+        transcript=transcript,
+        summary=summary,
+        patient_id=patient_id,
+        created_at=current_time,
+        extraction_metadata={
+            "basic_clinical": basic_clinical_data,
+            "comprehensive_clinical": comprehensive_data,
+            "stored_tables": list(stored_data.keys())
+        }
+    )
+
 @app.post("/consultation/comprehensive", response_model=UploadResponse)
 async def create_comprehensive_consultation(
     file: UploadFile = File(...),
-    patient_id: str = Form(...)
+    patient_id: str = Form(...),
+    background: bool = Query(False, description="Run as a background job and return 202 with a job id")
 ):
     """Process consultation with comprehensive clinical data extraction."""
+    stored_upload = None
     try:
         logger.info("Creating comprehensive consultation with advanced extraction")
         
         # Process the file (audio/text/pdf)
-        file_content = await file.read()
         file_extension = Path(file.filename).suffix
         unique_filename = f"{uuid.uuid4()}{file_extension}"
+        admit_transcoding(file.content_type, background)
+        stored_upload = await spool_upload(file, unique_filename)
+        logger.info(f"File size: {stored_upload.size} bytes, sha256: {stored_upload.sha256}")
         
-        # Process based on file type
-        transcript = ""
-        if file.content_type and (file.content_type.startswith('audio/') or file.content_type.startswith('video/')):
-            transcript = await process_audio_file(file_content, unique_filename, file.content_type)
-        elif file.content_type == 'text/plain' or file_extension.lower() == '.txt':
-            transcript = file_content.decode('utf-8')
-        elif file.content_type == 'application/pdf' or file_extension.lower() == '.pdf':
-            transcript = await process_pdf_file(file_content, unique_filename)
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
-        
-        # Generate summary
-        summary = await generate_consultation_summary(transcript)
-        
-        # Extract basic clinical data
-        basic_clinical_data = await parse_clinical_data_from_summary(summary)
-        
-        # Extract comprehensive clinical data
-        comprehensive_data = await extract_comprehensive_clinical_data(transcript, summary)
-        
-        # Create recording record
-        recording_id = str(uuid.uuid4())
-        current_time = datetime.utcnow()
-        
-        recording_record = {
-            "id": recording_id,
-            "filename": unique_filename,
-            "transcript": transcript,
-            "summary": summary,
-            "patient_id": patient_id,
-            "created_at": current_time.isoformat()
-        }
-        
-        recording_response = supabase.table("recordings").insert(recording_record).execute()
-        
-        if not recording_response.data:
-            raise HTTPException(status_code=500, detail="Failed to save recording record")
-        
-        # Store comprehensive clinical data in respective tables
-        stored_data = {}
-        
-        # Store symptom assessment if data exists
-        if comprehensive_data.get("symptom_assessment") and any(comprehensive_data["symptom_assessment"].values()):
-            symptom_data = comprehensive_data["symptom_assessment"].copy()
-            symptom_data.update({
-                "patient_id": patient_id,
-                "assessment_date": current_time.date().isoformat()
-            })
-            try:
-                symptom_response = supabase.table("patient_symptom_assessments").insert(symptom_data).execute()
-                stored_data["symptom_assessment"] = symptom_response.data[0] if symptom_response.data else None
-            except Exception as e:
-                logger.warning(f"Failed to store symptom assessment: {str(e)}")
-        
-        # Store biomarker results if data exists
-        if comprehensive_data.get("biomarker_results") and any(comprehensive_data["biomarker_results"].values()):
-            biomarker_data = comprehensive_data["biomarker_results"].copy()
-            biomarker_data.update({
-                "patient_id": patient_id,
-                "test_date": current_time.date().isoformat()
-            })
-            try:
-                biomarker_response = supabase.table("patient_biomarkers").insert(biomarker_data).execute()
-                stored_data["biomarker_results"] = biomarker_response.data[0] if biomarker_response.data else None
-            except Exception as e:
-                logger.warning(f"Failed to store biomarker results: {str(e)}")
-        
-        # Store risk assessment if data exists
-        if comprehensive_data.get("risk_assessment") and any(comprehensive_data["risk_assessment"].values()):
-            risk_data = comprehensive_data["risk_assessment"].copy()
-            risk_data.update({
-                "patient_id": patient_id,
-                "assessment_date": current_time.date().isoformat()
-            })
-            try:
-                risk_response = supabase.table("patient_risk_assessments").insert(risk_data).execute()
-                stored_data["risk_assessment"] = risk_response.data[0] if risk_response.data else None
-            except Exception as e:
-                logger.warning(f"Failed to store risk assessment: {str(e)}")
-        
-        logger.info(f"Comprehensive consultation created with extracted data: {list(stored_data.keys())}")
-        
-        return UploadResponse(
-            id=recording_id,
+        consultation = ConsultationInput(
+            upload=stored_upload,
             filename=file.filename,
-            transcript=transcript,
-            summary=summary,
-            patient_id=patient_id,
-            created_at=current_time,
-            extraction_metadata={
-                "basic_clinical": basic_clinical_data,
-                "comprehensive_clinical": comprehensive_data,
-                "stored_tables": list(stored_data.keys())
-            }
+            unique_filename=unique_filename,
+            content_type=file.content_type,
+            patient_id=patient_id
         )
+        if background:
+            job = await enqueue_job("comprehensive", consultation)
+            stored_upload = None  # the job owns the spooled file now
+            return job_accepted_response(job)
         
+        return await run_comprehensive_pipeline(consultation)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to create comprehensive consultation: {str(e)}")
         raise HTTPException(
             status_code=500, 
             detail=f"Failed to create comprehensive consultation: {str(e)}"
         )
+    finally:
+        if stored_upload:
+            discard_temp_file(stored_upload.path)
+
+# Pipelines that background jobs can run, by job kind
+JOB_PIPELINES = {
+    "upload": run_upload_pipeline,
+    "new_patient": run_new_patient_pipeline,
+    "comprehensive": run_comprehensive_pipeline,
+}
+
+@app.get("/metrics/scheduler")
+async def get_scheduler_metrics():
+    """Per-stage, per-class queue depth, running work and wait times, plus the background job backlog."""
+    return {
+        "stages": stage_scheduler.snapshot(),
+        "slots": SCHEDULER_STAGE_SLOTS,
+        "class_weights": SCHEDULER_CLASS_WEIGHTS,
+        "queued_jobs": job_queue.qsize(),
+        "transcoding": transcode_pool.snapshot(),
+    }
+
+@app.get("/metrics/cache")
+async def get_cache_metrics():
+    """Size, hit/miss counts and evictions of the transcript and LLM response caches."""
+    transcript_stats, llm_stats = await asyncio.gather(
+        asyncio.to_thread(transcript_cache.stats),
+        asyncio.to_thread(llm_cache.stats)
+    )
+    return {
+        "transcripts": transcript_stats,
+        "llm_responses": {**llm_stats, "enabled": LLM_CACHE_ENABLED, "bypassed": llm_cache_bypassed, "prompt_version": LLM_PROMPT_VERSION},
+    }
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    """Get the stage, progress and (once finished) result of a background consultation job."""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs/{job_id}/retry", response_model=JobStatus, status_code=202)
+async def retry_job(job_id: str):
+    """Re-queue a failed job; it resumes from the stages that completed before it failed."""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "failed":
+        raise HTTPException(status_code=409, detail=f"Only failed jobs can be retried (job is {job['status']})")
+    if not os.path.exists(job["params"]["upload"]["path"]):
+        raise HTTPException(status_code=410, detail="Uploaded file is no longer available; please upload it again")
+    await asyncio.to_thread(job_store.update, job_id, status="queued", stage="retrying", progress=0.0, error=None)
+    job = await asyncio.to_thread(job_store.get, job_id)
+    await queue_job(job)
+    logger.info(f"Retrying {job['kind']} job {job_id}")
+    return job
+
+# ===============================
+# RESUMABLE UPLOADS
+# ===============================
+
+# Large recordings can be sent in byte ranges over several requests: create a session,
+# PUT ranges with a Content-Range header, GET the session to find the current offset after
+# a dropped connection, then complete it to run the consultation pipeline on the file.
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+UPLOAD_SESSION_MAX_MB = int(os.getenv("UPLOAD_SESSION_MAX_MB", "2048"))
+
+class UploadSessionStore:
+    """Resumable upload sessions persisted in a local SQLite file; the bytes live in UPLOAD_DIR."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS upload_sessions ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, filename TEXT NOT NULL, content_type TEXT, "
+            "patient_id TEXT, total_size INTEGER NOT NULL, received INTEGER NOT NULL DEFAULT 0, "
+            "path TEXT NOT NULL, created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def create(self, session: UploadSessionCreate) -> dict:
+        now = datetime.utcnow().isoformat()
+        upload_id = str(uuid.uuid4())
+        path = os.path.join(UPLOAD_DIR, f"{upload_id}{Path(session.filename).suffix.lower()}")
+        open(path, "wb").close()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO upload_sessions (id, kind, filename, content_type, patient_id, total_size, path, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (upload_id, session.kind, session.filename, session.content_type, session.patient_id,
+                 session.total_size, path, now, now)
+            )
+            self._conn.commit()
+        return self.get(upload_id)
+
+    def get(self, upload_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM upload_sessions WHERE id = ?", (upload_id,)).fetchone()
+        return dict(row) if row else None
+
+    def set_received(self, upload_id: str, received: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE upload_sessions SET received = ?, updated_at = ? WHERE id = ?",
+                (received, datetime.utcnow().isoformat(), upload_id)
+            )
+            self._conn.commit()
+
+    def delete(self, upload_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM upload_sessions WHERE id = ?", (upload_id,))
+            self._conn.commit()
+
+    def purge_expired(self, max_age_hours: float) -> List[str]:
+        """Drop sessions (and their partial files) that have not received data for max_age_hours; returns their ids."""
+        cutoff = datetime.utcfromtimestamp(time.time() - max_age_hours * 3600).isoformat()
+        with self._lock:
+            rows = self._conn.execute("SELECT id, path FROM upload_sessions WHERE updated_at < ?", (cutoff,)).fetchall()
+            self._conn.execute("DELETE FROM upload_sessions WHERE updated_at < ?", (cutoff,))
+            self._conn.commit()
+        for row in rows:
+            discard_temp_file(row["path"])
+        return [row["id"] for row in rows]
+
+upload_sessions = UploadSessionStore(os.path.join(STATE_DIR, "uploads.sqlite3"))
+upload_session_locks: dict = {}  # session id -> asyncio.Lock, only for sessions that exist
+
+def parse_content_range(content_range: Optional[str]) -> tuple:
+    """Parse "bytes start-end/total" (total may be "*") into (start, end, total or None)."""
+    try:
+        unit, byte_range = content_range.strip().split(" ", 1)
+        span, total = byte_range.split("/", 1)
+        start, end = (int(value) for value in span.split("-", 1))
+        if unit != "bytes" or start < 0 or end < start:
+            raise ValueError(content_range)
+        return start, end, None if total == "*" else int(total)
+    except (AttributeError, ValueError):
+        raise HTTPException(status_code=400, detail="Content-Range header must look like 'bytes start-end/total'")
+
+def upload_session_status(session: dict) -> UploadSessionStatus:
+    return UploadSessionStatus(
+        upload_id=session["id"],
+        kind=session["kind"],
+        filename=session["filename"],
+        offset=session["received"],
+        total_size=session["total_size"],
+        complete=session["received"] == session["total_size"],
+        upload_url=f"/uploads/{session['id']}"
+    )
+
+async def get_upload_session(upload_id: str) -> dict:
+    session = await asyncio.to_thread(upload_sessions.get, upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+    return session
+
+async def get_upload_session_lock(upload_id: str) -> asyncio.Lock:
+    """The lock serializing writes to a session (404 for unknown ids, so they don't add locks)."""
+    await get_upload_session(upload_id)
+    return upload_session_locks.setdefault(upload_id, asyncio.Lock())
+
+@app.post("/uploads", response_model=UploadSessionStatus, status_code=201)
+async def create_upload_session(session_data: UploadSessionCreate):
+    """Start a resumable upload for a file that will be processed by the given consultation pipeline."""
+    if session_data.kind not in JOB_PIPELINES:
+        raise HTTPException(status_code=400, detail=f"Unknown upload kind: {session_data.kind}")
+    if session_data.kind == "comprehensive" and not session_data.patient_id:
+        raise HTTPException(status_code=400, detail="patient_id is required for comprehensive consultations")
+    if session_data.total_size <= 0:
+        raise HTTPException(status_code=400, detail="total_size must be positive")
+    if session_data.total_size > UPLOAD_SESSION_MAX_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"Upload is too large (max {UPLOAD_SESSION_MAX_MB} MB)")
+    
+    purged = await asyncio.to_thread(upload_sessions.purge_expired, UPLOAD_SESSION_TTL_HOURS)
+    for purged_id in purged:
+        upload_session_locks.pop(purged_id, None)
+    if purged:
+        logger.info(f"Purged {len(purged)} expired upload session(s)")
+    
+    session = await asyncio.to_thread(upload_sessions.create, session_data)
+    logger.info(f"Created upload session {session['id']} for {session_data.filename} ({session_data.total_size} bytes)")
+    return upload_session_status(session)
+
+@app.get("/uploads/{upload_id}", response_model=UploadSessionStatus)
+async def get_upload_session_status(upload_id: str):
+    """Get the current offset of an upload session, i.e. where the client should resume."""
+    return upload_session_status(await get_upload_session(upload_id))
+
+@app.put("/uploads/{upload_id}", response_model=UploadSessionStatus)
+async def upload_session_range(upload_id: str, request: Request, content_range: Optional[str] = Header(None)):
+    """
+    Write one byte range of an upload session (Content-Range: bytes start-end/total).
+    A range may not start past the current offset; re-sending bytes that were already
+    received is allowed. If the connection drops mid-range, whatever arrived is kept.
+    """
+    start, end, total = parse_content_range(content_range)
+    lock = await get_upload_session_lock(upload_id)
+    async with lock:
+        session = await get_upload_session(upload_id)
+        if total is not None and total != session["total_size"]:
+            raise HTTPException(status_code=400, detail=f"Upload size is {session['total_size']} bytes, not {total}")
+        if end >= session["total_size"]:
+            raise HTTPException(status_code=416, detail=f"Range ends past the upload size of {session['total_size']} bytes")
+        if start > session["received"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Range starts at {start} but only {session['received']} bytes have been received",
+                headers={"Upload-Offset": str(session["received"])}
+            )
+        
+        position = start
+        try:
+            with open(session["path"], "r+b") as upload_file:
+                upload_file.seek(start)
+                async for block in request.stream():
+                    block = block[:end + 1 - position]  # ignore anything past the declared range
+                    if block:
+                        await asyncio.to_thread(upload_file.write, block)
+                        position += len(block)
+        except ClientDisconnect:
+            logger.warning(f"Upload session {upload_id}: client disconnected at byte {position}")
+        finally:
+            session["received"] = max(session["received"], position)
+            await asyncio.to_thread(upload_sessions.set_received, upload_id, session["received"])
+    
+    return upload_session_status(session)
+
+@app.post("/uploads/{upload_id}/complete", response_model=UploadResponse)
+async def complete_upload_session(
+    upload_id: str,
+    background: bool = Query(False, description="Run as a background job and return 202 with a job id")
+):
+    """Finish a resumable upload and run its consultation pipeline on the assembled file (no extra copy).
+
+    The session and its file are kept until the pipeline succeeds (or a background job takes
+    the file over), so a failed completion can simply be retried; the retry resumes from the
+    pipeline's checkpoints. The session lock is held throughout, so two completions of one
+    session never run at once.
+    """
+    lock = await get_upload_session_lock(upload_id)
+    async with lock:
+        session = await get_upload_session(upload_id)
+        if session["received"] != session["total_size"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload incomplete: {session['received']} of {session['total_size']} bytes received",
+                headers={"Upload-Offset": str(session["received"])}
+            )
+        admit_transcoding(session["content_type"], background)
+        sha256 = await asyncio.to_thread(hash_file, session["path"])
+        logger.info(f"Upload session {upload_id} complete: {session['filename']}, sha256: {sha256}")
+        consultation = ConsultationInput(
+            upload=StoredUpload(path=session["path"], size=session["total_size"], sha256=sha256),
+            filename=session["filename"],
+            unique_filename=os.path.basename(session["path"]),
+            content_type=session["content_type"],
+            patient_id=session["patient_id"],
+            run_scope=f"upload-session:{upload_id}"
+        )
+        
+        try:
+            if background:
+                job = await enqueue_job(session["kind"], consultation)
+                response = job_accepted_response(job)
+            else:
+                response = await JOB_PIPELINES[session["kind"]](consultation)
+        except Exception as e:
+            # Keep the session (with a fresh expiry) so the client can retry the completion
+            await asyncio.to_thread(upload_sessions.set_received, upload_id, session["received"])
+            if isinstance(e, HTTPException):
+                raise
+            logger.error(f"Failed to process upload session {upload_id}: {str(e)}")
+            raise HTTPException(
+                status_code=500, 
+                detail=f"Internal server error: {str(e)}"
+            )
+        
+        await asyncio.to_thread(upload_sessions.delete, upload_id)
+        upload_session_locks.pop(upload_id, None)
+        if not background:
+            discard_temp_file(session["path"])  # a background job owns the file and removes it itself
+        return response
+
+# ===============================
+# BATCH INGESTION
+# ===============================
+
+# Onboarding a transferred patient means many prior notes, PDFs and recordings at once. They
+# can be sent in one request (as files and/or zip archives); each is read or transcribed and
+# summarized in parallel, still within the transcoding pool and stage scheduler shared with
+# every other request. Per-file results stream back as NDJSON as soon as they finish, and the
+# recordings rows are written in bulk.
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "200"))
+BATCH_MAX_ZIP_BYTES = int(os.getenv("BATCH_MAX_ZIP_BYTES", str(2 * 1024 ** 3)))  # uncompressed
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_INSERT_SIZE = int(os.getenv("BATCH_INSERT_SIZE", "25"))
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+FAILED_TRANSCRIPT_PREFIXES = ("Transcription failed", "Audio transcription failed", "PDF processing failed")
+
+def guess_content_type(filename: str, declared: Optional[str] = None) -> Optional[str]:
+    """The declared content type, or one guessed from the file name when it is missing or generic."""
+    if declared and declared != "application/octet-stream":
+        return declared
+    return mimetypes.guess_type(filename)[0] or declared
+
+def _unpack_zip_to_disk(zip_path: str, limit: int) -> List[Tuple[str, StoredUpload]]:
+    """Copy every file in a zip archive to UPLOAD_DIR; returns (file name, stored upload) pairs."""
+    entries = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            members = [
+                member for member in archive.infolist()
+                if not member.is_dir()
+                and not member.filename.startswith("__MACOSX/")
+                and not os.path.basename(member.filename).startswith(".")
+            ]
+            if len(members) > limit:
+                raise HTTPException(status_code=413, detail=f"Too many files in batch (max {BATCH_MAX_FILES})")
+            if sum(member.file_size for member in members) > BATCH_MAX_ZIP_BYTES:
+                raise HTTPException(status_code=413, detail="Zip archive is too large once extracted")
+            for member in members:
+                filename = os.path.basename(member.filename)
+                destination_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}{Path(filename).suffix.lower()}")
+                with archive.open(member) as source:
+                    entries.append((filename, _copy_upload_to_disk(source, destination_path)))
+    except Exception:
+        for _filename, stored_upload in entries:
+            discard_temp_file(stored_upload.path)
+        raise
+    return entries
+
+async def spool_batch_files(files: List[UploadFile], patient_id: str) -> List[ConsultationInput]:
+    """Spool every uploaded file (expanding zip archives) to disk, so the response can stream after the request body is gone."""
+    consultations: List[ConsultationInput] = []
+    batch_scope = new_run_scope()
+    try:
+        for file in files:
+            filename = file.filename or "upload"
+            unique_filename = f"{uuid.uuid4()}{Path(filename).suffix.lower()}"
+            stored_upload = await spool_upload(file, unique_filename)
+            content_type = guess_content_type(filename, file.content_type)
+            if content_type in ZIP_CONTENT_TYPES or filename.lower().endswith(".zip"):
+                try:
+                    members = await asyncio.to_thread(
+                        _unpack_zip_to_disk, stored_upload.path, BATCH_MAX_FILES - len(consultations)
+                    )
+                except zipfile.BadZipFile:
+                    raise HTTPException(status_code=400, detail=f"Not a valid zip archive: {filename}")
+                finally:
+                    discard_temp_file(stored_upload.path)
+                entries = [(member_name, member_upload, guess_content_type(member_name)) for member_name, member_upload in members]
+            else:
+                entries = [(filename, stored_upload, content_type)]
+            for entry_filename, entry_upload, entry_content_type in entries:
+                consultations.append(ConsultationInput(
+                    upload=entry_upload,
+                    filename=entry_filename,
+                    unique_filename=os.path.basename(entry_upload.path),
+                    content_type=entry_content_type,
+                    patient_id=patient_id,
+                    run_scope=f"{batch_scope}:{len(consultations)}"  # identical files in one batch are separate runs
+                ))
+            if len(consultations) > BATCH_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"Too many files in batch (max {BATCH_MAX_FILES})")
+    except Exception:
+        for consultation in consultations:
+            discard_temp_file(consultation.upload.path)
+        raise
+    return consultations
+
+@exclusive_run("batch")
+async def prepare_batch_recording(consultation: ConsultationInput) -> Tuple[dict, List[TranscriptSegment], PipelineRun]:
+    """Read or transcribe one batch file and summarize it; returns its recordings row (not yet written)."""
+    enter_work_context(consultation)
+    run = PipelineRun("batch", consultation)
+    summarizer = StreamingSummary()
+    content_type = consultation.content_type or ""
+    segments: List[TranscriptSegment] = []
+    if content_type.startswith(("audio/", "video/")):
+        audio_transcript = await run.transcribe_audio(consultation, summarizer.add_chunk)
+        transcript, segments = audio_transcript.text, audio_transcript.segments
+    elif content_type == "application/pdf":
+        transcript = await process_pdf_file(consultation.upload.path, consultation.unique_filename)
+    else:
+        try:
+            transcript = read_text_upload(consultation.upload)
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {consultation.content_type}")
+    if transcript.startswith(FAILED_TRANSCRIPT_PREFIXES):
+        raise RuntimeError(transcript)
+    
+    summary = await run.stage("summary", lambda: summarizer.finish(transcript), summary_is_complete)
+    recording_id = await run.stage("recording_id", lambda: str(uuid.uuid4()))
+    recording_record = {
+        "id": recording_id,
+        "filename": consultation.unique_filename,
+        "transcript": transcript,
+        "summary": summary,
+        "patient_id": consultation.patient_id,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    return recording_record, segments, run
+
+async def save_batch_recordings(prepared: List[tuple]) -> List[str]:
+    """Write prepared recordings rows in one request, then their segments; returns the saved ids."""
+    response = await db_execute(supabase.table("recordings").upsert([record for record, _segments, _run in prepared]))
+    if not response.data:
+        raise RuntimeError("No data returned from recordings insert")
+    for record, segments, run in prepared:
+        await save_recording_segments(record["id"], segments)
+        await run.complete()
+    return [record["id"] for record, _segments, _run in prepared]
+
+async def stream_batch_results(consultations: List[ConsultationInput]):
+    """Process batch files in parallel, yielding one NDJSON line per file and per bulk write."""
+    transcode_can_wait.set(True)  # admitted as a whole; individual files wait for slots
+    semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+    finished: asyncio.Queue = asyncio.Queue()
+    
+    async def process(index: int, consultation: ConsultationInput) -> None:
+        async with semaphore:
+            try:
+                await finished.put((index, await prepare_batch_recording(consultation), None))
+            except Exception as e:
+                await finished.put((index, None, e))
+            finally:
+                discard_temp_file(consultation.upload.path)
+    
+    def event(payload: dict) -> str:
+        return json.dumps(payload) + "\n"
+    
+    tasks = [asyncio.create_task(process(index, consultation)) for index, consultation in enumerate(consultations)]
+    pending: List[tuple] = []
+    saved_count = 0
+    failed_count = 0
+    
+    async def flush():
+        nonlocal saved_count, failed_count
+        batch, pending[:] = list(pending), []
+        try:
+            recording_ids = await save_batch_recordings(batch)
+            saved_count += len(recording_ids)
+            logger.info(f"Batch ingestion saved {len(recording_ids)} recordings")
+            return event({"type": "saved", "recording_ids": recording_ids})
+        except Exception as e:
+            failed_count += len(batch)
+            logger.error(f"Batch ingestion failed to save {len(batch)} recordings: {str(e)}")
+            return event({"type": "error", "recording_ids": [record["id"] for record, _segments, _run in batch], "error": str(e)})
+    
+    try:
+        for _ in range(len(tasks)):
+            index, prepared, error = await finished.get()
+            filename = consultations[index].filename
+            if error is not None:
+                failed_count += 1
+                detail = error.detail if isinstance(error, HTTPException) else str(error)
+                logger.warning(f"Batch file {filename} failed: {detail}")
+                yield event({"type": "file", "index": index, "filename": filename, "status": "failed", "error": detail})
+                continue
+            record, _segments, _run = prepared
+            yield event({
+                "type": "file", "index": index, "filename": filename, "status": "processed",
+                "recording_id": record["id"], "summary": record["summary"]
+            })
+            pending.append(prepared)
+            if len(pending) >= BATCH_INSERT_SIZE:
+                yield await flush()
+        if pending:
+            yield await flush()
+        yield event({"type": "done", "files": len(consultations), "saved": saved_count, "failed": failed_count})
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for consultation in consultations:
+            discard_temp_file(consultation.upload.path)
+
+@app.post("/upload/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    patient_id: str = Form(...)
+):
+    """
+    Ingest many files for one patient (notes, PDFs, recordings, or zip archives of them).
+    Streams NDJSON: {"type": "file", ...} per file as it finishes, {"type": "saved", ...}
+    after each bulk write of recordings rows, and a final {"type": "done", ...}.
+    """
+    logger.info(f"Received batch upload of {len(files)} file(s) for patient {patient_id}")
+    consultations = await spool_batch_files(files, patient_id)
+    try:
+        for consultation in consultations:
+            if consultation.content_type and consultation.content_type.startswith(("audio/", "video/")):
+                admit_transcoding(consultation.content_type, background=False)
+                break
+    except HTTPException:
+        for consultation in consultations:
+            discard_temp_file(consultation.upload.path)
+        raise
+    logger.info(f"Batch for patient {patient_id}: {len(consultations)} file(s) spooled")
+    return StreamingResponse(stream_batch_results(consultations), media_type="application/x-ndjson")
+
+# ===============================
+# IDEMPOTENCY KEYS
+# ===============================
+
+# Ingestion endpoints accept an Idempotency-Key header. A retry with the same key (on the same
+# path) while the first request is still running waits for it (up to
+# IDEMPOTENCY_JOIN_TIMEOUT_SECONDS, then 409) and gets its response; a retry after it finished
+# gets the stored response replayed, with Idempotent-Replayed: true. Only successful responses
+# are stored, so a failed request can simply be retried. The running request holds a claim on
+# its key in the same SQLite store, so this works across worker processes; a claim left by a
+# crashed worker lapses after IDEMPOTENCY_CLAIM_SECONDS. A key reused for a different request
+# (method, path, query, media type or body length differ) gets 422 instead of a replay; bodies
+# are not hashed, since uploads are streamed to disk rather than buffered here.
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_JOIN_TIMEOUT_SECONDS = float(os.getenv("IDEMPOTENCY_JOIN_TIMEOUT_SECONDS", "600"))
+IDEMPOTENCY_CLAIM_SECONDS = float(os.getenv("IDEMPOTENCY_CLAIM_SECONDS", "3600"))
+IDEMPOTENCY_POLL_SECONDS = 0.25
+IDEMPOTENT_PATHS = re.compile(r"^/(upload|upload/batch|consultation/new_patient|consultation/comprehensive|uploads/[^/]+/complete)$")
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+class IdempotencyStore:
+    """Responses of finished idempotent requests and claims of running ones, persisted in a local SQLite file."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)  # transactions are explicit
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, status_code INTEGER NOT NULL, media_type TEXT, body BLOB NOT NULL, created_at REAL NOT NULL, "
+            "fingerprint TEXT)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(responses)")]
+        if "fingerprint" not in columns:  # stores written before responses were fingerprinted
+            self._conn.execute("ALTER TABLE responses ADD COLUMN fingerprint TEXT")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, token TEXT NOT NULL, fingerprint TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def claim(self, key: str, fingerprint: str) -> tuple:
+        """Atomically look up key and claim it if it is free.
+
+        Returns ("stored", (status_code, media_type, body, fingerprint)) for a finished request,
+        ("claimed", token) when the caller now owns the key, or ("running", fingerprint of the
+        request holding it).
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")  # also serializes other worker processes
+            try:
+                stored = self._conn.execute(
+                    "SELECT status_code, media_type, body, fingerprint FROM responses WHERE key = ? AND created_at >= ?",
+                    (key, now - IDEMPOTENCY_TTL_HOURS * 3600)
+                ).fetchone()
+                if stored:
+                    return "stored", stored
+                self._conn.execute("DELETE FROM claims WHERE key = ? AND created_at < ?", (key, now - IDEMPOTENCY_CLAIM_SECONDS))
+                holder = self._conn.execute("SELECT fingerprint FROM claims WHERE key = ?", (key,)).fetchone()
+                if holder:
+                    return "running", holder[0]
+                token = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO claims (key, token, fingerprint, created_at) VALUES (?, ?, ?, ?)", (key, token, fingerprint, now)
+                )
+                return "claimed", token
+            finally:
+                self._conn.execute("COMMIT")
+
+    def complete(self, key: str, token: str, fingerprint: str, status_code: int, media_type: Optional[str], body: bytes) -> None:
+        """Store the response of a claimed request and drop its claim, in one transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, status_code, media_type, body, created_at, fingerprint) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, status_code, media_type, body, time.time(), fingerprint)
+                )
+                self._conn.execute("DELETE FROM claims WHERE key = ? AND token = ?", (key, token))
+            finally:
+                self._conn.execute("COMMIT")
+
+    def release(self, key: str, token: str) -> None:
+        """Drop a claim without storing a response (the request failed or was abandoned)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM claims WHERE key = ? AND token = ?", (key, token))
+
+    def purge_older_than(self, max_age_seconds: float) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - max_age_seconds,))
+            self._conn.execute("DELETE FROM claims WHERE created_at < ?", (time.time() - IDEMPOTENCY_CLAIM_SECONDS,))
+
+idempotency_store = IdempotencyStore(os.path.join(STATE_DIR, "idempotency.sqlite3"))
+
+def request_fingerprint(request: Request) -> str:
+    """What must match for a reused Idempotency-Key to count as the same request."""
+    parts = [
+        request.method,
+        request.url.path,
+        sorted(request.query_params.multi_items()),
+        request.headers.get("content-type", "").split(";")[0].strip().lower(),  # without the multipart boundary
+        request.headers.get("content-length"),
+    ]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+def key_reused_response(key: str) -> JSONResponse:
+    logger.warning(f"Idempotency key {key} reused for a different request")
+    return JSONResponse(status_code=422, content={"detail": "Idempotency-Key was already used for a different request"})
+
+def replay_stored_response(stored: tuple):
+    status_code, media_type, body, _fingerprint = stored
+    return Response(content=body, status_code=status_code, media_type=media_type, headers={"Idempotent-Replayed": "true"})
+
+class ClaimReleasingResponse(StreamingResponse):
+    """StreamingResponse that runs on_close once sending ends, however it ends.
+
+    A client that disconnects before the body is read means the body iterator never starts
+    (so its own finally never runs); this still releases the idempotency claim.
+    """
+
+    def __init__(self, *args, on_close: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await asyncio.shield(self.on_close())
+
+async def idempotency_keys(request: Request, call_next):
+    """Deduplicate retried ingestion requests that carry an Idempotency-Key header."""
+    key = request.headers.get("idempotency-key")
+    if request.method != "POST" or not key or not IDEMPOTENT_PATHS.match(request.url.path):
+        return await call_next(request)
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return JSONResponse(status_code=400, content={"detail": "Idempotency-Key is too long"})
+    scoped_key = f"{request.url.path}:{key}"
+    request_idempotency_key.set(scoped_key)  # pipelines started by this request checkpoint under it
+    fingerprint = request_fingerprint(request)
+    
+    deadline = time.monotonic() + IDEMPOTENCY_JOIN_TIMEOUT_SECONDS
+    joined = False
+    while True:
+        state, value = await asyncio.to_thread(idempotency_store.claim, scoped_key, fingerprint)
+        if state == "stored":
+            if value[3] is not None and value[3] != fingerprint:
+                return key_reused_response(key)
+            logger.info(f"Replaying stored response for idempotency key {key}")
+            return replay_stored_response(value)
+        if state == "claimed":
+            token = value
+            break
+        if value != fingerprint:
+            return key_reused_response(key)
+        # Join the running request; if it fails nothing is stored and this one runs instead
+        if not joined:
+            logger.info(f"Joining in-flight request for idempotency key {key}")
+            joined = True
+        if time.monotonic() >= deadline:
+            return JSONResponse(
+                status_code=409,
+                content={"detail": "A request with this Idempotency-Key is still being processed; retry later"},
+                headers={"Retry-After": "30"}
+            )
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+    
+    async def release() -> None:
+        await asyncio.to_thread(idempotency_store.release, scoped_key, token)
+    
+    try:
+        response = await call_next(request)
+    except BaseException:
+        await asyncio.shield(release())
+        raise
+    if response.status_code >= 300:
+        await release()
+        return response
+    
+    async def body_then_store():
+        # Streamed responses (batch ingestion) pass through unchanged and are stored once complete
+        chunks = []
+        async for chunk in response.body_iterator:
+            chunks.append(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+            yield chunk
+        await asyncio.to_thread(
+            idempotency_store.complete, scoped_key, token, fingerprint, response.status_code,
+            response.media_type or response.headers.get("content-type"), b"".join(chunks)
+        )
+    
+    # The claim is released after sending in every case (a no-op once complete() dropped it)
+    return ClaimReleasingResponse(
+        body_then_store(), status_code=response.status_code, headers=dict(response.headers),
+        background=response.background, on_close=release
+    )
 
 @app.delete("/patients/{patient_id}")
 async def delete_patient(patient_id: str):
@@ -2302,18 +5354,18 @@ async def delete_patient(patient_id: str):
         logger.info(f"Deleting patient: {patient_id}")
         
         # Check if patient exists
-        existing = supabase.table("patients").select("id").eq("id", patient_id).execute()
+        existing = await db_execute(supabase.table("patients").select("id").eq("id", patient_id))
         if not existing.data:
             raise HTTPException(status_code=404, detail="Patient not found")
         
         # Get all baselines for this patient to delete their tumors first
-        baselines = supabase.table("patient_baselines").select("id").eq("patient_id", patient_id).execute()
+        baselines = await db_execute(supabase.table("patient_baselines").select("id").eq("patient_id", patient_id))
         baseline_ids = [baseline["id"] for baseline in baselines.data] if baselines.data else []
         
         # Delete baseline tumors first (foreign key dependency)
         if baseline_ids:
             for baseline_id in baseline_ids:
-                supabase.table("baseline_tumors").delete().eq("baseline_id", baseline_id).execute()
+                await db_execute(supabase.table("baseline_tumors").delete().eq("baseline_id", baseline_id))
                 logger.info(f"Deleted tumors for baseline: {baseline_id}")
         
         # Delete all related records in order (to avoid foreign key constraints)
@@ -2337,7 +5389,7 @@ async def delete_patient(patient_id: str):
         deleted_counts = {}
         for table in tables_to_clean:
             try:
-                result = supabase.table(table).delete().eq("patient_id", patient_id).execute()
+                result = await db_execute(supabase.table(table).delete().eq("patient_id", patient_id))
                 # Supabase doesn't return count directly, but we can log the operation
                 deleted_counts[table] = len(result.data) if result.data else 0
                 logger.info(f"Deleted records from {table}")
@@ -2346,7 +5398,7 @@ async def delete_patient(patient_id: str):
                 # Continue with other tables even if one fails
         
         # Finally delete the patient record
-        response = supabase.table("patients").delete().eq("id", patient_id).execute()
+        response = await db_execute(supabase.table("patients").delete().eq("id", patient_id))
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Patient not found during deletion")
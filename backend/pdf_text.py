@@ -0,0 +1,27 @@
+# PDF page text extraction, run in worker processes by main.process_pdf_file.
+# Kept out of main.py so spawned workers import only pypdf, not the app
+# (Supabase/OpenAI clients, SQLite stores, env checks).
+
+from typing import List
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional: without it PDFs can't be read
+    PdfReader = None
+
+
+def page_count(path: str) -> int:
+    """Number of pages; only the page tree is read, not the page contents."""
+    return len(PdfReader(path).pages)
+
+
+def extract_pages(path: str, first_page: int, last_page: int) -> List[str]:
+    """Text of pages [first_page, last_page) (0-based); a page that fails to parse yields ""."""
+    reader = PdfReader(path)
+    texts = []
+    for page_index in range(first_page, last_page):
+        try:
+            texts.append(reader.pages[page_index].extract_text() or "")
+        except Exception:
+            texts.append("")
+    return texts
@@ -0,0 +1,79 @@
+# Extraction benchmark: the four separate LLM calls vs. the single unified JSON-schema call
+# Run from backend/ (with the usual .env) with: python scripts/bench_extraction.py --transcript consult.txt
+# Uses the OpenAI API; reports calls, prompt/completion tokens and latency for each path.
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+calls = []
+chat_completion = main.chat_completion
+
+
+async def recorded_chat_completion(stage, **request):
+    started = time.perf_counter()
+    response = await chat_completion(stage, **request)
+    usage = response.usage
+    calls.append((request["model"], usage.prompt_tokens, usage.completion_tokens, time.perf_counter() - started))
+    return response
+
+
+async def separate_path(transcript):
+    # Same shape as the comprehensive pipeline plus demographics: summary first, then the rest concurrently
+    summary = await main.generate_consultation_summary(transcript)
+    await asyncio.gather(
+        main.parse_clinical_data_from_summary(summary),
+        main.extract_patient_demographics_from_transcript(transcript),
+        main.extract_comprehensive_clinical_data(transcript, summary),
+    )
+
+
+async def unified_path(transcript):
+    data = await main.extract_consultation_unified(transcript, include_summary=True, include_demographics=True, include_oncology=True)
+    if data is None:
+        raise SystemExit("unified extraction failed (see log)")
+
+
+def report(label, wall_seconds):
+    prompt_tokens = sum(call[1] for call in calls)
+    completion_tokens = sum(call[2] for call in calls)
+    call_seconds = sum(call[3] for call in calls)
+    print(
+        f"{label:>9} {len(calls):>6} {prompt_tokens:>8} {completion_tokens:>11} "
+        f"{call_seconds:>10.1f} {wall_seconds:>8.1f}"
+    )
+    for model, prompt, completion, seconds in calls:
+        print(f"{'':>9}   - {model:<14} {prompt:>6} + {completion:>5} tokens {seconds:>6.1f}s")
+
+
+async def run(args):
+    main.chat_completion = recorded_chat_completion
+    main.bypass_llm_cache()  # measure real calls, not cached answers from a previous run
+    for path in args.transcript:
+        with open(path, encoding="utf-8") as transcript_file:
+            transcript = transcript_file.read()
+        print(f"input: {path} ({len(transcript)} characters)")
+        print(f"{'path':>9} {'calls':>6} {'prompt':>8} {'completion':>11} {'call s':>10} {'wall s':>8}")
+        for label, fn in (("separate", separate_path), ("unified", unified_path)):
+            for _ in range(args.repeat):
+                calls.clear()
+                started = time.perf_counter()
+                await fn(transcript)
+                report(label, time.perf_counter() - started)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Compare separate and unified LLM extraction")
+    parser.add_argument("--transcript", nargs="+", required=True, help="Transcript text file(s)")
+    parser.add_argument("--repeat", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
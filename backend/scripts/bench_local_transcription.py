@@ -0,0 +1,60 @@
+# Local transcription benchmark: real-time factor of faster-whisper models on this host's CPU
+# Run from backend/ with: python scripts/bench_local_transcription.py --audio consult.m4a --models base small
+# RTF = processing seconds / audio seconds (below 1.0 is faster than real time).
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def run(args):
+    if main.WhisperModel is None:
+        sys.exit("faster-whisper is not installed (pip install faster-whisper)")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pcm_path = os.path.join(workdir, "decoded.raw")
+        total_samples = asyncio.run(main.decode_to_pcm(args.audio, pcm_path))
+        if args.seconds:
+            total_samples = min(total_samples, int(args.seconds * main.PCM_SAMPLE_RATE))
+        audio_seconds = total_samples / main.PCM_SAMPLE_RATE
+        clip_path = os.path.join(workdir, "clip.wav")
+        main.write_wav_chunk(pcm_path, 0, total_samples, clip_path)
+
+        print(f"input: {args.audio} ({audio_seconds:.0f} s), host cores: {os.cpu_count()}")
+        print(f"{'model':>10} {'compute':>8} {'threads':>8} {'load s':>8} {'run s':>8} {'RTF':>6}")
+        for model_size in args.models:
+            for compute_type in args.compute_types:
+                for threads in args.threads:
+                    backend = main.LocalWhisperBackend(model_size, compute_type, workers=1, threads=threads)
+                    started = time.perf_counter()
+                    backend._get_model()
+                    load_seconds = time.perf_counter() - started
+                    started = time.perf_counter()
+                    backend._transcribe_sync(clip_path)
+                    run_seconds = time.perf_counter() - started
+                    print(
+                        f"{model_size:>10} {compute_type:>8} {threads:>8} "
+                        f"{load_seconds:>8.1f} {run_seconds:>8.1f} {run_seconds / audio_seconds:>6.2f}"
+                    )
+                    backend.executor.shutdown()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure local Whisper real-time factor on CPU")
+    parser.add_argument("--audio", required=True, help="Recording to transcribe")
+    parser.add_argument("--seconds", type=float, default=300, help="Only use the first N seconds (0 = all)")
+    parser.add_argument("--models", nargs="+", default=["base", "small"])
+    parser.add_argument("--compute-types", nargs="+", default=["int8"])
+    parser.add_argument("--threads", type=int, nargs="+", default=[main.LOCAL_WHISPER_THREADS])
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,94 @@
+# PDF extraction benchmark: pages/second of process_pdf_file for 1-page and 200-page documents
+# Run from backend/ (with the usual .env) with: python scripts/bench_pdf_extraction.py --pages 1 200 --workers 1 2 4
+# Pass --pdf to measure real documents instead of synthetic text-layer PDFs.
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+LINES_PER_PAGE = 40
+
+
+def make_pdf(path, pages):
+    """Write a minimal text-layer PDF with LINES_PER_PAGE lines of clinical-looking text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_number in range(1, pages + 1):
+        lines = [
+            f"({'Page %d line %d: patient reports fatigue, CBC within normal limits, follow up in 3 weeks.' % (page_number, line)}) Tj T*"
+            for line in range(1, LINES_PER_PAGE + 1)
+        ]
+        content = ("BT /F1 10 Tf 14 TL 40 800 Td " + " ".join(lines) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode("ascii")
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+
+    with open(path, "wb") as pdf:
+        pdf.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(pdf.tell())
+            pdf.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref_offset = pdf.tell()
+        pdf.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            pdf.write(b"%010d 00000 n \n" % offset)
+        pdf.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+
+
+async def measure(path, workers):
+    if main.pdf_executor is not None:
+        main.pdf_executor.shutdown()
+    main.pdf_executor = None
+    main.PDF_WORKERS = workers
+    # Warm the pool so worker start-up isn't counted against the first document
+    await asyncio.get_running_loop().run_in_executor(main.get_pdf_executor(), main.pdf_text.page_count, path)
+    started = time.perf_counter()
+    text = await main.process_pdf_file(path, os.path.basename(path))
+    return time.perf_counter() - started, len(text)
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        inputs = list(args.pdf or [])
+        for pages in args.pages if not inputs else []:
+            path = os.path.join(workdir, f"synthetic_{pages}p.pdf")
+            make_pdf(path, pages)
+            inputs.append(path)
+
+        print(f"host cores: {os.cpu_count()}, OCR available: {main.pdf_ocr_available()}")
+        print(f"{'input':>22} {'pages':>6} {'workers':>8} {'seconds':>9} {'pages/s':>9} {'chars':>9}")
+        for path in inputs:
+            pages = main.pdf_text.page_count(path)
+            for workers in args.workers:
+                seconds, characters = await measure(path, workers)
+                print(
+                    f"{os.path.basename(path)[-22:]:>22} {pages:>6} {workers:>8} "
+                    f"{seconds:>9.3f} {pages / seconds:>9.1f} {characters:>9}"
+                )
+    if main.pdf_executor is not None:
+        main.pdf_executor.shutdown()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure PDF text extraction throughput")
+    parser.add_argument("--pdf", nargs="+", help="Real PDFs to measure (default: synthetic documents)")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 200], help="Synthetic document sizes")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, main.PDF_WORKERS])
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,91 @@
+# Segmentation benchmark: per-chunk ffmpeg seek loop vs. single-pass decode + PCM slicing
+# Run from backend/ (with the usual .env) with: python scripts/bench_segmentation.py --minutes 30 60 120
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fixed_chunks import fixed_chunk_bounds  # noqa: E402
+from main import decode_to_pcm, write_wav_chunk  # noqa: E402
+
+CHUNK_DURATION = 300
+
+
+def make_input(path, minutes):
+    """Synthesize a stereo 44.1 kHz AAC file, similar to a phone/browser recording."""
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-f", "lavfi",
+        "-i", f"anoisesrc=color=pink:sample_rate=44100:duration={minutes * 60}",
+        "-ac", "2", "-c:a", "aac", "-b:a", "96k", "-y", path
+    ], check=True)
+
+
+def legacy_loop(input_path, workdir, duration_seconds):
+    """The previous implementation: one ffmpeg process per 5-minute chunk."""
+    start_time = 0
+    chunk_number = 0
+    while start_time < duration_seconds:
+        chunk_number += 1
+        chunk_path = os.path.join(workdir, f"legacy_{chunk_number}.wav")
+        subprocess.run([
+            "ffmpeg", "-i", input_path,
+            "-ss", str(start_time), "-t", str(CHUNK_DURATION),
+            "-acodec", "pcm_s16le", "-ar", "16000", "-ac", "1", "-y", chunk_path
+        ], capture_output=True, check=True)
+        os.unlink(chunk_path)
+        start_time += CHUNK_DURATION
+
+
+def single_pass(input_path, workdir):
+    pcm_path = os.path.join(workdir, "decoded.raw")
+    total_samples = asyncio.run(decode_to_pcm(input_path, pcm_path))
+    for chunk_number, (start, end) in enumerate(fixed_chunk_bounds(total_samples, CHUNK_DURATION), 1):
+        chunk_path = os.path.join(workdir, f"single_{chunk_number}.wav")
+        write_wav_chunk(pcm_path, start, end, chunk_path)
+        os.unlink(chunk_path)
+    os.unlink(pcm_path)
+
+
+def measure(fn, *args):
+    before_self = resource.getrusage(resource.RUSAGE_SELF)
+    before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    fn(*args)
+    wall = time.perf_counter() - started
+    after_self = resource.getrusage(resource.RUSAGE_SELF)
+    after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = sum(
+        (getattr(after, field) - getattr(before, field))
+        for before, after in ((before_self, after_self), (before_children, after_children))
+        for field in ("ru_utime", "ru_stime")
+    )
+    return wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare long-audio segmentation strategies")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[30, 60, 120])
+    args = parser.parse_args()
+
+    print(f"{'input':>8} {'strategy':>12} {'wall s':>9} {'cpu s':>9}")
+    for minutes in args.minutes:
+        with tempfile.TemporaryDirectory() as workdir:
+            input_path = os.path.join(workdir, f"input_{minutes}min.m4a")
+            make_input(input_path, minutes)
+            for label, fn, fn_args in (
+                ("legacy", legacy_loop, (input_path, workdir, minutes * 60)),
+                ("single-pass", single_pass, (input_path, workdir)),
+            ):
+                wall, cpu = measure(fn, *fn_args)
+                print(f"{minutes:>6}m {label:>12} {wall:>9.2f} {cpu:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Whisper upload format benchmark: 16-bit WAV chunks vs. low-bitrate OGG/Opus chunks
+# Run from backend/ (with the usual .env) with: python scripts/bench_upload_format.py --audio consult.m4a
+# Add --transcribe to also time the Whisper requests end to end (uses the OpenAI API).
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fixed_chunks import fixed_chunk_bounds  # noqa: E402
+
+
+def chunk_plan(total_samples, fmt):
+    """The chunks the pipeline would send for this format (no quiet-point search, same sizes)."""
+    main.WHISPER_UPLOAD_FORMAT = fmt
+    target_seconds = min(
+        main.CHUNK_TARGET_SECONDS,
+        main.max_chunk_seconds() - main.CHUNK_SEARCH_WINDOW_SECONDS - 2 * main.CHUNK_OVERLAP_SECONDS
+    )
+    return fixed_chunk_bounds(total_samples, int(target_seconds))
+
+
+async def run_format(pcm_path, total_samples, fmt, workdir, transcribe):
+    bounds = chunk_plan(total_samples, fmt)
+    total_bytes = 0
+    started = time.perf_counter()
+    encode_seconds = 0.0
+    for chunk_number, (start, end) in enumerate(bounds, 1):
+        chunk_path = os.path.join(workdir, f"chunk_{chunk_number}.{fmt}")
+        encode_started = time.perf_counter()
+        await main.encode_pcm_chunk(pcm_path, start, end, chunk_path)
+        encode_seconds += time.perf_counter() - encode_started
+        total_bytes += os.path.getsize(chunk_path)
+        os.unlink(chunk_path)
+    if transcribe:
+        await main.transcribe_chunks_concurrently(pcm_path, f"bench_{fmt}", bounds)
+    return len(bounds), total_bytes, encode_seconds, time.perf_counter() - started
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        pcm_path = os.path.join(workdir, "decoded.raw")
+        total_samples = await main.decode_to_pcm(args.audio, pcm_path)
+        minutes = total_samples / main.PCM_SAMPLE_RATE / 60
+        print(f"input: {args.audio} ({minutes:.1f} min)")
+        print(f"{'format':>6} {'chunks':>7} {'MB sent':>9} {'MB/min':>8} {'encode s':>9} {'total s':>9}")
+        for fmt in ("wav", "ogg"):
+            chunks, total_bytes, encode_seconds, total_seconds = await run_format(
+                pcm_path, total_samples, fmt, workdir, args.transcribe
+            )
+            megabytes = total_bytes / (1024 * 1024)
+            print(
+                f"{fmt:>6} {chunks:>7} {megabytes:>9.2f} {megabytes / max(minutes, 1e-9):>8.2f} "
+                f"{encode_seconds:>9.2f} {total_seconds:>9.2f}"
+            )
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Compare Whisper upload formats")
+    parser.add_argument("--audio", required=True, help="Recording to decode and chunk")
+    parser.add_argument("--transcribe", action="store_true", help="Also send the chunks to Whisper and time it")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
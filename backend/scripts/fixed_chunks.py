@@ -0,0 +1,14 @@
+# Back-to-back fixed-length chunk plans, the baseline the benchmarks compare main's
+# quiet-point chunking against. Imported by the scripts in this directory (after they put
+# backend/ on sys.path).
+
+from main import PCM_SAMPLE_RATE
+
+
+def fixed_chunk_bounds(total_samples, chunk_duration=300):
+    """Split a recording into back-to-back (start_sample, end_sample) chunks of chunk_duration seconds."""
+    chunk_samples = chunk_duration * PCM_SAMPLE_RATE
+    return [
+        (start, min(start + chunk_samples, total_samples))
+        for start in range(0, total_samples, chunk_samples)
+    ]
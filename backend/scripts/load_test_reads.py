@@ -0,0 +1,87 @@
+# Read-latency load test: measures GET /patients latency while uploads are in flight
+# Run with: python scripts/load_test_reads.py --audio sample.m4a --uploads 4
+
+import argparse
+import asyncio
+import mimetypes
+import statistics
+import time
+from pathlib import Path
+
+import httpx
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def poll_reads(client, path, duration, interval):
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get(path)
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def upload_loop(client, audio_path, stop_event):
+    content_type = mimetypes.guess_type(audio_path.name)[0] or "audio/mpeg"
+    completed = rejected = 0
+    while not stop_event.is_set():
+        with open(audio_path, "rb") as audio_file:
+            response = await client.post(
+                "/upload",
+                files={"file": (audio_path.name, audio_file, content_type)},
+            )
+        if response.status_code == 429:
+            # Transcoding queue is full: back off as the server asks and count the rejection
+            rejected += 1
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+            continue
+        response.raise_for_status()
+        completed += 1
+    return completed, rejected
+
+
+def report(label, latencies):
+    print(
+        f"{label:<16} n={len(latencies):<5} "
+        f"p50={statistics.median(latencies):7.1f} ms  "
+        f"p99={percentile(latencies, 99):7.1f} ms  "
+        f"max={max(latencies):7.1f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure read latency while uploads run")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--audio", required=True, type=Path, help="Audio file to upload repeatedly")
+    parser.add_argument("--uploads", type=int, default=4, help="Number of concurrent upload loops")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to sample reads for each phase")
+    parser.add_argument("--interval", type=float, default=0.05, help="Pause between reads")
+    parser.add_argument("--read-path", default="/patients")
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=None) as client:
+        baseline = await poll_reads(client, args.read_path, args.duration, args.interval)
+        report("idle", baseline)
+
+        stop_event = asyncio.Event()
+        uploaders = [
+            asyncio.create_task(upload_loop(client, args.audio, stop_event))
+            for _ in range(args.uploads)
+        ]
+        under_load = await poll_reads(client, args.read_path, args.duration, args.interval)
+        stop_event.set()
+        results = await asyncio.gather(*uploaders)
+        report(f"{args.uploads} uploads", under_load)
+        print(f"uploads completed: {sum(completed for completed, _ in results)}, rejected (429): {sum(rejected for _, rejected in results)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
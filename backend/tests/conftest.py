@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+# main reads its settings and opens its SQLite stores at import time
+_state = tempfile.mkdtemp(prefix="ai-clinic-tests-")
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test-anon-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+os.environ["STATE_DIR"] = os.path.join(_state, "state")
+os.environ["CACHE_DIR"] = os.path.join(_state, "cache")
+os.environ["UPLOAD_DIR"] = _state
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from openai.types.chat import ChatCompletion  # noqa: E402
+
+
+def completion(content, finish_reason="stop"):
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "gpt-4",
+        "choices": [{"index": 0, "finish_reason": finish_reason, "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    })
+
+
+@pytest.fixture
+def openai_replies(monkeypatch, tmp_path):
+    replies, requests = [], []
+
+    async def create(**request):
+        requests.append(request)
+        return replies.pop(0)
+
+    monkeypatch.setattr(main, "llm_cache", main.DiskCache(str(tmp_path / "llm.sqlite3"), 1024 * 1024, 3600))
+    monkeypatch.setattr(main, "openai_client", SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    return replies, requests
@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import main
+
+RATE = main.PCM_SAMPLE_RATE
+
+
+@pytest.fixture
+def chunking(monkeypatch):
+    def configure(target, window, overlap):
+        monkeypatch.setattr(main, "CHUNK_TARGET_SECONDS", target)
+        monkeypatch.setattr(main, "CHUNK_SEARCH_WINDOW_SECONDS", window)
+        monkeypatch.setattr(main, "CHUNK_OVERLAP_SECONDS", overlap)
+    return configure
+
+
+def plan(tmp_path, samples):
+    pcm_path = tmp_path / "audio.raw"
+    pcm_path.write_bytes(samples.astype("<i2").tobytes())
+    return main.plan_chunk_bounds(str(pcm_path), len(samples))
+
+
+def speech_with_pauses(seconds, pauses):
+    samples = np.full(int(seconds * RATE), 8000, dtype="<i2")
+    for pause in pauses:
+        samples[int(pause * RATE):int((pause + 0.2) * RATE)] = 0
+    return samples
+
+
+def test_short_recording_is_one_chunk(tmp_path, chunking):
+    chunking(10, 2, 0.5)
+    assert plan(tmp_path, speech_with_pauses(11, [])) == [(0, 11 * RATE)]
+
+
+def test_cuts_land_on_pauses_and_chunks_overlap(tmp_path, chunking):
+    chunking(10, 2, 0.5)
+    bounds = plan(tmp_path, speech_with_pauses(30, [9, 19.5]))
+    overlap = int(0.5 * RATE)
+    cuts = [end - overlap for _, end in bounds[:-1]]
+    assert len(cuts) == 2
+    for cut, pause in zip(cuts, [9, 19.5]):
+        assert pause * RATE <= cut <= (pause + 0.2) * RATE
+    assert bounds[0][0] == 0 and bounds[-1][1] == 30 * RATE
+    for (_, end), (start, _) in zip(bounds, bounds[1:]):
+        assert end - start == 2 * overlap
+
+
+@pytest.mark.parametrize("target, window, overlap", [(2, 1.4, 0.5), (1, 0.5, 0.4), (3, 0, 2.9), (2, 1.9, 0)])
+def test_small_targets_always_move_forward(tmp_path, chunking, target, window, overlap):
+    chunking(target, window, overlap)
+    bounds = plan(tmp_path, np.zeros(60 * RATE))  # silence: the quietest frame is the first one searched
+    starts = [start for start, _ in bounds]
+    assert starts == sorted(set(starts))
+    assert bounds[-1][1] == 60 * RATE
+    longest = (target + window + 2 * overlap + main.ENERGY_FRAME_SECONDS) * RATE
+    assert all(end - start <= longest for start, end in bounds)
+
+
+def test_invalid_chunk_settings_fail_at_import():
+    env = dict(os.environ, CHUNK_TARGET_SECONDS="10", CHUNK_SEARCH_WINDOW_SECONDS="20")
+    result = subprocess.run(
+        [sys.executable, "-c", "import main"], cwd=os.path.dirname(main.__file__), env=env, capture_output=True, text=True
+    )
+    assert result.returncode != 0
+    assert "CHUNK_TARGET_SECONDS must exceed" in result.stderr
+
+
+@pytest.mark.parametrize("previous_text, next_text, expected", [
+    ("we will start the chemotherapy next", "Chemotherapy next week, on Monday.", "week, on Monday."),
+    ("her scan was clear.", "Scan was clear. Good news.", "Good news."),
+    ("and so", "so the dose", "so the dose"),  # one short word is not evidence of overlap
+    ("pain is stable", "Appetite is fine", "Appetite is fine"),
+    ("", "first words", "first words"),
+])
+def test_strip_overlapping_words(previous_text, next_text, expected):
+    assert main.strip_overlapping_words(previous_text, next_text) == expected
+
+
+def test_stitching_leaves_failed_chunks_alone():
+    chunks = ["the patient reports fatigue", "reports fatigue since March", "Transcription failed: timeout", "March"]
+    assert main.stitch_chunk_transcripts(chunks) == [
+        "the patient reports fatigue", "since March", "Transcription failed: timeout", "March",
+    ]
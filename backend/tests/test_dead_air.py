@@ -0,0 +1,72 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import main
+
+RATE = main.PCM_SAMPLE_RATE
+PADDING = main.DEAD_AIR_PADDING_SECONDS
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * RATE), dtype="<i2")
+
+
+def tone(seconds):
+    t = np.arange(int(seconds * RATE)) / RATE
+    return (8000 * np.sin(2 * np.pi * 440 * t)).astype("<i2")
+
+
+def trim(tmp_path, *pieces):
+    pcm_path = tmp_path / "audio.raw"
+    trimmed_path = tmp_path / "trimmed.raw"
+    pcm_path.write_bytes(np.concatenate(pieces).tobytes())
+    result = main.trim_dead_air(str(pcm_path), str(trimmed_path))
+    assert trimmed_path.stat().st_size == result.kept_samples * main.PCM_SAMPLE_WIDTH
+    return result
+
+
+@pytest.mark.parametrize("seconds", [30, 1, 0.05])
+def test_silent_recording_is_dropped_entirely(tmp_path, seconds):
+    result = trim(tmp_path, silence(seconds))
+    assert result.kept_samples == 0
+    assert result.offset_map == []
+
+
+def test_edge_silence_is_cut_without_padding(tmp_path):
+    result = trim(tmp_path, silence(5), tone(2), silence(5))
+    assert result.kept_samples == int((2 + 2 * PADDING) * RATE)
+    assert result.to_original_seconds(0) == pytest.approx(5 - PADDING)
+
+
+def test_inner_silence_keeps_padding_and_maps_back(tmp_path):
+    result = trim(tmp_path, tone(3), silence(10), tone(3))
+    assert result.kept_samples == int((6 + 2 * PADDING) * RATE)
+    assert result.removed_seconds == pytest.approx(10 - 2 * PADDING)
+    assert result.to_original_seconds(1) == pytest.approx(1)
+    # One second into the second burst of speech
+    assert result.to_original_seconds(3 + 2 * PADDING + 1) == pytest.approx(14)
+
+
+def test_short_pause_is_kept(tmp_path):
+    result = trim(tmp_path, tone(2), silence(1), tone(2))
+    assert result.kept_samples == 5 * RATE
+    assert result.offset_map == [(0, 0, 5 * RATE)]
+
+
+def test_silent_recording_is_not_sent_to_whisper(tmp_path, monkeypatch):
+    async def decode(input_path, pcm_path):
+        silent = silence(20)
+        with open(pcm_path, "wb") as pcm_file:
+            pcm_file.write(silent.tobytes())
+        return len(silent)
+
+    async def transcribe(*args):
+        raise AssertionError("silence reached Whisper")
+
+    monkeypatch.setattr(main, "decode_to_pcm", decode)
+    monkeypatch.setattr(main, "transcribe_chunks_concurrently", transcribe)
+    transcript = asyncio.run(main.process_audio_file(str(tmp_path / "upload.wav"), "silent.wav", "audio/wav"))
+    assert transcript.text == ""
+    assert transcript.segments == []
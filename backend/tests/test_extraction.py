@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+from conftest import completion
+
+
+class FakeSummarizer:
+    streaming = False
+
+    def __init__(self):
+        self.finished = 0
+
+    async def finish(self, transcript):
+        self.finished += 1
+        return "- merged summary"
+
+
+def test_unified_call_is_skipped_when_transcript_overflows(openai_replies, monkeypatch):
+    replies, requests = openai_replies
+    monkeypatch.setattr(main, "UNIFIED_EXTRACTION_CONTEXT_TOKENS", 100)
+    assert asyncio.run(main.extract_consultation_unified("word " * 500)) is None
+    assert requests == []
+
+
+def test_overlong_transcript_is_extracted_from_merged_summary(monkeypatch):
+    calls = []
+
+    async def unified(text, **kwargs):
+        calls.append((text, kwargs))
+        return {"clinical": {}}
+
+    monkeypatch.setattr(main, "EXTRACTION_MODE", "unified")
+    monkeypatch.setattr(main, "unified_extraction_fits", lambda text, *flags: len(text) < 1000)
+    monkeypatch.setattr(main, "extract_consultation_unified", unified)
+    summarizer = FakeSummarizer()
+
+    async def run():
+        extractor = main.ConsultationExtractor(summarizer)
+        transcript = "[Segment 1] " + "the patient reports fatigue " * 100
+        return await asyncio.gather(extractor.summary(transcript), extractor.clinical(transcript, "- merged summary"))
+
+    summary, _ = asyncio.run(run())
+    assert summary == "- merged summary"
+    assert summarizer.finished == 1
+    assert calls == [("- merged summary", {
+        "include_summary": False, "include_demographics": True, "include_oncology": False, "from_summary": True,
+    })]
+
+
+@pytest.mark.parametrize("transcript_words, sends_transcript", [(50, True), (20000, False)])
+def test_comprehensive_extraction_fits_gpt4_context(openai_replies, transcript_words, sends_transcript):
+    replies, requests = openai_replies
+    replies.append(completion(json.dumps({"symptom_assessment": {"pain_scale": 4}})))
+    data = asyncio.run(main.extract_comprehensive_clinical_data("pain " * transcript_words, "- pain 4/10"))
+    assert data == {"symptom_assessment": {"pain_scale": 4}}
+    prompt = requests[0]["messages"][1]["content"]
+    assert ("Transcript: pain" in prompt) is sends_transcript
+    assert "Summary: - pain 4/10" in prompt
+    assert main.count_tokens(prompt) <= main.SUMMARY_CONTEXT_TOKENS - main.COMPREHENSIVE_RESPONSE_TOKENS
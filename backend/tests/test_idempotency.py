@@ -0,0 +1,152 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def pipeline_runs(monkeypatch):
+    runs = []
+
+    async def fake_pipeline(consultation, report_progress=main.ignore_progress):
+        runs.append(consultation)
+        return main.UploadResponse(
+            id=str(len(runs)), filename=consultation.filename, transcript="t", summary="s",
+            patient_id=None, created_at=datetime(2025, 1, 1)
+        )
+
+    monkeypatch.setattr(main, "run_upload_pipeline", fake_pipeline)
+    monkeypatch.setattr(main, "IDEMPOTENCY_JOIN_TIMEOUT_SECONDS", 2)
+    return runs
+
+
+def upload(client, key, content=b"hello consultation", query=""):
+    return client.post(
+        f"/upload{query}",
+        files={"file": ("notes.txt", content, "text/plain")},
+        headers={"Idempotency-Key": key, "Origin": "http://app.example"},
+    )
+
+
+def test_retry_replays_stored_response(pipeline_runs):
+    client = TestClient(main.app)
+    key = str(uuid.uuid4())
+    first = upload(client, key)
+    retry = upload(client, key)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.headers["access-control-allow-origin"] == "*"
+    assert len(pipeline_runs) == 1
+
+
+def test_key_reused_for_different_request_is_rejected(pipeline_runs):
+    client = TestClient(main.app)
+    key = str(uuid.uuid4())
+    assert upload(client, key).status_code == 200
+    assert upload(client, key, content=b"a different, longer file").status_code == 422
+    assert upload(client, key, query="?background=true").status_code == 422
+    assert len(pipeline_runs) == 1
+
+
+def test_requests_without_key_are_separate_runs(pipeline_runs):
+    client = TestClient(main.app)
+    client.post("/upload", files={"file": ("notes.txt", b"same", "text/plain")})
+    client.post("/upload", files={"file": ("notes.txt", b"same", "text/plain")})
+    assert len(pipeline_runs) == 2
+    assert pipeline_runs[0].run_scope != pipeline_runs[1].run_scope
+
+
+def test_client_dropping_before_body_releases_claim(pipeline_runs):
+    key = str(uuid.uuid4())
+    boundary = "testboundary"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"notes.txt\"\r\n"
+        f"Content-Type: text/plain\r\n\r\nhello consultation\r\n--{boundary}--\r\n"
+    ).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/upload", "raw_path": b"/upload", "query_string": b"",
+        "root_path": "", "server": ("testserver", 80), "client": ("testclient", 123),
+        "headers": [
+            (b"host", b"testserver"),
+            (b"content-type", f"multipart/form-data; boundary={boundary}".encode()),
+            (b"content-length", str(len(body)).encode()),
+            (b"idempotency-key", key.encode()),
+        ],
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}  # the client is gone before the response body is read
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            raise OSError("connection reset")
+
+    async def drop_then_retry():
+        try:
+            await main.app(scope, receive, send)
+        except OSError:
+            pass
+        return await asyncio.to_thread(main.idempotency_store.claim, f"/upload:{key}", "other")
+
+    state, _ = asyncio.run(drop_then_retry())
+    assert len(pipeline_runs) == 1
+    assert state == "claimed"  # nothing left holding the key, so a retry runs instead of waiting
+
+
+def test_running_request_with_same_key_times_out_with_409(pipeline_runs, monkeypatch):
+    monkeypatch.setattr(main, "IDEMPOTENCY_JOIN_TIMEOUT_SECONDS", 0.3)
+    client = TestClient(main.app)
+    key = str(uuid.uuid4())
+    request = client.build_request(
+        "POST", "/upload", files={"file": ("notes.txt", b"hello consultation", "text/plain")},
+        headers={"Idempotency-Key": key}
+    )
+    fingerprint = main.request_fingerprint(main.Request({
+        "type": "http", "method": "POST", "path": "/upload", "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in request.headers.items()],
+    }))
+    state, _token = main.idempotency_store.claim(f"/upload:{key}", fingerprint)  # another worker is running it
+    assert state == "claimed"
+    response = client.send(request)
+    assert response.status_code == 409
+    assert response.headers["Retry-After"]
+    assert not pipeline_runs
+
+
+def test_concurrent_retry_joins_running_request(monkeypatch):
+    runs = []
+
+    async def slow_pipeline(consultation, report_progress=main.ignore_progress):
+        runs.append(consultation)
+        await asyncio.sleep(0.5)
+        return main.UploadResponse(
+            id="only", filename=consultation.filename, transcript="t", summary="s",
+            patient_id=None, created_at=datetime(2025, 1, 1)
+        )
+
+    monkeypatch.setattr(main, "run_upload_pipeline", slow_pipeline)
+    key = str(uuid.uuid4())
+
+    async def send_twice():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await asyncio.gather(*(
+                client.post("/upload", files={"file": ("notes.txt", b"hello consultation", "text/plain")},
+                            headers={"Idempotency-Key": key})
+                for _ in range(2)
+            ))
+
+    first, second = asyncio.run(send_twice())
+    assert first.status_code == second.status_code == 200
+    assert first.json()["id"] == second.json()["id"] == "only"
+    assert len(runs) == 1
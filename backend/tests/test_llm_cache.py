@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import main
+from conftest import completion
+
+
+def ask(content="transcript", **kwargs):
+    return asyncio.run(main.chat_completion(
+        "summary", model="gpt-4", messages=[{"role": "user", "content": content}], **kwargs
+    )).choices[0].message.content
+
+
+def test_identical_request_is_served_from_cache(openai_replies):
+    replies, requests = openai_replies
+    replies.append(completion("- summary"))
+    assert ask() == ask() == "- summary"
+    assert len(requests) == 1
+
+
+def test_truncated_answer_is_not_cached(openai_replies):
+    replies, requests = openai_replies
+    replies.extend([completion("- cut off", finish_reason="length"), completion("- complete")])
+    assert ask() == "- cut off"
+    assert ask() == "- complete"
+    assert len(requests) == 2
+
+
+def test_malformed_json_is_not_cached(openai_replies):
+    replies, requests = openai_replies
+    replies.extend([completion('{"diagnosis": '), completion('```json\n{"diagnosis": "NSCLC"}\n```')])
+    assert ask(cache_if=main.is_json_reply) == '{"diagnosis": '
+    assert ask(cache_if=main.is_json_reply).endswith("```")
+    assert ask(cache_if=main.is_json_reply).endswith("```")
+    assert len(requests) == 2
+
+
+def test_bypass_skips_cache_but_stores_fresh_answer(openai_replies):
+    replies, requests = openai_replies
+    replies.extend([completion("- first"), completion("- second")])
+    assert ask() == "- first"
+
+    async def refresh():
+        main.bypass_llm_cache()
+        return await main.chat_completion("summary", model="gpt-4", messages=[{"role": "user", "content": "transcript"}])
+
+    assert asyncio.run(refresh()).choices[0].message.content == "- second"
+    assert ask() == "- second"
+    assert len(requests) == 2
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = main.DiskCache(str(tmp_path / "lru.sqlite3"), max_bytes=30)
+    cache.set("a", "x" * 10)
+    cache.set("b", "y" * 10)
+    assert cache.get("a") == "x" * 10  # a is now more recently used than b
+    cache.set("c", "z" * 15)
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 10
+    assert cache.get("c") == "z" * 15
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_cache_expires_entries(tmp_path):
+    cache = main.DiskCache(str(tmp_path / "ttl.sqlite3"), max_bytes=1024, ttl_seconds=0.2)
+    cache.set("a", "value")
+    assert cache.get("a") == "value"
+    time.sleep(0.3)
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 0)
+
+
+def test_disk_cache_skips_values_larger_than_the_cache(tmp_path):
+    cache = main.DiskCache(str(tmp_path / "big.sqlite3"), max_bytes=4)
+    cache.set("a", "too large")
+    assert cache.get("a") is None
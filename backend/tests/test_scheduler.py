@@ -0,0 +1,84 @@
+import asyncio
+
+import main
+
+
+def new_scheduler(slots=1):
+    return main.StageScheduler({"summary": slots}, {"interactive": 8.0, "batch": 1.0})
+
+
+async def queue_work(scheduler, work):
+    """Start each (name, class, tenant, cost) while the only slot is held; return the order they ran in."""
+    release = asyncio.Event()
+    order = []
+
+    async def hold():
+        async with scheduler.slot("summary"):
+            await release.wait()
+
+    async def run(name, priority_class, tenant, cost):
+        main.work_class.set(priority_class)
+        main.work_tenant.set(tenant)
+        async with scheduler.slot("summary", cost):
+            order.append(name)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    tasks = []
+    for item in work:
+        tasks.append(asyncio.create_task(run(*item)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return order
+
+
+def test_interactive_work_overtakes_a_batch_backlog():
+    work = [(f"audio-{n}", "batch", "patient-1", 60.0) for n in range(4)] + [("text", "interactive", "patient-2", 1.0)]
+    order = asyncio.run(queue_work(new_scheduler(), work))
+    # Only the batch job that was already first in line (same start tag, queued earlier) runs before it
+    assert order.index("text") == 1
+
+
+def test_batch_work_is_not_starved():
+    work = [("audio", "batch", "patient-1", 1.0)] + [(f"text-{n}", "interactive", "patient-2", 1.0) for n in range(20)]
+    order = asyncio.run(queue_work(new_scheduler(), work))
+    assert order.index("audio") < 12
+
+
+def test_one_patient_cannot_monopolize_a_stage():
+    work = [(f"long-{n}", "batch", "patient-1", 60.0) for n in range(5)] + [("short", "batch", "patient-2", 60.0)]
+    order = asyncio.run(queue_work(new_scheduler(), work))
+    assert order.index("short") <= 1
+
+
+def test_cancelled_waiter_gives_its_turn_back():
+    stage_scheduler = new_scheduler()
+
+    async def run():
+        release = asyncio.Event()
+        ran = []
+
+        async def hold():
+            async with stage_scheduler.slot("summary"):
+                await release.wait()
+
+        async def wait_for_slot(name):
+            async with stage_scheduler.slot("summary"):
+                ran.append(name)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(wait_for_slot("cancelled"))
+        waiting = asyncio.create_task(wait_for_slot("waiting"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        release.set()
+        await asyncio.gather(holder, waiting)
+        return ran
+
+    assert asyncio.run(run()) == ["waiting"]
+    snapshot = stage_scheduler.snapshot()["summary"]
+    assert snapshot["free_slots"] == 1
+    assert snapshot["classes"]["interactive"]["queue_depth"] == 0
+    assert snapshot["classes"]["interactive"]["completed"] == 2
@@ -0,0 +1,93 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+PART_LABEL = re.compile(r"^\[Part \d+\]", re.M)
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    """Fake chat_completion: part notes echo their part number, merges report how many notes they took."""
+    calls = []
+
+    async def chat_completion(stage, **request):
+        system, user = (message["content"] for message in request["messages"])
+        calls.append((system, user))
+        if system == main.MERGE_SUMMARY_PROMPT:
+            reply = f"- merged {len(PART_LABEL.findall(user))} notes"
+        else:
+            reply = f"- notes on {user.split(' of ')[0]}"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+    monkeypatch.setattr(main, "chat_completion", chat_completion)
+    return calls
+
+
+def merge_budget():
+    return main.SUMMARY_CONTEXT_TOKENS - main.count_tokens(main.MERGE_SUMMARY_PROMPT) - main.SUMMARY_RESPONSE_TOKENS - 100
+
+
+def test_split_keeps_segments_whole_and_within_budget():
+    segments = [f"[Segment {n}] " + " ".join(["the patient reports fatigue"] * 20) for n in range(1, 11)]
+    parts = main.split_transcript("\n\n".join(segments), max_tokens=400)
+    assert len(parts) > 1
+    assert all(main.count_tokens(part) <= 400 for part in parts)
+    assert [segment for part in parts for segment in part.split("\n\n")] == segments
+
+
+def test_split_breaks_an_oversized_segment_on_words():
+    parts = main.split_transcript("[Segment 1] " + "fatigue " * 2000, max_tokens=300)
+    assert len(parts) > 1
+    assert all(main.count_tokens(part) <= 300 for part in parts)
+    assert sum(part.count("fatigue") for part in parts) == 2000
+
+
+def test_long_transcript_is_summarized_in_parts(llm_calls):
+    transcript = "\n\n".join(f"[Segment {n}] " + "the patient reports fatigue " * 200 for n in range(1, 6))
+    assert main.count_tokens(transcript) > main.SUMMARY_SINGLE_PASS_TOKENS
+    summary = asyncio.run(main.generate_consultation_summary(transcript))
+    part_calls = [user for system, user in llm_calls if system == main.PARTIAL_SUMMARY_PROMPT]
+    assert len(part_calls) == len(main.split_transcript(transcript))
+    assert summary == f"- merged {len(part_calls)} notes"
+
+
+def test_merge_rounds_always_shrink_the_notes(llm_calls, monkeypatch):
+    monkeypatch.setattr(
+        main, "SUMMARY_CONTEXT_TOKENS",
+        main.count_tokens(main.MERGE_SUMMARY_PROMPT) + main.SUMMARY_RESPONSE_TOKENS + 100 + 200
+    )
+    notes = [f"- note {n}: " + "fatigue " * 40 for n in range(10)] + ["- oversized note: " + "pain " * 2000]
+    assert asyncio.run(main.merge_partial_summaries(notes)).startswith("- merged")
+    merges = [user for system, user in llm_calls if system == main.MERGE_SUMMARY_PROMPT]
+    assert len(merges) > 2  # merged in rounds
+    assert all(main.count_tokens(user) <= merge_budget() for user in merges)
+    # Every merge call takes at least two notes, so each round leaves fewer notes than it got
+    assert all(len(PART_LABEL.findall(user)) >= 2 for user in merges)
+
+
+def test_streaming_summary_merges_chunk_notes_in_order(llm_calls):
+    async def run():
+        summarizer = main.StreamingSummary()
+        summarizer.add_chunk(1, "the patient reports fatigue since March " * 5)
+        summarizer.add_chunk(0, "scan results were discussed in detail today " * 5)
+        summarizer.add_chunk(2, "Transcription failed: timeout")
+        assert summarizer.streaming
+        return await summarizer.finish("unused transcript")
+
+    assert asyncio.run(run()) == "- merged 2 notes"
+    merge = next(user for system, user in llm_calls if system == main.MERGE_SUMMARY_PROMPT)
+    assert merge.index("notes on Part 1") < merge.index("notes on Part 2")
+
+
+def test_token_counts_fall_back_to_estimate_when_encoding_cannot_load(monkeypatch):
+    def encoding_for_model(model):
+        raise ConnectionError("openaipublic.blob.core.windows.net unreachable")
+
+    monkeypatch.setattr(main, "tiktoken", SimpleNamespace(encoding_for_model=encoding_for_model))
+    monkeypatch.setattr(main, "token_encodings", {})
+    assert main.count_tokens("é" * 30) == 20
+    assert main.count_tokens("twelve bytes") == 4
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import wave
+
+import numpy as np
+import pytest
+
+import main
+
+RATE = main.PCM_SAMPLE_RATE
+
+
+@pytest.fixture
+def fake_chunks(monkeypatch, tmp_path):
+    """Replace the per-chunk Whisper call; chunk numbers in `failing` fail once. Tracks concurrency."""
+    state = {"running": 0, "peak": 0, "calls": [], "failing": set()}
+
+    async def transcribe(pcm_path, unique_filename, chunk_number, start_sample, end_sample):
+        state["calls"].append(chunk_number)
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        try:
+            await asyncio.sleep(0.01)
+            if chunk_number in state["failing"]:
+                state["failing"].discard(chunk_number)
+                raise RuntimeError("Whisper timed out")
+            return [main.TranscriptSegment(start_sample / RATE, end_sample / RATE, f"chunk {chunk_number}")]
+        finally:
+            state["running"] -= 1
+
+    monkeypatch.setattr(main, "_transcribe_pcm_chunk", transcribe)
+    monkeypatch.setattr(main, "TRANSCRIPTION_RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(main, "transcript_cache", main.DiskCache(str(tmp_path / "transcripts.sqlite3"), 1024 * 1024, 3600))
+    return state
+
+
+def bounds(count):
+    return [(index * 10 * RATE, (index + 1) * 10 * RATE) for index in range(count)]
+
+
+def test_chunks_run_concurrently_up_to_the_limit(fake_chunks, monkeypatch):
+    monkeypatch.setattr(main, "TRANSCRIPTION_CONCURRENCY", 3)
+    texts, segments = asyncio.run(main.transcribe_chunks_concurrently("unused.raw", "audio.wav", bounds(8)))
+    assert fake_chunks["peak"] == 3
+    assert texts == [f"chunk {number}" for number in range(1, 9)]
+    assert [segment.text for segment in segments] == texts
+
+
+def test_only_failed_chunks_are_retried(fake_chunks):
+    fake_chunks["failing"].add(2)
+    texts, _ = asyncio.run(main.transcribe_chunks_concurrently("unused.raw", "audio.wav", bounds(4)))
+    assert texts == ["chunk 1", "chunk 2", "chunk 3", "chunk 4"]
+    assert sorted(fake_chunks["calls"]) == [1, 2, 2, 3, 4]
+
+
+def test_only_chunks_that_failed_last_time_are_sent_again(fake_chunks, monkeypatch):
+    monkeypatch.setattr(main, "TRANSCRIPTION_MAX_RETRIES", 0)
+    fake_chunks["failing"].add(3)
+    texts, _ = asyncio.run(main.transcribe_chunks_concurrently("unused.raw", "audio.wav", bounds(3), "checkpoint"))
+    assert texts[2] == "Transcription failed: Whisper timed out"
+    fake_chunks["calls"].clear()
+    seen = []
+    texts, _ = asyncio.run(main.transcribe_chunks_concurrently(
+        "unused.raw", "audio.wav", bounds(3), "checkpoint", on_chunk=lambda index, text: seen.append(index)
+    ))
+    assert fake_chunks["calls"] == [3]
+    assert texts == ["chunk 1", "chunk 2", "chunk 3"]
+    assert sorted(seen) == [0, 1, 2]
+
+
+def test_chunk_file_is_written_under_upload_dir_and_removed(monkeypatch, tmp_path):
+    pcm_path = tmp_path / "audio.raw"
+    pcm_path.write_bytes(np.arange(5 * RATE, dtype="<i2").tobytes())
+    seen = []
+
+    class Backend:
+        name = "fake"
+
+        async def transcribe(self, path):
+            seen.append(path)
+            assert os.path.exists(path)
+            return [main.TranscriptSegment(0.0, 1.0, "hello")]
+
+    monkeypatch.setattr(main, "WHISPER_UPLOAD_FORMAT", "wav")
+    monkeypatch.setattr(main, "choose_transcription_backend", lambda duration_seconds: Backend())
+    segments = asyncio.run(main._transcribe_pcm_chunk(str(pcm_path), "audio.wav", 2, RATE, 3 * RATE))
+    assert [(segment.start, segment.end) for segment in segments] == [(1.0, 2.0)]
+    assert os.path.dirname(seen[0]) == main.UPLOAD_DIR
+    assert not os.path.exists(seen[0])
+
+
+
+def test_wav_chunk_is_an_exact_slice_of_the_pcm(tmp_path):
+    samples = np.arange(-RATE, RATE, dtype="<i2")
+    pcm_path, wav_path = tmp_path / "audio.raw", tmp_path / "chunk.wav"
+    pcm_path.write_bytes(samples.tobytes())
+    main.write_wav_chunk(str(pcm_path), 1234, 20000, str(wav_path))
+    with wave.open(str(wav_path)) as wav_file:
+        assert (wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth()) == (RATE, 1, 2)
+        chunk = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2")
+    assert np.array_equal(chunk, samples[1234:20000])
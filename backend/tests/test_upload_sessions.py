@@ -0,0 +1,66 @@
+import os
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def create_session(client, content, kind="upload"):
+    response = client.post("/uploads", json={
+        "filename": "notes.txt", "content_type": "text/plain", "total_size": len(content), "kind": kind
+    })
+    assert response.status_code == 201
+    session = response.json()
+    response = client.put(
+        session["upload_url"], content=content,
+        headers={"Content-Range": f"bytes 0-{len(content) - 1}/{len(content)}"}
+    )
+    assert response.json()["complete"]
+    return session
+
+
+def test_failed_completion_keeps_upload_for_retry(monkeypatch):
+    attempts = []
+
+    async def flaky_pipeline(consultation, report_progress=main.ignore_progress):
+        attempts.append(consultation)
+        if len(attempts) == 1:
+            raise RuntimeError("Whisper is unavailable")
+        return main.UploadResponse(
+            id="recording", filename=consultation.filename, transcript="t", summary="s",
+            patient_id=None, created_at=datetime(2025, 1, 1)
+        )
+
+    monkeypatch.setitem(main.JOB_PIPELINES, "upload", flaky_pipeline)
+    client = TestClient(main.app)
+    session = create_session(client, b"hello consultation" * 10)
+    path = os.path.join(main.UPLOAD_DIR, f"{session['upload_id']}.txt")
+
+    assert client.post(f"/uploads/{session['upload_id']}/complete").status_code == 500
+    assert os.path.exists(path)
+    assert client.get(session["upload_url"]).json()["complete"]
+
+    assert client.post(f"/uploads/{session['upload_id']}/complete").status_code == 200
+    assert not os.path.exists(path)
+    assert client.get(session["upload_url"]).status_code == 404
+    # Both attempts share a run scope, so the retry resumes from the first one's checkpoints
+    assert attempts[0].run_scope == attempts[1].run_scope
+    assert session["upload_id"] not in main.upload_session_locks
+
+
+def test_unknown_session_does_not_create_lock():
+    client = TestClient(main.app)
+    response = client.put("/uploads/missing", content=b"ab", headers={"Content-Range": "bytes 0-1/2"})
+    assert response.status_code == 404
+    assert client.post("/uploads/missing/complete").status_code == 404
+    assert "missing" not in main.upload_session_locks
+
+
+def test_oversized_session_is_rejected():
+    client = TestClient(main.app)
+    response = client.post("/uploads", json={
+        "filename": "long.m4a", "content_type": "audio/mp4",
+        "total_size": main.UPLOAD_SESSION_MAX_MB * 1024 * 1024 + 1, "kind": "upload"
+    })
+    assert response.status_code == 413
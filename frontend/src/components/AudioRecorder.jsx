@@ -27,6 +27,7 @@ export function AudioRecorder({
   const [isPlaying, setIsPlaying] = useState(false)
   const [hasPermission, setHasPermission] = useState(null) // null = checking, true = granted, false = denied
   const [permissionError, setPermissionError] = useState('')
+  const [liveSegments, setLiveSegments] = useState({})
   
   // Refs
   const mediaRecorderRef = useRef(null)
@@ -34,9 +35,14 @@ export function AudioRecorder({
   const streamRef = useRef(null)
   const durationIntervalRef = useRef(null)
   const audioElementRef = useRef(null)
+  const liveSocketRef = useRef(null)
+  const liveFinalRef = useRef(null)
   
   // Configuration
   const CHUNK_DURATION = 30000 // 30 seconds in milliseconds
+  const LIVE_TIMESLICE = 1000 // stream audio to the server every second while live transcription is on
+  const LIVE_CONNECT_TIMEOUT = 3000
+  const LIVE_TRANSCRIBE_URL = 'ws://localhost:8000/ws/transcribe'
   const MAX_RECORDING_TIME = 3600 // 1 hour in seconds
 
   // Memoize validation result to prevent infinite re-renders
@@ -63,6 +69,7 @@ export function AudioRecorder({
       if (audioUrl) {
         URL.revokeObjectURL(audioUrl)
       }
+      closeLiveSocket()
     }
   }, [])
   
@@ -97,6 +104,62 @@ export function AudioRecorder({
     return `${minutes}:${secs.toString().padStart(2, '0')}`
   }
   
+  // Open the live transcription socket; resolves to null if the server can't be reached
+  // so recording falls back to uploading the whole file at the end
+  const connectLiveTranscription = () => new Promise((resolve) => {
+    let socket
+    try {
+      socket = new WebSocket(LIVE_TRANSCRIBE_URL)
+    } catch (error) {
+      console.warn('Live transcription unavailable:', error)
+      resolve(null)
+      return
+    }
+    
+    let finalResolve
+    let finalReject
+    liveFinalRef.current = new Promise((res, rej) => {
+      finalResolve = res
+      finalReject = rej
+    })
+    liveFinalRef.current.catch(() => {}) // handled when recording stops
+    
+    const timeout = setTimeout(() => {
+      socket.close()
+      resolve(null)
+    }, LIVE_CONNECT_TIMEOUT)
+    
+    socket.onopen = () => {
+      clearTimeout(timeout)
+      resolve(socket)
+    }
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data)
+      if (message.type === 'segment') {
+        setLiveSegments(prev => ({ ...prev, [message.segment]: message.text }))
+      } else if (message.type === 'final') {
+        finalResolve(message.transcript)
+      } else if (message.type === 'error') {
+        finalReject(new Error(message.detail))
+      }
+    }
+    socket.onerror = () => {
+      clearTimeout(timeout)
+      finalReject(new Error('Live transcription connection failed'))
+      resolve(null)
+    }
+    socket.onclose = () => {
+      finalReject(new Error('Live transcription connection closed'))
+    }
+  })
+  
+  const closeLiveSocket = () => {
+    if (liveSocketRef.current) {
+      liveSocketRef.current.close()
+      liveSocketRef.current = null
+    }
+  }
+  
   const startRecording = async () => {
     // Use the validation check from parent component
     if (validationError) {
@@ -120,6 +183,8 @@ export function AudioRecorder({
       
       streamRef.current = stream
       audioChunksRef.current = []
+      setLiveSegments({})
+      liveSocketRef.current = await connectLiveTranscription()
       
       // Create MediaRecorder with appropriate options
       const options = {
@@ -145,6 +210,9 @@ export function AudioRecorder({
       mediaRecorderRef.current.ondataavailable = (event) => {
         if (event.data.size > 0) {
           audioChunksRef.current.push(event.data)
+          if (liveSocketRef.current?.readyState === WebSocket.OPEN) {
+            liveSocketRef.current.send(event.data)
+          }
         }
       }
       
@@ -159,11 +227,11 @@ export function AudioRecorder({
         const url = URL.createObjectURL(finalBlob)
         setAudioUrl(url)
         
-        // Upload final recording
-        uploadFinalRecording(finalBlob)
+        // Upload the live transcript, or the whole recording if live transcription wasn't available
+        finishRecording(finalBlob)
       }
       
-      mediaRecorderRef.current.start(CHUNK_DURATION)
+      mediaRecorderRef.current.start(liveSocketRef.current ? LIVE_TIMESLICE : CHUNK_DURATION)
       setIsRecording(true)
       setIsPaused(false)
       setRecordingDuration(0)
@@ -231,13 +299,34 @@ export function AudioRecorder({
     }
   }
   
-  const uploadFinalRecording = async (finalBlob) => {
+  const finishRecording = async (finalBlob) => {
+    const socket = liveSocketRef.current
+    if (socket?.readyState === WebSocket.OPEN) {
+      setIsUploading(true)
+      onUploadStatusChange('uploading')
+      try {
+        // Everything but the last chunk has already been transcribed
+        socket.send(JSON.stringify({ type: 'stop' }))
+        const transcript = await liveFinalRef.current
+        const transcriptBlob = new Blob([transcript], { type: 'text/plain' })
+        await uploadFinalRecording(transcriptBlob, `recording_${Date.now()}.txt`)
+        return
+      } catch (error) {
+        console.warn('Live transcription failed, uploading full recording:', error)
+      } finally {
+        closeLiveSocket()
+      }
+    }
+    closeLiveSocket()
+    await uploadFinalRecording(finalBlob, `recording_${Date.now()}.webm`)
+  }
+  
+  const uploadFinalRecording = async (finalBlob, filename) => {
     setIsUploading(true)
     onUploadStatusChange('uploading')
     
     try {
       const formData = new FormData()
-      const filename = `recording_${Date.now()}.webm`
       formData.append('file', finalBlob, filename)
       
       let endpoint = 'http://localhost:8000/upload'
@@ -295,6 +384,7 @@ export function AudioRecorder({
     setRecordingDuration(0)
     setIsPlaying(false)
     setUploadProgress(0)
+    setLiveSegments({})
     audioChunksRef.current = []
   }
   
@@ -432,6 +522,24 @@ export function AudioRecorder({
         />
       )}
       
+      {/* Live Transcript */}
+      {Object.keys(liveSegments).length > 0 && (
+        <Card>
+          <CardContent className="pt-6">
+            <div className="space-y-2">
+              <h4 className="font-medium">Live Transcript:</h4>
+              <p className="text-sm text-muted-foreground whitespace-pre-wrap max-h-48 overflow-y-auto">
+                {Object.keys(liveSegments)
+                  .sort((a, b) => a - b)
+                  .map(segment => liveSegments[segment])
+                  .filter(Boolean)
+                  .join(' ')}
+              </p>
+            </div>
+          </CardContent>
+        </Card>
+      )}
+      
       {/* Recording Tips */}
       <Card>
         <CardContent className="pt-6">
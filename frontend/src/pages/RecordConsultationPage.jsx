@@ -19,6 +19,89 @@ import { AudioRecorder } from '@/components/AudioRecorder'
 import { PatientSelector } from '@/components/PatientSelector'
 import { UploadStatus } from '@/components/UploadStatus'
 
+const JOB_POLL_INTERVAL_MS = 2000
+const RESUMABLE_UPLOAD_THRESHOLD = 20 * 1024 * 1024 // files above this are sent in resumable ranges
+const RESUMABLE_PART_SIZE = 8 * 1024 * 1024
+const RESUMABLE_MAX_RETRIES = 5
+
+// Poll a background consultation job until it finishes and return its result
+async function waitForJob(jobId, onProgress) {
+  while (true) {
+    const response = await fetch(`http://localhost:8000/jobs/${jobId}`)
+    if (!response.ok) {
+      throw new Error(`Job status check failed: ${response.statusText}`)
+    }
+    const job = await response.json()
+    onProgress?.(job)
+    if (job.status === 'succeeded') {
+      return job.result
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Processing failed')
+    }
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS))
+  }
+}
+
+// Send a large file in byte ranges through an upload session, resuming from the server's
+// offset after a dropped connection, then complete it as a background job
+async function uploadResumable(file, kind, patientId, onProgress) {
+  const sessionResponse = await fetch('http://localhost:8000/uploads', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      filename: file.name,
+      total_size: file.size,
+      content_type: file.type || null,
+      kind,
+      patient_id: patientId || null,
+    }),
+  })
+  if (!sessionResponse.ok) {
+    throw new Error(`Upload failed: ${sessionResponse.statusText}`)
+  }
+  const session = await sessionResponse.json()
+  const uploadUrl = `http://localhost:8000${session.upload_url}`
+  
+  let offset = session.offset
+  let failures = 0
+  while (offset < file.size) {
+    const end = Math.min(offset + RESUMABLE_PART_SIZE, file.size)
+    try {
+      const response = await fetch(uploadUrl, {
+        method: 'PUT',
+        headers: { 'Content-Range': `bytes ${offset}-${end - 1}/${file.size}` },
+        body: file.slice(offset, end),
+      })
+      if (!response.ok && response.status !== 409) {
+        throw new Error(`Upload failed: ${response.statusText}`)
+      }
+      const status = response.status === 409
+        ? await (await fetch(uploadUrl)).json()
+        : await response.json()
+      offset = status.offset
+      failures = 0
+    } catch (error) {
+      if (++failures > RESUMABLE_MAX_RETRIES) {
+        throw error
+      }
+      // Ask the server how much arrived before the connection dropped, then continue from there
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures))
+      const statusResponse = await fetch(uploadUrl).catch(() => null)
+      if (statusResponse?.ok) {
+        offset = (await statusResponse.json()).offset
+      }
+    }
+    onProgress?.(offset / file.size)
+  }
+  
+  const completeResponse = await fetch(`${uploadUrl}/complete?background=true`, { method: 'POST' })
+  if (!completeResponse.ok) {
+    throw new Error(`Upload failed: ${completeResponse.statusText}`)
+  }
+  return completeResponse.json()
+}
+
 export default function RecordConsultationPage() {
   const navigate = useNavigate()
   const [searchParams] = useSearchParams()
@@ -129,28 +212,47 @@ export default function RecordConsultationPage() {
     setErrorMessage('')
     
     try {
-      const formData = new FormData()
-      formData.append('file', file)
-      
-      let endpoint = 'http://localhost:8000/upload'
+      let job
       
-      if (consultationType === 'existing') {
-        formData.append('patient_id', selectedPatient.id)
+      if (file.size > RESUMABLE_UPLOAD_THRESHOLD) {
+        // Large recordings survive dropped connections instead of starting over
+        job = await uploadResumable(
+          file,
+          consultationType === 'existing' ? 'upload' : 'new_patient',
+          consultationType === 'existing' ? selectedPatient.id : null,
+          (fraction) => setUploadProgress(Math.round(fraction * 100))
+        )
       } else {
-        // For new patients, use the new endpoint
-        endpoint = 'http://localhost:8000/consultation/new_patient'
+        const formData = new FormData()
+        formData.append('file', file)
+        
+        let endpoint = 'http://localhost:8000/upload'
+        
+        if (consultationType === 'existing') {
+          formData.append('patient_id', selectedPatient.id)
+        } else {
+          // For new patients, use the new endpoint
+          endpoint = 'http://localhost:8000/consultation/new_patient'
+        }
+        
+        // Long recordings are processed as a background job so the request doesn't hang
+        const response = await fetch(`${endpoint}?background=true`, {
+          method: 'POST',
+          body: formData,
+        })
+        
+        if (!response.ok) {
+          throw new Error(`Upload failed: ${response.statusText}`)
+        }
+        
+        job = await response.json()
       }
       
-      const response = await fetch(endpoint, {
-        method: 'POST',
-        body: formData,
+      setUploadProgress(0)
+      setUploadStatus('processing')
+      const result = await waitForJob(job.job_id, (status) => {
+        setUploadProgress(Math.round(status.progress * 100))
       })
-      
-      if (!response.ok) {
-        throw new Error(`Upload failed: ${response.statusText}`)
-      }
-      
-      const result = await response.json()
       setTranscriptionResult(result)
       setUploadStatus('completed')
       